@@ -0,0 +1,484 @@
+# Timing benchmarks for the hot paths of lc_lmfit and swift_scrape. Run with: python benchmarks.py
+# The regression suite runs with: python benchmarks.py suite --save baseline.json (once) and then
+# python benchmarks.py suite --compare baseline.json, which exits with status 1 on a regression.
+# The cold-start import budgets (IMPORT_BUDGETS) are checked by tests/test_imports.py.
+
+import argparse
+import contextlib
+import glob
+import http.server
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import timeit
+import numpy as np
+import lmfit as lm
+import lc_lmfit
+import lc_store
+import swift_scrape
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis_notebooks')
+# cold-start import budgets in seconds (NumPy included), and the modules these imports must not load
+IMPORT_BUDGETS = {'lc_lmfit': 0.3, 'swift_scrape': 0.4}
+HEAVY_MODULES = ('lmfit', 'scipy', 'emcee', 'pandas', 'astropy', 'matplotlib')
+
+
+def _nbroken_law_append(x, breaks, alphas, amplitude):
+    '''
+    Previous np.append based implementation of lc_lmfit.nbroken_law, kept as a reference.
+    '''
+    breaks = list(breaks) + [np.max(x)]
+    n_seg = len(alphas)
+    x_seg = x[np.where(x<=breaks[0])]**(-alphas[0])
+    scaling_factors = 1
+    for i in range(1,n_seg):
+        x_chunk = x[np.where((x>=breaks[i-1])&(x<=breaks[i]))]
+        scaling_factors = scaling_factors * breaks[i-1]**(alphas[i]-alphas[i-1])
+        x_seg = np.append(x_seg,scaling_factors * x_chunk**(-alphas[i]))
+    return amplitude * (breaks[0])**(alphas[0]) * x_seg
+
+
+def _best_time(func, repeat=5, number=None):
+    '''
+    Best time per call (in seconds) of func over several repeats.
+    '''
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def synthetic_curve(n_points, n_breaks, seed=0):
+    '''
+    Log-spaced times and a random n-broken power law configuration for benchmarking.
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.logspace(1, 6, n_points)
+    breaks = np.sort(10**rng.uniform(1.5, 5.5, n_breaks))
+    alphas = rng.uniform(-0.5, 3., n_breaks+1)
+    return x, breaks, alphas
+
+
+def bench_nbroken_law(points=(10**2, 10**3, 10**4, 10**5, 10**6), n_breaks=(1, 2, 4, 8, 16)):
+    '''
+    Time nbroken_law (with and without an out= buffer) against the np.append implementation,
+    scanning the number of points at 2 breaks and the number of breaks at 10^4 points.
+    Returns:
+        list : rows of (n_points, n_breaks, t_append, t_nbroken, t_nbroken_out) in seconds
+    '''
+    configs = [(n, 2) for n in points] + [(10**4, b) for b in n_breaks]
+    rows = []
+    for n_points, n_brk in configs:
+        x, breaks, alphas = synthetic_curve(n_points, n_brk)
+        out = np.empty_like(x)
+        t_old = _best_time(lambda: _nbroken_law_append(x, breaks, alphas, 1e-10))
+        t_new = _best_time(lambda: lc_lmfit.nbroken_law(x, breaks, alphas, 1e-10))
+        t_out = _best_time(lambda: lc_lmfit.nbroken_law(x, breaks, alphas, 1e-10, out=out))
+        rows.append((n_points, n_brk, t_old, t_new, t_out))
+    return rows
+
+
+def _finite_difference_jacobian(cost_func, params, args, rel_step=1e-6):
+    '''
+    Central finite-difference jacobian of cost_func over the varying parameters.
+    '''
+    columns = []
+    for name in [name for name, par in params.items() if par.vary]:
+        step = rel_step * (abs(params[name].value) or 1.)
+        upper, lower = params.copy(), params.copy()
+        upper[name].value += step
+        lower[name].value -= step
+        columns.append((cost_func(upper, *args) - cost_func(lower, *args)) / (2*step))
+    return np.column_stack(columns)
+
+
+def bench_jacobians(n_points=300, seed=0):
+    '''
+    Fit a noisy broken and a double broken power law with method='least_squares', with and
+    without the analytic jacobians, and check those jacobians against finite differences.
+    Returns:
+        list : rows of (cost function, max relative jacobian error, nfev, nfev with jac, t, t with jac)
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.sort(10**rng.uniform(1, 5, n_points))
+    x_err = np.ones(n_points)
+    y_bpl = lc_lmfit.broken_power_law(x, 500., 0.2, 1.8, 1e-11)
+    y_dbl = lc_lmfit.double_broken_law(x, 100., 3e3, 0.1, 1.2, 2.5, 1e-11)
+    configs = [(lc_lmfit.cost_func_bpl, lc_lmfit.jac_func_bpl, y_bpl,
+                dict(t_break=(200., 10., 1e4), alpha_1=(0., -1., 1.), alpha_2=(1., 0., 4.), amplitude=(1e-11, 1e-14, 1e-9))),
+               (lc_lmfit.cost_func_dbl, lc_lmfit.jac_func_dbl, y_dbl,
+                dict(tb0=(50., 10., 1e3), tb1=(1e4, 1e3, 1e5), alpha_0=(0., -1., 1.), alpha_1=(1., 0., 4.),
+                     alpha_2=(2., 0., 4.), amplitude=(1e-11, 1e-14, 1e-9)))]
+    rows = []
+    for cost_func, jac_func, y_true, init in configs:
+        y_err = 0.1 * y_true
+        args = (x, y_true + y_err*rng.standard_normal(n_points), x_err, y_err)
+        params = lm.Parameters()
+        for name, (value, lower, upper) in init.items():
+            params.add(name, value=value, min=lower, max=upper)
+        fd_jac = _finite_difference_jacobian(cost_func, params, args)
+        jac_err = np.max(np.abs(jac_func(params, *args) - fd_jac) / np.abs(fd_jac).max(axis=0))
+        fit = lambda **kws: lm.minimize(cost_func, params, args=args, method='least_squares', **kws)
+        nfev, nfev_jac = fit().nfev, fit(jac=jac_func).nfev
+        t_fit = _best_time(fit, repeat=3, number=1)
+        t_jac = _best_time(lambda: fit(jac=jac_func), repeat=3, number=1)
+        rows.append((cost_func.__name__, jac_err, nfev, nfev_jac, t_fit, t_jac))
+    return rows
+
+
+def bench_log_residuals(points=(10**2, 10**3, 10**4, 10**5, 10**6), n=3):
+    '''
+    Time cost_func_nbpl in linear and in log space (log=True, with log10(time) computed once per dataset).
+    Returns:
+        list : rows of (n_points, t_linear, t_log) in seconds per call
+    '''
+    rows = []
+    for n_points in points:
+        x, breaks, alphas = synthetic_curve(n_points, n-1)
+        y = lc_lmfit.nbroken_law(x, breaks, alphas, 1e-10)
+        data = lc_lmfit.FitData((x, np.ones(n_points), np.ones(n_points), y, 0.05*y, 0.05*y), log=True)
+        params = lm.Parameters()
+        for i, tb in enumerate(breaks):
+            params.add("tb"+str(i), value=tb)
+        for i, alpha in enumerate(alphas):
+            params.add("alpha_"+str(i), value=alpha)
+        params.add("amplitude", value=1e-10)
+        t_lin = _best_time(lambda: lc_lmfit.cost_func_nbpl(params, x, y, 1., 0.1*y, n))
+        t_log = _best_time(lambda: lc_lmfit.cost_func_nbpl(params, *data.args, n, log=True))
+        rows.append((n_points, t_lin, t_log))
+    return rows
+
+
+def _read_qdp_append(lines):
+    '''
+    Previous per-line np.append QDP reader of swift_scrape, kept as a reference.
+    '''
+    Time, Tpos, Tneg, Flux, Fpos, Fneg = [], [], [], [], [], []
+    for line in lines:
+        if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0][0] != '!':
+            Time = np.append(Time,float(line.split()[0]))
+            Tpos = np.append(Tpos,float(line.split()[1]))
+            Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
+            Flux = np.append(Flux,float(line.split()[3]))
+            Fpos = np.append(Fpos,float(line.split()[4]))
+            Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
+    return Time, Tpos, Tneg, Flux, Fpos, Fneg
+
+
+def qdp_lines(rows, separator_every=200):
+    '''
+    Lines of a Swift-style QDP file (READ/comment/header lines and NO separators) holding rows.
+    '''
+    lines = ['READ TERR 1 2', 'READ SERR 3', '!Time\tT_+ve\tT_-ve\tFlux\tFluxpos\tFluxneg']
+    for i, row in enumerate(rows):
+        if i and i % separator_every == 0:
+            lines.append('NO\tNO\tNO\tNO\tNO\tNO')
+        lines.append('\t'.join(repr(float(v)) for v in row))
+    return lines
+
+
+def bench_qdp(synthetic_rows=(10**4, 10**5, 10**6), max_append_rows=2*10**4):
+    '''
+    Time swift_scrape.read_qdp against the np.append reader on QDP versions of the
+    afterglow_data light curves and on synthetic files (the quadratic np.append reader is
+    skipped above max_append_rows rows).
+    Returns:
+        list : rows of (source, n_rows, t_append, t_read_qdp) in seconds
+    '''
+    sources = []
+    for filename in sorted(glob.glob(os.path.join(DATA_DIR, 'EE_sGRB', 'afterglow_data', '*_xray_batxrt.txt'))):
+        sources.append((os.path.basename(filename).split('_')[0], np.loadtxt(filename, skiprows=1, ndmin=2)))
+    rng = np.random.default_rng(0)
+    for n_rows in synthetic_rows:
+        sources.append(('synthetic', rng.uniform(1e-12, 1e3, (n_rows, 6))))
+    rows = []
+    for name, values in sources:
+        lines = qdp_lines(values)
+        t_old = _best_time(lambda: _read_qdp_append(lines), repeat=3) if len(values) <= max_append_rows else np.nan
+        t_new = _best_time(lambda: swift_scrape.read_qdp(lines), repeat=3)
+        rows.append((name, len(values), t_old, t_new))
+    return rows
+
+
+def fixture_files(filenames):
+    '''
+    UKSSDC-style files for a local HTTP stub of swift.ac.uk: the GRB list, the XRT flux.qdp and
+    the burst analyser tarball (its rows split into BAT, WT and PC thirds) of every
+    *_xray_batxrt.txt light curve in filenames.
+    Returns:
+        dict : url path -> file content (bytes)
+    '''
+    files, grbs = {}, []
+    for k, filename in enumerate(filenames):
+        GRB, tID = os.path.basename(filename).split('_')[0], '{:08d}'.format(30000+k)
+        grbs.append('{} {} {}'.format(GRB, GRB, int(tID)))
+        values = np.loadtxt(filename, skiprows=1, ndmin=2) * [1, 1, -1, 1, 1, -1]   # negative errors, as in the real files
+        files['/xrt_curves/'+tID+'/flux.qdp'] = '\n'.join(qdp_lines(values)).encode()
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for name, rows in zip(('bat/bat_flux_snr4_XRTBAND_NOEVOLVE.qdp', 'xrt/xrt_flux_wt_XRTBAND_nosys.qdp', 'xrt/xrt_flux_pc_XRTBAND_nosys.qdp'),
+                                  np.array_split(values, 3)):
+                content = '\n'.join(qdp_lines(rows)).encode()
+                member = tarfile.TarInfo(tID+'/'+name)
+                member.size = len(content)
+                tar.addfile(member, io.BytesIO(content))
+        files['/burst_analyser/'+tID+'/batxrtfiles_'+tID+'.tar'] = buffer.getvalue()
+    files['/xrt_curves/grb.list'] = ('\n'.join(grbs)+'\n').encode()
+    return files
+
+
+def serve_fixtures(files):
+    '''
+    Serve files (see fixture_files) over keep-alive HTTP from a background thread. A file may also
+    be a list of responses (status, headers dict, body), served in turn (the last one repeatedly),
+    e.g. to test retries. Unknown paths are answered with 404.
+    Returns:
+        tuple : (server, base url); point swift_scrape.SWIFT_URL at the url and call server.shutdown() when done.
+                server.requests lists the (path, time.monotonic()) of every request
+    '''
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with lock:
+                server.requests.append((self.path, time.monotonic()))
+                body = files.get(self.path)
+                status, headers = (200, {}) if body is not None else (404, {})
+                if isinstance(body, list):
+                    status, headers, body = body.pop(0) if len(body) > 1 else body[0]
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body or b'')))
+            self.end_headers()
+            self.wfile.write(body or b'')
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+def _model_cases(points):
+    cases = {}
+    for n_points in points:
+        x, breaks, alphas = synthetic_curve(n_points, 3)
+        y = lc_lmfit.nbroken_law(x, breaks, alphas, 1e-10)
+        y_err = 0.1*y
+        params = lm.Parameters()
+        for name, value in [('t_break', breaks[0]), ('tb0', breaks[0]), ('tb1', breaks[1]), ('tb2', breaks[2]), ('alpha_1', alphas[1]),
+                            ('alpha_2', alphas[2]), ('alpha_0', alphas[0]), ('alpha_3', alphas[3]), ('amplitude', 1e-10)]:
+            params.add(name, value=value)
+        log_args = lc_lmfit.FitData((x, x, x, y, y_err, y_err), log=True).args
+        theta = np.array([1e3, 0., 1.5, 1e-12])   # inside the prior box of lc_lmfit.lnprior
+        suffix = '[{}]'.format(n_points)
+        cases.update({
+            'power_law'+suffix: lambda x=x: lc_lmfit.power_law(x, 1.2, 1e-10),
+            'broken_power_law'+suffix: lambda x=x, b=breaks, a=alphas: lc_lmfit.broken_power_law(x, b[0], a[0], a[1], 1e-10),
+            'double_broken_law'+suffix: lambda x=x, b=breaks, a=alphas: lc_lmfit.double_broken_law(x, b[0], b[1], a[0], a[1], a[2], 1e-10),
+            'triple_broken_law'+suffix: lambda x=x, b=breaks, a=alphas: lc_lmfit.triple_broken_law(x, b[0], b[1], b[2], a[0], a[1], a[2], a[3], 1e-10),
+            'nbroken_law'+suffix: lambda x=x, b=breaks, a=alphas: lc_lmfit.nbroken_law(x, b, a, 1e-10),
+            'cost_func_pl'+suffix: lambda p=params, args=(x, y, x, y_err): lc_lmfit.cost_func_pl(p, *args),
+            'cost_func_bpl'+suffix: lambda p=params, args=(x, y, x, y_err): lc_lmfit.cost_func_bpl(p, *args),
+            'cost_func_dbl'+suffix: lambda p=params, args=(x, y, x, y_err): lc_lmfit.cost_func_dbl(p, *args),
+            'cost_func_nbpl'+suffix: lambda p=params, args=(x, y, x, y_err): lc_lmfit.cost_func_nbpl(p, *args, 4),
+            'cost_func_nbpl_log'+suffix: lambda p=params, args=log_args: lc_lmfit.cost_func_nbpl(p, *args, 4, log=True),
+            'lnprob'+suffix: lambda t=theta, args=(x, y, y_err): lc_lmfit.lnprob(t, *args),
+        })
+    return cases
+
+
+def _file_cases():
+    afterglows = sorted(glob.glob(os.path.join(DATA_DIR, 'EE_sGRB', 'afterglow_data', '*_xray_batxrt.txt')))
+    fxrts = sorted(glob.glob(os.path.join(DATA_DIR, 'fxrt', 'data', '*.txt')))
+    qdps = [qdp_lines(np.loadtxt(filename, skiprows=1, ndmin=2)) for filename in afterglows]
+    return {
+        'get_individual_curves_log[afterglow_data]': lambda: [lc_lmfit.get_individual_curves_log(f) for f in afterglows],
+        'read_text_curve[fxrt/data]': lambda: [lc_store.read_text_curve(f, 'fxrt') for f in fxrts],
+        'read_qdp[afterglow_data]': lambda: [swift_scrape.read_qdp(lines) for lines in qdps],
+    }
+
+
+def _scrape_cases(loc):
+    afterglows = sorted(glob.glob(os.path.join(DATA_DIR, 'EE_sGRB', 'afterglow_data', '*_xray_batxrt.txt')))
+    GRBs = [os.path.basename(f).split('_')[0] for f in afterglows]
+    def fetch_all(func):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for GRB in GRBs:
+                    func(GRB, loc, uselocal=False)
+        return run
+    return {
+        'get_xrt[stub]': fetch_all(swift_scrape.get_xrt),
+        'get_batxrt[stub]': fetch_all(swift_scrape.get_batxrt),
+    }
+
+
+def import_profile(statement, repeat=3):
+    '''
+    Run statement in fresh interpreters with -X importtime.
+    Returns:
+        tuple : (cumulative import time in seconds of each top-level import of the fastest run,
+                 names of all modules it imported)
+    '''
+    best = None
+    for _ in range(repeat):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stderr
+        times, modules = {}, set()
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules.add(name.strip())
+            if not name.startswith('  '):
+                times[name.strip()] = int(cumulative)*1e-6
+        if best is None or sum(times.values()) < sum(best[0].values()):
+            best = (times, modules)
+    return best
+
+
+def check_imports(budgets=IMPORT_BUDGETS, heavy=HEAVY_MODULES):
+    '''
+    Check the cold-start import time of each module in budgets, and that importing lc_lmfit and
+    evaluating a model loads none of the heavy dependencies.
+    Returns:
+        tuple : (rows of (module, seconds, budget, heavy modules loaded, flag), names of the failed modules)
+    '''
+    rows, failed = [], []
+    for module, budget in budgets.items():
+        statement = 'import {0}'.format(module)
+        if module == 'lc_lmfit':
+            statement += '; import numpy; lc_lmfit.nbroken_law(numpy.logspace(1, 5), [1e2, 1e3], [0.5, 1., 2.], 1.)'
+        times, modules = import_profile(statement)
+        loaded = sorted(name for name in heavy if name in modules)
+        flag = 'OVER BUDGET' if times.get(module, 0) > budget else ''
+        if module == 'lc_lmfit' and loaded:
+            flag = (flag + ' HEAVY IMPORTS').strip()
+        if flag:
+            failed.append(module)
+        rows.append((module, times.get(module, np.nan), budget, ','.join(loaded) or '-', flag))
+    return rows, failed
+
+
+def run_suite(points=(10**2, 10**3, 10**4, 10**5, 10**6), pattern='', repeat=5):
+    '''
+    Time every case of the regression suite: the model functions, every cost function and lnprob
+    on synthetic light curves of each size in points, the light curve readers on the afterglow_data
+    and fxrt/data files, and the QDP paths of swift_scrape, fed through a local HTTP stub
+    (see serve_fixtures). Only cases whose name contains pattern are run.
+    Returns:
+        dict : case name -> best time per call in seconds
+    '''
+    afterglows = sorted(glob.glob(os.path.join(DATA_DIR, 'EE_sGRB', 'afterglow_data', '*_xray_batxrt.txt')))
+    server, url = serve_fixtures(fixture_files(afterglows))
+    old_url, swift_scrape.SWIFT_URL = swift_scrape.SWIFT_URL, url
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            loc = tmp + '/'
+            with contextlib.redirect_stdout(io.StringIO()):
+                swift_scrape.get_targetIDs(loc)
+            cases = _model_cases(points)
+            cases.update(_file_cases())
+            cases.update(_scrape_cases(loc))
+            return {name: _best_time(func, repeat=repeat) for name, func in cases.items() if pattern in name}
+    finally:
+        swift_scrape.SWIFT_URL = old_url
+        server.shutdown()
+
+
+def save_baseline(filename, results):
+    with open(filename, 'w') as f:
+        json.dump({'python': sys.version.split()[0], 'numpy': np.__version__, 'machine': platform.platform(),
+                   'results': results}, f, indent=1)
+
+
+def compare_baseline(filename, results, tolerance=1.25):
+    '''
+    Compare suite results with a saved baseline. A case regressed if it takes more than
+    tolerance times its baseline time.
+    Returns:
+        tuple : (rows of (case, baseline, current, ratio, flag), names of the regressed cases)
+    '''
+    with open(filename) as f:
+        baseline = json.load(f)['results']
+    rows, regressed = [], []
+    for name, current in results.items():
+        old = baseline.get(name, np.nan)
+        ratio = current/old
+        flag = 'REGRESSED' if ratio > tolerance else ('faster' if ratio < 1/tolerance else '')
+        if flag == 'REGRESSED':
+            regressed.append(name)
+        rows.append((name, old, current, ratio, flag))
+    return rows, regressed
+
+
+def print_table(title, header, rows):
+    print(title)
+    print(''.join('{:>14}'.format(h) for h in header))
+    for row in rows:
+        print(''.join('{:>14.4g}'.format(v) if isinstance(v, float) else '{:>14}'.format(v) for v in row))
+    print()
+
+
+def print_tables():
+    print_table('nbroken_law (seconds per call)',
+                ('n_points', 'n_breaks', 'np.append', 'searchsorted', 'with out='),
+                bench_nbroken_law())
+    print_table('least_squares fits with analytic jacobians',
+                ('cost function', 'jac rel. err', 'nfev', 'nfev (jac)', 'time', 'time (jac)'),
+                bench_jacobians())
+    print_table('cost_func_nbpl residuals (seconds per call)',
+                ('n_points', 'linear', 'log space'),
+                bench_log_residuals())
+    print_table('QDP parsing (seconds per file)',
+                ('source', 'n_rows', 'np.append', 'read_qdp'),
+                bench_qdp())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Timing benchmarks of lc_lmfit and swift_scrape.")
+    parser.add_argument("mode", nargs="?", default="tables", choices=("tables", "suite"),
+                        help="comparison tables against the previous implementations, or the regression suite")
+    parser.add_argument("--save", help="suite: write the results as a baseline json file")
+    parser.add_argument("--compare", help="suite: compare with a baseline json file, exit status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="suite: slowdown factor counted as a regression")
+    parser.add_argument("-k", "--pattern", default="", help="suite: only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="suite: number of timing repeats per case")
+    args = parser.parse_args(argv)
+
+    if args.mode == "tables":
+        print_tables()
+        return 0
+    import_rows, _ = check_imports()
+    print_table('cold-start imports (seconds)', ('module', 'time', 'budget', 'heavy', ''), import_rows)
+    results = run_suite(pattern=args.pattern, repeat=args.repeat)
+    if args.save:
+        save_baseline(args.save, results)
+    if not args.compare:
+        for name, seconds in results.items():
+            print('{:<45}{:>14.4g}'.format(name, seconds))
+        return 0
+    rows, regressed = compare_baseline(args.compare, results, args.tolerance)
+    print('{:<45}{:>14}{:>14}{:>10}  '.format('case', 'baseline', 'current', 'ratio'))
+    for name, old, current, ratio, flag in rows:
+        print('{:<45}{:>14.4g}{:>14.4g}{:>10.3f}  {}'.format(name, old, current, ratio, flag))
+    if regressed:
+        print('{} of {} cases regressed by more than a factor {}'.format(len(regressed), len(rows), args.tolerance))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# Parallel fitting of whole catalogues of light curves with the cost functions of lc_lmfit.
+# Usage: python catalogue.py manifest.json -o fit_parameters.csv [--workers N] [--timeout SECONDS]
+#        python catalogue.py manifest.json -o fit_parameters.csv --hierarchical alpha_2 [--shared alpha_1]
+
+import argparse
+import json
+import os
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import lmfit as lm
+import pandas as pd
+import lc_lmfit
+import lc_store
+import instrument
+
+# model name -> (cost function, jacobian), see lc_lmfit
+MODELS = {
+    "pl": (lc_lmfit.cost_func_pl, lc_lmfit.jac_func_pl),
+    "bpl": (lc_lmfit.cost_func_bpl, lc_lmfit.jac_func_bpl),
+    "dbl": (lc_lmfit.cost_func_dbl, lc_lmfit.jac_func_dbl),
+    "nbpl": (lc_lmfit.cost_func_nbpl, lc_lmfit.jac_func_nbpl),
+}
+
+
+def read_manifest(filename):
+    '''
+    Read a JSON catalogue manifest. It has the form
+        {"name_column": "FXRT_Name", "start_column": "time_plt_start",
+         "sources": [{"name": "FXRT_1", "file": "data/FXRT_1_LC_log.txt", "format": "fxrt",
+                      "model": "bpl", "window": [0, 1e3], "exclude": [4, 6, 7],
+                      "params": {"t_break": [200, 50, 300], "alpha_1": [0.5, 0, 5], ...}}, ...]}
+    where params maps each parameter to [value, min, max], "model" is one of MODELS ("nbpl"
+    also needs "n"), "format" is "batxrt" (swift_scrape output, the default) or "fxrt"
+    (whitespace separated, no header), and "window", "exclude" and "method" are optional. An
+    optional "rebin" dict combines the points in the window into adaptive log-time bins before
+    fitting (keyword arguments of lc_lmfit.rebin_log, e.g. {"snr": 20}).
+    For "nbpl" sources "params" may be left out: the fit then starts from a global sweep over the
+    break times (see lc_lmfit.global_fit, with the optional "global" dict as keyword arguments).
+    An optional top-level "store" names a light curve store (see lc_store) to read the
+    sources from instead of their text files, and an optional top-level "cache" a directory of
+    cached fit results (see lc_lmfit.FitCache), so that only the sources whose data, model, bounds
+    or starting values changed are refitted. Relative paths are taken relative to the manifest.
+    Returns:
+        dict : the manifest, with absolute file paths
+    '''
+    with open(filename) as f:
+        manifest = json.load(f)
+    folder = os.path.dirname(os.path.abspath(filename))
+    for source in manifest["sources"]:
+        source["file"] = os.path.join(folder, source["file"])
+    for name in ("store", "cache"):
+        if name in manifest:
+            manifest[name] = os.path.join(folder, manifest[name])
+    return manifest
+
+
+def load_curve(filename, format="batxrt", store=None):
+    '''
+    Load a light curve in either of the layouts of the analysis_notebooks data folders
+    (see lc_store.read_text_curve), or from a light curve store.
+    Returns:
+        tuple : (time,time_high,time_low,flux,flux_high,flux_low), as get_individual_curves_log
+    '''
+    if store is not None:
+        return lc_lmfit.get_individual_curves_log(filename, store=store)
+    return lc_store.read_text_curve(filename, format)
+
+
+class _Deadline:
+    # iteration callback that aborts a fit after timeout seconds (a class, so that it can be sent to workers)
+    def __init__(self, timeout):
+        self.deadline = timer.monotonic() + timeout
+
+    def __call__(self, *args, **kws):
+        return timer.monotonic() > self.deadline
+
+
+def load_source(source, store=None, rebin=True):
+    '''
+    FitData of a manifest source (see read_manifest and lc_lmfit.fit_data): the points in its
+    window, less the excluded ones, combined into log-time bins if it has a "rebin" dict and rebin
+    is set. store is the light curve store to read it from, by default the source's "store".
+    '''
+    data = lc_lmfit.fit_data(source["file"], window=source.get("window", (-np.inf, np.inf)), exclude=source.get("exclude", ()),
+                             store=source.get("store") if store is None else store, format=source.get("format", "batxrt"))
+    if rebin and "rebin" in source:
+        data = data.rebinned(**source["rebin"])
+    return data
+
+
+def fit_source(source, timeout=None):
+    '''
+    Fit a single manifest entry. A fit running longer than timeout seconds is aborted.
+    Returns:
+        dict : name, status ('ok', 'timeout' or the error message), best fit values,
+               their standard errors (as <param>_err) and the time and error of the first fitted point
+    '''
+    with instrument.timed("source", name=source["name"]) as record:
+        row = _fit_source(source, timeout)
+        record.add(status=row["status"])
+    return row
+
+
+def _fit_source(source, timeout):
+    row = {"name": source["name"]}
+    try:
+        data = load_source(source)
+        args = data.args
+        if source["model"] == "nbpl":
+            args = args + (source["n"],)
+        cost_func, jac_func = MODELS[source["model"]]
+        iter_cb = None if timeout is None else _Deadline(timeout)
+        if "params" not in source:
+            if source["model"] != "nbpl":
+                raise ValueError('"params" can only be left out for model "nbpl"')
+            fit = lambda: lc_lmfit.global_fit(*args, iter_cb=iter_cb, **source.get("global", {}))[1][0]
+            if source.get("cache"):
+                cache = lc_lmfit.FitCache(source["cache"])
+                config = dict(window=source.get("window"), exclude=source.get("exclude"), rebin=source.get("rebin"), **source.get("global", {}))
+                result = cache.fetch(cache.key("global_fit", None, args, **config), fit, "global_fit")
+            else:
+                result = fit()
+        else:
+            params = lm.Parameters()
+            for name, (value, lower, upper) in source["params"].items():
+                params.add(name, value=value, min=lower, max=upper)
+
+            method = source.get("method", "least_squares")
+            fit_kws = {}
+            if method == "least_squares":
+                fit_kws["jac"] = jac_func
+            elif method == "leastsq":
+                fit_kws["Dfun"] = jac_func
+            if source.get("cache"):
+                config = dict(window=source.get("window"), exclude=source.get("exclude"), rebin=source.get("rebin"))
+                result = lc_lmfit.FitCache(source["cache"]).minimize(cost_func, params, args=args, method=method, config=config,
+                                                                     iter_cb=iter_cb, **fit_kws)
+            else:
+                result = lc_lmfit.minimize(cost_func, params, args=args, method=method, iter_cb=iter_cb, **fit_kws)
+    except Exception as err:
+        row["status"] = "{}: {}".format(type(err).__name__, err)
+        return row
+
+    row["status"] = "timeout" if result.aborted else "ok"
+    row.update(result.params.valuesdict())
+    row.update({name+"_err": par.stderr for name, par in result.params.items()})
+    row["time_start"], row["time_start_err"] = data.x[0], data.x_err[0]
+    return row
+
+
+def _param_names(source):
+    if "params" in source or source.get("model") != "nbpl" or "n" not in source:
+        return list(source.get("params", ()))
+    n = source["n"]
+    return ["tb"+str(i) for i in range(n-1)] + ["alpha_"+str(i) for i in range(n)] + ["amplitude"]
+
+
+def _log_metrics(path):
+    # worker initializer: record to the metrics log only once, even if the parent's sinks were inherited
+    instrument.disable()
+    instrument.enable(log=path)
+
+
+def fit_catalogue(manifest, workers=None, timeout=None, metrics=None, cache=None):
+    '''
+    Fit every source of a manifest (see read_manifest) in a pool of worker processes.
+    Args:
+        manifest : manifest dict, or path to a manifest file
+        workers : number of worker processes (defaults to the number of CPUs)
+        timeout : per-source time limit in seconds
+        metrics : path of a JSON lines file the workers append their instrumentation records to (see instrument)
+        cache : directory of cached fit results (see lc_lmfit.FitCache), in place of the manifest's "cache"
+    Returns:
+        tuple : (table, failed). table is a pandas.DataFrame with one row per successful fit,
+                laid out as fxrt_refit_parameters.csv / eegrb_fit_parameters.csv;
+                failed maps the names of the other sources to the reason they failed
+    '''
+    if isinstance(manifest, str):
+        manifest = read_manifest(manifest)
+    shared = {name: manifest[name] for name in ("store", "cache") if name in manifest}
+    if cache is not None:
+        shared["cache"] = cache
+    sources = [dict(source, **shared) for source in manifest["sources"]]
+    pool_kws = {} if metrics is None else dict(initializer=_log_metrics, initargs=(metrics,))
+    with ProcessPoolExecutor(max_workers=workers, **pool_kws) as pool:
+        rows = list(pool.map(fit_source, sources, [timeout]*len(sources)))
+
+    failed = {row["name"]: row["status"] for row in rows if row["status"] != "ok"}
+    rows = [row for row in rows if row["status"] == "ok"]
+    param_names = list(dict.fromkeys(name for source in sources for name in _param_names(source)))
+    name_column = manifest.get("name_column", "name")
+    start_column = manifest.get("start_column", "time_fit_start")
+    columns = [name_column] + param_names + [name+"_err" for name in param_names] + [start_column, start_column+"_err"]
+    table = pd.DataFrame(rows, columns=["name"] + columns[1:-2] + ["time_start", "time_start_err"])
+    table.columns = columns
+    return table, failed
+
+
+def fit_population(manifest, shared=(), hierarchical=("alpha_2",), tau=None, **joint_kws):
+    '''
+    Fit all "bpl" sources of a manifest jointly, with shared and hierarchical parameters (see
+    lc_lmfit.joint_fit), in place of independent fits combined afterwards. The starting values and
+    bounds of each source are taken from its "params", where given.
+    Returns:
+        tuple : (table, population, failed). table is laid out as fit_catalogue's, population is the
+                dict of population parameters of lc_lmfit.joint_fit and failed maps the names of the
+                sources that were left out to the reason
+    '''
+    if isinstance(manifest, str):
+        manifest = read_manifest(manifest)
+    names, curves, init, bounds, starts, failed = [], [], [], [], [], {}
+    for source in manifest["sources"]:
+        try:
+            if source["model"] != "bpl":
+                raise ValueError('joint fits take "bpl" sources only')
+            data = load_source(source, manifest.get("store"))
+        except Exception as err:
+            failed[source["name"]] = "{}: {}".format(type(err).__name__, err)
+            continue
+        params = source.get("params", {})
+        names.append(source["name"])
+        curves.append(data.args)
+        start = {name: value for name, (value, lower, upper) in params.items()}
+        init.append(start if set(start) >= set(lc_lmfit.BPL_PARAMS) else None)
+        bounds.append({name: (lower, upper) for name, (value, lower, upper) in params.items()})
+        starts.append((data.x[0], data.x_err[0]))
+    table, population = lc_lmfit.joint_fit(curves, shared=shared, hierarchical=hierarchical, tau=tau,
+                                           init=init, bounds=bounds, **joint_kws)
+
+    param_names = list(lc_lmfit.BPL_PARAMS)
+    name_column = manifest.get("name_column", "name")
+    start_column = manifest.get("start_column", "time_fit_start")
+    table = table[param_names + [name+"_err" for name in param_names]]
+    table.insert(0, name_column, names)
+    table[start_column], table[start_column+"_err"] = np.array(starts).reshape(-1, 2).T
+    return table, population, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit every light curve of a catalogue manifest in parallel.")
+    parser.add_argument("manifest", help="JSON manifest of sources, models, bounds and fit windows")
+    parser.add_argument("-o", "--output", default="fit_parameters.csv", help="output parameter table (csv)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-t", "--timeout", type=float, default=None, help="per-source time limit in seconds")
+    parser.add_argument("-m", "--metrics", default=None, help="append instrumentation records (JSON lines) to this file")
+    parser.add_argument("-c", "--cache", default=None, help="directory of cached fit results; unchanged sources are not refitted")
+    parser.add_argument("--shared", action="append", default=[], help="fit the bpl sources jointly, with one value of this parameter (repeatable)")
+    parser.add_argument("--hierarchical", action="append", default=[], help="fit the bpl sources jointly, with this parameter drawn from a population distribution (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.shared or args.hierarchical:
+        table, population, failed = fit_population(args.manifest, shared=args.shared, hierarchical=args.hierarchical)
+        print("Population: " + ", ".join("{}={:.4g}".format(name, value) for name, value in population.items()))
+    else:
+        table, failed = fit_catalogue(args.manifest, workers=args.workers, timeout=args.timeout, metrics=args.metrics, cache=args.cache)
+    table.to_csv(args.output, index=False)
+    print("Fitted {} sources, parameters written to {}".format(len(table), args.output))
+    for name, reason in failed.items():
+        print("Fit failed for {}: {}".format(name, reason))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# File handling shared by the on-disk caches (lc_lmfit.FitCache and swift_scrape.ProductCache):
+# atomic writes, so that concurrent workers never read a half-written file, and LRU eviction.
+
+import glob
+import os
+import tempfile
+
+
+def atomic_write(path, write, mode='wb'):
+    '''
+    Call write(f) on a temporary file in the directory of path, opened with mode, then atomically
+    replace path with it.
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def evict_lru(pattern, max_bytes, max_entries=None, companions=None):
+    '''
+    Remove the least recently modified files matching the glob pattern until they take at most
+    max_bytes and number at most max_entries.
+    Args:
+        companions : function of a path returning the other files that belong to it (removed with
+                     it, but not counted)
+    '''
+    entries = []
+    for path in glob.glob(pattern):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # evicted by another worker
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total, count = sum(size for _, size, _ in entries), len(entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes and (max_entries is None or count <= max_entries):
+            break
+        for name in [path] + list(companions(path) if companions else ()):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+        total -= size
+        count -= 1
@@ -0,0 +1,147 @@
+# Opt-in instrumentation of swift_scrape and lc_lmfit: per-stage timings, counts and byte volumes.
+# Enable with instrument.enable(log='metrics.jsonl') and/or instrument.enable(callback=...);
+# while disabled every hook is a single flag check.
+
+import json
+import os
+import threading
+import time
+
+active = False      # True while at least one sink is enabled; checked by every hook
+_sinks = []
+_files = []
+_lock = threading.Lock()
+
+
+def enable(callback=None, log=None):
+    '''
+    Start recording. Every record is a dict with at least "stage", "time" (unix time) and "pid",
+    plus the fields of its stage:
+        http      : url, status, bytes, attempts, seconds
+        parse_qdp : segment, rows, seconds, rows_per_s
+        tar       : GRB, members, seconds
+        fit       : cost_func, method, nfev, success, seconds
+        mcmc      : walkers, steps, converged, seconds, steps_per_s
+        fit_cache : cost_func, hit (one per lc_lmfit.FitCache.fetch call)
+        source    : name, status, seconds (one per catalogue.fit_source call)
+    A stage that raised also carries "error".
+    Args:
+        callback : called with every record (in the process that made it)
+        log : path of a JSON lines file to append every record to (safe to share between processes)
+    '''
+    global active
+    with _lock:
+        if callback is not None:
+            _sinks.append(callback)
+        if log is not None:
+            f = open(log, 'a', buffering=1)
+            _files.append(f)
+            _sinks.append(lambda record: f.write(json.dumps(record, default=str) + '\n'))
+        active = bool(_sinks)
+
+
+def disable():
+    '''
+    Stop recording and close the log files.
+    '''
+    global active
+    with _lock:
+        active = False
+        del _sinks[:]
+        for f in _files:
+            f.close()
+        del _files[:]
+
+
+def emit(stage, **fields):
+    '''
+    Send one record to every sink (nothing happens while disabled).
+    '''
+    if not active:
+        return
+    record = {"stage": stage, "time": time.time(), "pid": os.getpid()}
+    record.update(fields)
+    for sink in list(_sinks):
+        sink(record)
+
+
+class _Timer:
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def add(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        self.fields["seconds"] = seconds
+        for count in ("rows", "steps"):
+            if count in self.fields and seconds > 0:
+                self.fields[count + "_per_s"] = self.fields[count] / seconds
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        emit(self.stage, **self.fields)
+        return False
+
+
+class _NullTimer:
+    def add(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage, **fields):
+    '''
+    Context manager timing a stage; further fields can be attached with .add(...). Usage:
+        with instrument.timed('parse_qdp', segment='PC') as timer:
+            ...
+            timer.add(rows=len(data))
+    '''
+    return _Timer(stage, fields) if active else _NULL_TIMER
+
+
+class Summary:
+    '''
+    Metrics callback that aggregates the records per stage: number of records, total seconds and
+    the totals of the other numeric fields (bytes, rows, nfev, steps, ...). Usage:
+        summary = instrument.Summary()
+        instrument.enable(callback=summary)
+        ...
+        print(summary.report())
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            totals = self.stages.setdefault(record["stage"], {"count": 0})
+            totals["count"] += 1
+            for name, value in record.items():
+                if name in ("time", "pid", "status") or name.endswith("_per_s") or isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float)):
+                    totals[name] = totals.get(name, 0) + value
+
+    def report(self):
+        '''
+        The totals as text, one line per stage, slowest stage first.
+        '''
+        lines = []
+        for stage, totals in sorted(self.stages.items(), key=lambda item: -item[1].get("seconds", 0)):
+            lines.append(stage + ": " + ", ".join("{}={:.4g}".format(name, value) for name, value in totals.items()))
+        return "\n".join(lines)
@@ -0,0 +1,33 @@
+# Deferred imports for the heavy optional dependencies (lmfit, scipy, emcee, pandas, astropy, ...),
+# so that importing lc_lmfit for model evaluation only pays for NumPy.
+
+import importlib
+
+
+class LazyModule:
+    '''
+    Stand-in for a module that is imported (with the normal import machinery) on first attribute
+    access; later accesses go straight to the module.
+    '''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module {!r}{}>".format(self._name, "" if self._module is None else " (imported)")
+
+
+def lazy_import(name):
+    '''
+    Return module name, imported on first attribute access instead of now. Usage:
+        lm = lazy_import("lmfit")   # instead of import lmfit as lm
+    '''
+    return LazyModule(name)
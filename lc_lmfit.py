@@ -2,28 +2,287 @@
 # Also includes some functions (not used in this project) from Jonathan's notebooks.
 
 import numpy as np
-import swift_scrape
+import lc_store
+import instrument
+import filecache
 import os
-import lmfit as lm
-import scipy as sp
-import emcee
-import math
-import pandas as pd
+import itertools
+import glob
+import hashlib
+import json
+import time as time_module
+from lazy import lazy_import
 
+__version__ = "0.1"     # as in setup.py; part of the key of every cached fit (see FitCache)
 
-def get_individual_curves_log(filename,unpack=True):
+# the model functions need only NumPy; the fitting, sampling and scraping dependencies load on first use
+swift_scrape = lazy_import("swift_scrape")
+lm = lazy_import("lmfit")
+sp = lazy_import("scipy")
+emcee = lazy_import("emcee")
+pd = lazy_import("pandas")
+futures = lazy_import("concurrent.futures")
+multiprocessing = lazy_import("multiprocessing")
+uuid = lazy_import("uuid")
+
+
+def get_individual_curves_log(filename,unpack=True,store=None):
     """ Extract light curve from .txt file
         obtained using swift_scrape.py   
     Args:
         filename : path+name
+        store : optional light curve store (lc_store.LightCurveStore or path to one) to read
+                the light curve from instead, under filename or else its lc_store.source_name.
+                The returned arrays are then read-only memory-mapped views.
     Returns:
         tuple : (time,time_perr,time_nerr,flux,flux_perr,flux_nerr). Here 
                 time_perr = time_upper_limit - time; 
                 time_nerr = time - time_lower_limit.
     """
+    if store is not None:
+        store = lc_store.open_store(store) if isinstance(store, str) else store
+        name = filename if filename in store else lc_store.source_name(filename)
+        return store[name] if unpack else store.rows(name)
     time,time_high,time_low, flux, flux_high,flux_low = np.genfromtxt(filename, delimiter='\t', unpack=unpack, skip_header=1)
     return time,time_high,time_low,flux,flux_high,flux_low
 
+class FitData:
+    '''
+    Fit window and data cleaning of one light curve, declared once and applied lazily, in place of
+    np.delete / np.where index surgery on the six arrays of get_individual_curves_log.
+    A time window on a time-ordered curve selects a slice, so the columns are views of the curve;
+    point exclusions and masks select through a boolean mask. Each column is computed on first
+    access and kept, so repeated fits (and resamples) of the same selection reuse it.
+    Args:
+        curve : (time,time_high,time_low,flux,flux_high,flux_low), as get_individual_curves_log
+        window : (t_min, t_max), keeps t_min < time < t_max
+        exclude : indices (into the full curve) of points to drop
+        mask : boolean array over the full curve, True for points to keep
+        errors : symmetrisation of the asymmetric errors, "sum" (high + low, as in the notebooks),
+                 "mean" or "max"
+        log : if True, x and y are log10(time) and log10(flux) and x_err and y_err the propagated errors
+    Usage:
+        data = FitData(get_individual_curves_log(filename), window=(4, 1e3), exclude=[4,6,7])
+        lm.minimize(cost_func_bpl, params, args=data.args)
+    '''
+    COLUMNS = ('time', 'time_high', 'time_low', 'flux', 'flux_high', 'flux_low')
+    ERRORS = {"sum": lambda high, low: high + low,
+              "mean": lambda high, low: 0.5*(high + low),
+              "max": np.maximum}
+
+    def __init__(self, curve, window=(-np.inf, np.inf), exclude=(), mask=None, errors="sum", log=False):
+        if errors not in self.ERRORS:
+            raise ValueError("errors must be one of " + ", ".join(self.ERRORS))
+        self.curve = tuple(np.asarray(column) for column in curve)
+        self.window = tuple(window)
+        self.exclude = tuple(exclude)
+        self.mask = mask
+        self.errors = errors
+        self.log = log
+        self._columns = {}
+
+    def replace(self, **changes):
+        '''
+        A FitData of the same curve with some of window, exclude, mask, errors and log changed.
+        '''
+        spec = dict(window=self.window, exclude=self.exclude, mask=self.mask, errors=self.errors, log=self.log)
+        spec.update(changes)
+        return FitData(self.curve, **spec)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self.COLUMNS + ('x', 'y', 'x_err', 'y_err', 'selection'):
+            raise AttributeError(name)
+        if name not in self._columns:
+            self._columns[name] = self._evaluate(name)
+        return self._columns[name]
+
+    def _evaluate(self, name):
+        if name == 'selection':
+            time = self.curve[0]
+            if np.all(time[1:] >= time[:-1]):
+                selection = slice(np.searchsorted(time, self.window[0], 'right'), np.searchsorted(time, self.window[1], 'left'))
+            else:
+                selection = (time > self.window[0]) & (time < self.window[1])
+            if self.exclude or self.mask is not None:
+                keep = np.zeros(len(time), dtype=bool)
+                keep[selection] = True
+                keep[list(self.exclude)] = False
+                if self.mask is not None:
+                    keep &= self.mask
+                selection = keep
+            return selection
+        if name in self.COLUMNS:
+            return self.curve[self.COLUMNS.index(name)][self.selection]
+        symmetrise = self.ERRORS[self.errors]
+        if name == 'x':
+            return np.log10(self.time) if self.log else self.time
+        if name == 'y':
+            return np.log10(self.flux) if self.log else self.flux
+        if name == 'x_err':
+            x_err = symmetrise(self.time_high, self.time_low)
+            return x_err / (self.time*np.log(10)) if self.log else x_err
+        y_err = symmetrise(self.flux_high, self.flux_low)
+        return y_err / (self.flux*np.log(10)) if self.log else y_err
+
+    def rebinned(self, **rebin_kws):
+        '''
+        A FitData of the selected points combined into adaptive log-time bins (see rebin_log for
+        snr, chi2_tol and max_dex), with the same errors and log settings.
+        '''
+        columns = tuple(getattr(self, column) for column in self.COLUMNS)
+        return FitData(rebin_log(columns, **rebin_kws), errors=self.errors, log=self.log)
+
+    @property
+    def args(self):
+        '''
+        (x, y, x_err, y_err), the data arguments of the cost functions and jacobians.
+        '''
+        return self.x, self.y, self.x_err, self.y_err
+
+    def __getstate__(self):
+        # the selected columns are cheap to rebuild, so only the curve and the declaration are pickled
+        state = self.__dict__.copy()
+        state['_columns'] = {}
+        return state
+
+_fit_data = {}  # (filename, store, format, spec) -> ((mtime, size), FitData), see fit_data
+
+def fit_data(filename, window=(-np.inf, np.inf), exclude=(), errors="sum", log=False, store=None, format="batxrt"):
+    '''
+    FitData of a light curve file (or of a source of a light curve store, see get_individual_curves_log;
+    format is that of lc_store.read_text_curve), cached per source and selection: repeated calls
+    return the same object, until the file changes.
+    '''
+    path = store if isinstance(store, str) else filename
+    key = (filename, store if isinstance(store, str) else id(store), format, tuple(window), tuple(exclude), errors, log)
+    stat = os.stat(path) if store is None or isinstance(store, str) else None
+    version = None if stat is None else (stat.st_mtime_ns, stat.st_size)
+    cached = _fit_data.get(key)
+    if cached is None or cached[0] != version:
+        if store is None:
+            curve = lc_store.read_text_curve(filename, format)
+        else:
+            curve = get_individual_curves_log(filename, store=store)
+        cached = (version, FitData(curve, window=window, exclude=exclude, errors=errors, log=log))
+        _fit_data[key] = cached
+    return cached[1]
+
+def rebin_log(curve, snr=None, chi2_tol=None, max_dex=0.1):
+    '''
+    Adaptively combine consecutive points of a merged (BAT/WT/PC) light curve in log time, so
+    that densely sampled segments cost fewer model evaluations. Points are taken in time order
+    and a bin grows until its signal-to-noise reaches snr, until adding the next point would
+    make the scatter of the bin about its mean flux exceed chi2_tol per degree of freedom, or
+    until it would span more than max_dex in log10(time). Points at time <= 0 or flux <= 0 are
+    kept as they are.
+    The flux of a bin is the inverse-variance weighted mean (with the mean of the upper and lower
+    errors as the variance), and its upper and lower errors are propagated separately with the
+    same weights. The time of a bin is where a power law through its points (slope from a
+    weighted log-log fit) equals that mean, so that bins of a steep decay are not biased; its
+    time errors reach the outer edges of the combined bins.
+    Args:
+        curve : (time,time_high,time_low,flux,flux_high,flux_low), as get_individual_curves_log
+        snr : target signal-to-noise of a bin
+        chi2_tol : largest chi^2 per degree of freedom of the points of a bin about its mean flux
+        max_dex : largest width of a bin, in dex (the times of its first and last points)
+    Returns:
+        tuple : the rebinned curve, in the layout of curve
+    '''
+    if snr is None and chi2_tol is None:
+        raise ValueError("give snr and/or chi2_tol")
+    order = np.argsort(curve[0], kind="stable")
+    time, time_high, time_low, flux, flux_high, flux_low = (np.asarray(column, dtype=float)[order] for column in curve)
+    weight = 1./(0.5*(flux_high + flux_low))**2
+    positive = (time > 0) & (flux > 0)
+    log_time = np.log10(np.where(positive, time, 1.))
+
+    starts, i, n = [], 0, len(time)
+    while i < n:
+        starts.append(i)
+        j, sw, swf, swf2 = i, weight[i], weight[i]*flux[i], weight[i]*flux[i]**2
+        while positive[i] and j+1 < n and positive[j+1] and log_time[j+1] - log_time[i] <= max_dex:
+            if snr is not None and swf/np.sqrt(sw) >= snr:
+                break
+            w, f = weight[j+1], flux[j+1]
+            if chi2_tol is not None and (swf2 + w*f*f) - (swf + w*f)**2/(sw + w) > chi2_tol*(j+1-i):
+                break
+            j, sw, swf, swf2 = j+1, sw + w, swf + w*f, swf2 + w*f*f
+        i = j+1
+
+    starts = np.array(starts, dtype=int)
+    sizes = np.diff(np.append(starts, n))
+    sw = np.add.reduceat(weight, starts)
+    new_flux = np.add.reduceat(weight*flux, starts)/sw
+    new_high = np.sqrt(np.add.reduceat((weight*flux_high)**2, starts))/sw
+    new_low = np.sqrt(np.add.reduceat((weight*flux_low)**2, starts))/sw
+
+    #local slope of every bin: weighted least squares of log10(flux) on log10(time), relative to its first point
+    dt = log_time - np.repeat(log_time[starts], sizes)
+    log_flux = np.log10(np.where(positive, flux, 1.))
+    sums = [np.add.reduceat(weight*column, starts) for column in (dt, dt*dt, log_flux, dt*log_flux)]
+    denominator = sw*sums[1] - sums[0]**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = np.where(denominator > 1e-12*sw**2, -(sw*sums[3] - sums[0]*sums[2])/denominator, 0.)
+        #the mean of t^-alpha over the bin equals t_bin^-alpha (the weighted mean log time if alpha = 0)
+        flat = np.abs(alpha) < 1e-6
+        mean_power = np.add.reduceat(weight*10**(-np.repeat(np.where(flat, 0., alpha), sizes)*dt), starts)/sw
+        offset = np.where(flat, sums[0]/sw, -np.log10(mean_power)/np.where(flat, 1., alpha))
+    new_time = np.where(sizes == 1, time[starts], 10**(log_time[starts] + offset))
+    upper = np.maximum.reduceat(time + time_high, starts)
+    lower = np.minimum.reduceat(time - time_low, starts)
+    return new_time, upper - new_time, new_time - lower, new_flux, new_high, new_low
+
+def _param_drift(old, new, old_label, new_label):
+    '''
+    pandas.DataFrame indexed by the parameters of old with their values (column old_label) and
+    those of new (new_label), the change and the change in units of the standard error of old.
+    '''
+    drift = pd.DataFrame({old_label: [par.value for par in old.values()],
+                          new_label: [new[name].value for name in old],
+                          "stderr": [par.stderr if par.stderr is not None else np.nan for par in old.values()]},
+                         index=list(old))
+    drift["change"] = drift[new_label] - drift[old_label]
+    drift["sigma"] = drift["change"] / drift.pop("stderr")
+    return drift
+
+def rebin_shift(data, cost_func, params, n=None, method="least_squares", repeat=200, **rebin_kws):
+    '''
+    Fit a light curve at full resolution and rebinned (see FitData.rebinned) and report how far the
+    parameters move and how much cheaper an evaluation of the cost function becomes. The rebinned
+    fit starts from the full resolution best fit, so that the shift is that of the optimum and
+    not a jump to another local minimum.
+    Args:
+        data : FitData of the light curve, with its fit window
+        cost_func, params : cost function (n for cost_func_nbpl) and lmfit Parameters of the fit
+        repeat : number of cost function evaluations timed
+        rebin_kws : snr, chi2_tol and max_dex, see rebin_log
+    Returns:
+        tuple : (shift, summary, rebinned). shift is a pandas.DataFrame indexed by parameter with the
+                full resolution and rebinned values, their difference and that difference in units of
+                the full resolution standard error; summary a dict with the number of points and
+                the seconds per cost function evaluation of both fits, and the speedup
+    '''
+    rebinned = data.rebinned(**rebin_kws)
+    extra = () if n is None else (n,)
+    fit_kws = _jacobian_kws(cost_func, method)
+    kws = {"log": data.log}
+    results, seconds = [], []
+    for fit in (data, rebinned):
+        args = fit.args + extra
+        results.append(minimize(cost_func, results[-1].params if results else params, args=args, kws=kws, method=method, **fit_kws))
+        start = time_module.perf_counter()
+        for _ in range(repeat):
+            cost_func(results[-1].params, *args, **kws)
+        seconds.append((time_module.perf_counter() - start)/repeat)
+    full, binned = results
+    shift = _param_drift(full.params, binned.params, "full", "rebinned")
+    summary = {"n_full": len(data), "n_rebinned": len(rebinned), "seconds_full": seconds[0],
+               "seconds_rebinned": seconds[1], "speedup": seconds[0]/seconds[1]}
+    return shift, summary, rebinned
+
 def get_y(res, n, x):
     '''
     Pass the result object from lmfit
@@ -77,67 +336,698 @@ def triple_broken_law(x, tb0, tb1, tb2, alpha_0, alpha_1, alpha_2, alpha_3, ampl
     x_return = np.concatenate((x0, x1, x2, x3))
     return amplitude * x_return
 
-def nbroken_law(x, breaks, alphas, amplitude):
+def _nbroken_offsets(breaks, alphas, pivot):
+    '''
+    Cumulative log-space normalisation of each segment of the n-broken power law,
+    such that log(y/amplitude) = offsets[..., i] - alphas[..., i]*log(x) on segment i.
+    Works on a single parameter set or on a batch stacked along the leading axis.
+    '''
+    log_breaks = np.log(breaks[..., :alphas.shape[-1]-1])
+    offsets = np.empty(alphas.shape)
+    offsets[..., 0] = alphas[..., 0]*np.log(pivot)
+    offsets[..., 1:] = offsets[..., :1] + np.cumsum(np.diff(alphas, axis=-1)*log_breaks, axis=-1)
+    return offsets
+
+def nbroken_law(x, breaks, alphas, amplitude, out=None):
     '''
     Calculate the n-broken power law function.
+
+    Segments are assigned with np.searchsorted (x <= breaks[0] is segment 0,
+    breaks[0] < x <= breaks[1] is segment 1, ...) and evaluated in a single pass,
+    so x need not be sorted and neither x nor breaks is modified.
+    Args:
+        x : times at which to evaluate the model
+        breaks : the len(alphas)-1 break times, in increasing order
+        alphas : the slope of each segment
+        amplitude : flux at breaks[0] (at max(x) for a single segment)
+        out : optional preallocated float array of the shape of x to write into
+    Returns:
+        array : model flux at x (out, if given)
     '''
-    breaks.append(np.max(x))
-    n_seg = len(alphas)
-    x_seg = x[np.where(x<=breaks[0])]**(-alphas[0])
-    scaling_factors = 1
-    for i in range(1,n_seg):
-        x_chunk = x[np.where((x>=breaks[i-1])&(x<=breaks[i]))]
-        scaling_factors = scaling_factors * breaks[i-1]**(alphas[i]-alphas[i-1])
-        x_seg = np.append(x_seg,scaling_factors * x_chunk**(-alphas[i]))
-    return amplitude * (breaks[0])**(alphas[0]) * x_seg
+    x = np.asarray(x, dtype=float)
+    breaks = np.asarray(breaks, dtype=float)
+    alphas = np.asarray(alphas, dtype=float)
+    pivot = breaks[0] if len(alphas) > 1 else np.max(x)
+    offsets = _nbroken_offsets(breaks, alphas, pivot)
+    seg = np.searchsorted(breaks[:len(alphas)-1], x, side='left')
+    if out is None:
+        out = np.empty(x.shape)
+    np.log(x, out=out)
+    out *= -alphas[seg]
+    out += offsets[seg]
+    np.exp(out, out=out)
+    out *= amplitude
+    return out
+
+def nbroken_law_log(log_x, breaks, alphas, amplitude):
+    '''
+    Calculate log10 of the n-broken power law function as a piecewise-linear function of log10(x),
+    i.e. log10(nbroken_law(10**log_x, breaks, alphas, amplitude)) with additions instead of powers.
+    Args:
+        log_x : log10 of the times at which to evaluate the model (e.g. FitData(..., log=True).x)
+        breaks, alphas, amplitude : as nbroken_law
+    Returns:
+        array : log10 of the model flux
+    '''
+    log_x = np.asarray(log_x, dtype=float)
+    alphas = np.asarray(alphas, dtype=float)
+    log_breaks = np.log10(np.asarray(breaks, dtype=float)[:len(alphas)-1])
+    offsets = np.empty(alphas.shape)
+    offsets[0] = alphas[0]*(log_breaks[0] if len(alphas) > 1 else np.max(log_x))
+    offsets[1:] = offsets[0] + np.cumsum(np.diff(alphas)*log_breaks)
+    seg = np.searchsorted(log_breaks, log_x, side='left')
+    return np.log10(amplitude) + offsets[seg] - alphas[seg]*log_x
+
+#batched models: one row of parameters (and of the returned model matrix) per walker/grid point
+def nbroken_law_batch(x, breaks, alphas, amplitude):
+    '''
+    Calculate the n-broken power law function for many parameter sets at once.
+    Args:
+        x : (n_points,) times at which to evaluate the models
+        breaks : (n_sets, n_seg-1) break times, increasing along each row
+        alphas : (n_sets, n_seg) segment slopes
+        amplitude : (n_sets,) amplitudes
+    Returns:
+        array : (n_sets, n_points) model matrix, row k equal to nbroken_law(x, breaks[k], alphas[k], amplitude[k])
+    '''
+    x = np.asarray(x, dtype=float)
+    alphas = np.atleast_2d(np.asarray(alphas, dtype=float))
+    n_sets, n_seg = alphas.shape
+    breaks = np.asarray(breaks, dtype=float).reshape(n_sets, -1)[:, :n_seg-1]
+    amplitude = np.asarray(amplitude, dtype=float).reshape(n_sets, 1)
+    pivot = breaks[:, 0] if n_seg > 1 else np.full(n_sets, np.max(x))
+    offsets = _nbroken_offsets(breaks, alphas, pivot)
+    seg = np.zeros((n_sets, len(x)), dtype=np.intp)
+    for i in range(n_seg-1):
+        seg += x > breaks[:, i:i+1]
+    y = np.take_along_axis(alphas, seg, axis=1)
+    y *= -np.log(x)
+    y += np.take_along_axis(offsets, seg, axis=1)
+    np.exp(y, out=y)
+    y *= amplitude
+    return y
+
+def power_law_batch(x, theta):
+    '''
+    Calculate the power law function for an (n_sets, 2) array of (alpha_1, amplitude).
+    '''
+    theta = np.atleast_2d(theta)
+    return theta[:, 1:2] * np.asarray(x, dtype=float) ** (-theta[:, 0:1])
+
+def broken_power_law_batch(x, theta):
+    '''
+    Calculate the broken power law function for an (n_sets, 4) array of (t_break, alpha_1, alpha_2, amplitude).
+    '''
+    theta = np.atleast_2d(theta)
+    return nbroken_law_batch(x, theta[:, 0:1], theta[:, 1:3], theta[:, 3])
+
+def double_broken_law_batch(x, theta):
+    '''
+    Calculate the double broken power law function for an (n_sets, 6) array of
+    (tb0, tb1, alpha_0, alpha_1, alpha_2, amplitude).
+    '''
+    theta = np.atleast_2d(theta)
+    return nbroken_law_batch(x, theta[:, 0:2], theta[:, 2:5], theta[:, 5])
+
+def triple_broken_law_batch(x, theta):
+    '''
+    Calculate the triple broken power law function for an (n_sets, 8) array of
+    (tb0, tb1, tb2, alpha_0, alpha_1, alpha_2, alpha_3, amplitude).
+    '''
+    theta = np.atleast_2d(theta)
+    return nbroken_law_batch(x, theta[:, 0:3], theta[:, 3:7], theta[:, 7])
 
 #objective functions
-def cost_func_pl(params,x,y,x_err,y_err, orth=False):
+#with log=True the cost functions (and jacobians) take x, y and y_err as log10(time), log10(flux) and the
+#error of log10(flux), as FitData(..., log=True).args, and return residuals in log space, e.g.
+#lm.minimize(cost_func_bpl, params, args=data.args, kws={"log": True})
+def cost_func_pl(params,x,y,x_err,y_err, orth=False, log=False):
     '''
     Calculate the cost function for the power law model.
     '''
     v = params.valuesdict()
+    if log:
+        return (np.log10(v["amplitude"]) - v["alpha_1"]*x - y)/y_err
     y_model = power_law(x,v["alpha_1"],v["amplitude"])
     if orth == True:
         cost_fn = (y_model - y)/y_err + 1/x_err
     cost_fn = (y_model - y)/y_err
     return cost_fn
 
-def cost_func_bpl(params,x,y,x_err,y_err, orth=False):
+def cost_func_bpl(params,x,y,x_err,y_err, orth=False, log=False):
     '''
     Calculate the cost function for the broken power law model.
     '''
     v = params.valuesdict()
+    if log:
+        return (nbroken_law_log(x,[v["t_break"]],[v["alpha_1"],v["alpha_2"]],v["amplitude"]) - y)/y_err
     y_model = broken_power_law(x,v["t_break"],v["alpha_1"],v["alpha_2"],v["amplitude"])
     if orth == True:
         cost_fn = (y_model - y)/y_err + 1/x_err
     cost_fn = (y_model - y)/y_err
     return cost_fn
 
-def cost_func_dbl(params, x, y, x_err, y_err, orth=False):
+def cost_func_dbl(params, x, y, x_err, y_err, orth=False, log=False):
     '''
     Calculate the cost function for the double broken power law model.
     '''
     v = params.valuesdict()
+    if log:
+        return (nbroken_law_log(x,[v["tb0"],v["tb1"]],[v["alpha_0"],v["alpha_1"],v["alpha_2"]],v["amplitude"]) - y)/y_err
     y_model = double_broken_law(x,v["tb0"],v["tb1"],v["alpha_0"],v["alpha_1"],v["alpha_2"],v["amplitude"])
     if orth == True:
         cost_fn = (y_model - y)/y_err + 1/x_err
     cost_fn = (y_model - y)/y_err
     return cost_fn
 
-def cost_func_nbpl(params, x, y, x_err, y_err, n, orth=False):
+def cost_func_nbpl(params, x, y, x_err, y_err, n, orth=False, log=False):
     '''
     Calculate the cost function for the n-broken power law model.
     '''
     v = params.valuesdict()
     tbreaks = [v["tb"+str(i)] for i in range(n-1)]
     alphas = [v["alpha_"+str(i)] for i in range(n)]
+    if log:
+        return (nbroken_law_log(x,tbreaks,alphas,v["amplitude"]) - y)/y_err
     y_model = nbroken_law(x,tbreaks, alphas,v["amplitude"])
     if orth == True:
         cost_fn = (y_model - y)/y_err + 1/x_err
     cost_fn = (y_model - y)/y_err
     return cost_fn
 
+#analytic jacobians of the objective functions, for lmfit's Dfun (leastsq) / jac (least_squares) hook, e.g.
+#lm.minimize(cost_func_bpl, params, args=(x,y,x_err,y_err), method='least_squares', jac=jac_func_bpl)
+def _varying_columns(params, columns):
+    '''
+    Stack the derivative columns of the varying parameters in the order lmfit expects.
+    '''
+    return np.column_stack([columns[name] for name, par in params.items() if par.vary])
+
+def _nbroken_log_derivatives(x, breaks, alphas, amplitude):
+    '''
+    Evaluate the n-broken power law together with the derivatives of log(y) with
+    respect to each break and each slope, computed piecewise in log space.
+    Returns:
+        tuple : (y, dlogy_dbreaks, dlogy_dalphas) of shapes (n,), (n, n_seg-1), (n, n_seg)
+    '''
+    x = np.asarray(x, dtype=float)
+    y = nbroken_law(x, breaks, alphas, amplitude)
+    return (y,) + _nbroken_slope_derivatives(np.log(x), breaks, alphas)
+
+def _nbroken_slope_derivatives(log_x, breaks, alphas):
+    '''
+    Derivatives of log(y) of the n-broken power law with respect to each break and each slope,
+    given the natural log of the times.
+    Returns:
+        tuple : (dlogy_dbreaks, dlogy_dalphas) of shapes (n, n_seg-1), (n, n_seg)
+    '''
+    alphas = np.asarray(alphas, dtype=float)
+    n_seg = len(alphas)
+    breaks = np.asarray(breaks, dtype=float)[:n_seg-1]
+    seg = np.searchsorted(np.log(breaks), log_x, side='left')
+    pivot = breaks[0] if n_seg > 1 else np.exp(np.max(log_x))
+    #slope k enters as alphas[k]*(log b_(k-1) - log min(x, b_k)) for points at or beyond segment k, with b_(-1) = pivot
+    log_lower = np.log(np.concatenate(([pivot], breaks)))
+    log_upper = np.minimum(log_x[:, None], np.log(np.concatenate((breaks, [np.inf]))))
+    dlogy_dalphas = np.where(seg[:, None] >= np.arange(n_seg), log_lower - log_upper, 0.)
+    #break k shifts every later segment by (alphas[k+1]-alphas[k])/b_k, and break 0 is also the pivot
+    dlogy_dbreaks = np.where(seg[:, None] > np.arange(n_seg-1), np.diff(alphas), 0.) / breaks
+    if n_seg > 1:
+        dlogy_dbreaks[:, 0] += alphas[0] / breaks[0]
+    return dlogy_dbreaks, dlogy_dalphas
+
+def _nbroken_jacobian_terms(x, y_err, breaks, alphas, amplitude, log):
+    '''
+    (scale, dlogy_dbreaks, dlogy_dalphas) such that d(residual)/d(parameter) = dlogy_d(parameter)*scale,
+    for the linear (log=False) or log-space (log=True) residuals of the cost functions.
+    '''
+    if log:
+        return (1./(np.log(10)*y_err),) + _nbroken_slope_derivatives(np.log(10)*np.asarray(x, dtype=float), breaks, alphas)
+    y_model, d_breaks, d_alphas = _nbroken_log_derivatives(x, breaks, alphas, amplitude)
+    return (y_model/y_err, d_breaks, d_alphas)
+
+def jac_func_pl(params, x, y, x_err, y_err, orth=False, log=False):
+    '''
+    Calculate the jacobian of cost_func_pl.
+    '''
+    v = params.valuesdict()
+    if log:
+        columns = {"alpha_1": -x/y_err, "amplitude": 1./(np.log(10)*v["amplitude"]*y_err)}
+        return _varying_columns(params, columns)
+    y_model = power_law(x,v["alpha_1"],v["amplitude"])
+    columns = {"alpha_1": -np.log(x)*y_model/y_err, "amplitude": y_model/(v["amplitude"]*y_err)}
+    return _varying_columns(params, columns)
+
+def jac_func_bpl(params, x, y, x_err, y_err, orth=False, log=False):
+    '''
+    Calculate the jacobian of cost_func_bpl.
+    '''
+    v = params.valuesdict()
+    scale, d_breaks, d_alphas = _nbroken_jacobian_terms(x, y_err, [v["t_break"]], [v["alpha_1"],v["alpha_2"]], v["amplitude"], log)
+    columns = {"t_break": d_breaks[:,0]*scale, "alpha_1": d_alphas[:,0]*scale, "alpha_2": d_alphas[:,1]*scale,
+               "amplitude": scale/v["amplitude"]}
+    return _varying_columns(params, columns)
+
+def jac_func_dbl(params, x, y, x_err, y_err, orth=False, log=False):
+    '''
+    Calculate the jacobian of cost_func_dbl.
+    '''
+    v = params.valuesdict()
+    scale, d_breaks, d_alphas = _nbroken_jacobian_terms(x, y_err, [v["tb0"],v["tb1"]], [v["alpha_0"],v["alpha_1"],v["alpha_2"]], v["amplitude"], log)
+    columns = {"tb0": d_breaks[:,0]*scale, "tb1": d_breaks[:,1]*scale, "alpha_0": d_alphas[:,0]*scale,
+               "alpha_1": d_alphas[:,1]*scale, "alpha_2": d_alphas[:,2]*scale, "amplitude": scale/v["amplitude"]}
+    return _varying_columns(params, columns)
+
+def jac_func_nbpl(params, x, y, x_err, y_err, n, orth=False, log=False):
+    '''
+    Calculate the jacobian of cost_func_nbpl.
+    '''
+    v = params.valuesdict()
+    tbreaks = [v["tb"+str(i)] for i in range(n-1)]
+    alphas = [v["alpha_"+str(i)] for i in range(n)]
+    scale, d_breaks, d_alphas = _nbroken_jacobian_terms(x, y_err, tbreaks, alphas, v["amplitude"], log)
+    columns = {"amplitude": scale/v["amplitude"], "log_amplitude": scale*np.log(10)}
+    columns.update({"tb"+str(i): d_breaks[:,i]*scale for i in range(n-1)})
+    columns.update({"alpha_"+str(i): d_alphas[:,i]*scale for i in range(n)})
+    return _varying_columns(params, columns)
+
+JACOBIANS = {cost_func_pl: jac_func_pl, cost_func_bpl: jac_func_bpl, cost_func_dbl: jac_func_dbl, cost_func_nbpl: jac_func_nbpl}
+
+def minimize(cost_func, params, method="leastsq", **kws):
+    '''
+    lm.minimize, recording a "fit" stage with the number of cost function evaluations when
+    instrumentation is enabled (see instrument).
+    '''
+    with instrument.timed("fit", cost_func=getattr(cost_func, "__name__", repr(cost_func)), method=method) as timer:
+        result = lm.minimize(cost_func, params, method=method, **kws)
+        timer.add(nfev=result.nfev, success=bool(result.success))
+    return result
+
+def _jacobian_kws(cost_func, method):
+    '''
+    The lm.minimize keyword passing the analytic jacobian of cost_func, if method takes one.
+    '''
+    if cost_func in JACOBIANS and method == "least_squares":
+        return {"jac": JACOBIANS[cost_func]}
+    if cost_func in JACOBIANS and method == "leastsq":
+        return {"Dfun": JACOBIANS[cost_func]}
+    return {}
+
+#persistent cache of fit results
+class FitCache:
+    '''
+    On-disk cache of fit results, shared safely by concurrent workers, so that unchanged sources
+    are not refitted. Each result is one small JSON file named by the hash of everything the fit
+    depends on (see key): the data arrays, the cost function and its keyword arguments, the
+    method, the names, values and bounds of the parameters, any further configuration (e.g. the
+    fit window) and the package version. It holds the best fit values, standard errors,
+    covariance and information criteria of the lmfit MinimizerResult. Files are written to a
+    temporary name and atomically renamed, and the least recently used results are evicted once
+    the cache grows beyond max_bytes (or max_entries files).
+    Args:
+        root : directory of the cache
+        max_bytes : size limit of the cache
+        max_entries : limit on the number of cached results
+    Usage:
+        cache = FitCache('fit_cache/')
+        result = cache.minimize(cost_func_bpl, params, args=data.args, method="least_squares", window=(4, 1e3))
+    '''
+    STATS = ("chisqr", "redchi", "aic", "bic", "nfev", "ndata", "nvarys", "nfree", "success", "message", "method")
+
+    def __init__(self, root, max_bytes=2**26, max_entries=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(cost_func, params, args, method="leastsq", kws=None, **config):
+        '''
+        Hash of a fit: cost_func (a function or a name), params (lmfit Parameters or None), the
+        arguments after params, the method, the keyword arguments of the cost function and config.
+        '''
+        digest = hashlib.sha256()
+        name = cost_func if isinstance(cost_func, str) else cost_func.__module__ + "." + cost_func.__qualname__
+        header = [__version__, name, method, sorted((kws or {}).items()), sorted(config.items())]
+        if params is not None:
+            header.append([(n, p.value, p.min, p.max, p.vary, p.expr) for n, p in params.items()])
+        digest.update(repr(header).encode('utf-8'))
+        for arg in args:
+            if isinstance(arg, np.ndarray):
+                arg = np.ascontiguousarray(arg)
+                digest.update(repr((arg.dtype.str, arg.shape)).encode('utf-8'))
+                digest.update(arg.tobytes())
+            else:
+                digest.update(repr(arg).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + '.json')
+
+    def get(self, key):
+        '''
+        The cached result for key as an lmfit MinimizerResult (with cached=True), or None.
+        '''
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:  # evicted by another worker meanwhile
+            pass
+        params = lm.Parameters()
+        for name, value, stderr, lower, upper, vary, expr in record["params"]:
+            params.add(name, value=value, min=lower, max=upper, vary=vary)
+            params[name].stderr = stderr
+            params[name].expr = expr
+        covar = None if record["covar"] is None else np.array(record["covar"])
+        return lm.minimizer.MinimizerResult(params=params, var_names=record["var_names"], covar=covar, aborted=False,
+                                            errorbars=covar is not None, cached=True, **record["stats"])
+
+    def put(self, key, result):
+        '''
+        Store a MinimizerResult under key (aborted fits are not stored).
+        '''
+        if getattr(result, "aborted", False):
+            return
+        covar = getattr(result, "covar", None)
+        record = {"params": [(name, par.value, par.stderr, par.min, par.max, par.vary, par.expr) for name, par in result.params.items()],
+                  "var_names": list(getattr(result, "var_names", [])),
+                  "covar": None if covar is None else np.asarray(covar).tolist(),
+                  "stats": {stat: _json_scalar(getattr(result, stat)) for stat in self.STATS if hasattr(result, stat)}}
+        filecache.atomic_write(self.path(key), lambda f: json.dump(record, f), mode='w')
+        self.evict()
+
+    def fetch(self, key, fit, name):
+        '''
+        The cached result for key, or else the MinimizerResult of fit() (called without arguments),
+        which is then stored. name identifies the fit in the "fit_cache" event (see instrument).
+        '''
+        result = self.get(key)
+        instrument.emit("fit_cache", cost_func=name, hit=result is not None)
+        if result is None:
+            result = fit()
+            self.put(key, result)
+        return result
+
+    def minimize(self, cost_func, params, args=(), kws=None, method="leastsq", config=None, **fit_kws):
+        '''
+        minimize(cost_func, params, args=args, kws=kws, method=method, **fit_kws), unless the same fit
+        is cached. config is a dict of further settings that belong in the key (e.g. the fit window);
+        fit_kws (jacobians, iteration callbacks) do not change the result and are left out of it.
+        '''
+        key = self.key(cost_func, params, args, method, kws, **(config or {}))
+        return self.fetch(key, lambda: minimize(cost_func, params, args=args, kws=kws, method=method, **fit_kws),
+                          getattr(cost_func, "__name__", repr(cost_func)))
+
+    def evict(self):
+        '''
+        Remove the least recently used results until the cache is within max_bytes and max_entries.
+        '''
+        filecache.evict_lru(os.path.join(self.root, '*.json'), self.max_bytes, self.max_entries)
+
+    def clear(self):
+        '''
+        Remove every cached result.
+        '''
+        for path in glob.glob(os.path.join(self.root, '*.json')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def _json_scalar(value):
+    # numpy scalars (nfev, chisqr, success, ...) as plain Python values
+    return value.item() if isinstance(value, np.generic) else value
+
+#incremental refits of ongoing transients
+def warm_refit(previous, cost_func, args, method="least_squares"):
+    '''
+    Refit a light curve starting from the best fit of a previous lmfit result (e.g. after new
+    points arrived) and report how far each parameter moved. The analytic jacobian of
+    cost_func (see JACOBIANS) is used where the method supports one.
+    Args:
+        previous : lmfit MinimizerResult (or Parameters) of the previous fit
+        cost_func : one of the cost_func_* functions
+        args : its arguments after params, e.g. (x, y, x_err, y_err) or (x, y, x_err, y_err, n)
+    Returns:
+        tuple : (result, drift). drift is a pandas.DataFrame indexed by parameter with the
+                previous and new values, their difference and that difference in units of the
+                previous standard error
+    '''
+    old = getattr(previous, "params", previous)
+    result = minimize(cost_func, old.copy(), args=args, method=method, **_jacobian_kws(cost_func, method))
+
+    return result, _param_drift(old, result.params, "previous", "value")
+
+def refit_xrt(GRB, loc, previous, cost_func, n=None, window=(-np.inf, np.inf), cache=None):
+    '''
+    Append any new XRT points of an ongoing transient to its saved light curve (see
+    swift_scrape.update_xrt) and warm-start a refit from the previous result (see warm_refit).
+    Args:
+        GRB : name of the GRB, e.g. '060614'
+        loc : location of targetIDs.txt and of the saved light curve
+        previous : lmfit MinimizerResult of the previous fit
+        cost_func : cost function of the previous fit (with n for cost_func_nbpl)
+        window : (t_min, t_max) of the points to fit
+        cache : optional swift_scrape.ProductCache used for the download
+    Returns:
+        tuple : (result, drift, n_new) with n_new the number of appended points; if there are
+                none the previous result is returned with a drift of None. If the download
+                failed, the swift_scrape error code is returned instead.
+    '''
+    data, new = swift_scrape.update_xrt(GRB, loc, cache=cache)
+    if new is None:
+        return data
+    if not np.any(new):
+        return previous, None, 0
+    time = np.asarray(data['time'])
+    keep = (time > window[0]) & (time < window[1])
+    args = (time[keep], np.asarray(data['flux'])[keep], np.asarray(data['tpos']+data['tneg'])[keep],
+            np.asarray(data['fpos']+data['fneg'])[keep])
+    if n is not None:
+        args = args + (n,)
+    result, drift = warm_refit(previous, cost_func, args)
+    return result, drift, int(np.count_nonzero(new))
+
+#selection of the number of segments of the n-broken power law
+def _loglog_slope(x, y):
+    '''
+    Slope alpha and intercept of a straight line fit to log(y) against log(x), y ~ exp(intercept)*x**(-alpha).
+    '''
+    good = y > 0
+    if np.count_nonzero(good) < 2:
+        return 0., np.log(np.mean(np.abs(y)))
+    slope, intercept = np.polyfit(np.log(x[good]), np.log(y[good]), 1)
+    return -slope, intercept
+
+def _split_worst_segment(x, y, y_err, breaks, alphas, amplitude):
+    '''
+    Starting values for n+1 segments from an n-segment fit: the segment with the largest
+    mean squared residual is split at the log-midpoint of its points and each half gets
+    its own log-log slope.
+    '''
+    model = nbroken_law(x, breaks, alphas, amplitude)
+    seg = np.searchsorted(breaks, x, side='left')
+    chi2 = ((model - y)/y_err)**2
+    splittable = [i for i in range(len(alphas)) if np.count_nonzero(seg == i) >= 2]
+    worst = max(splittable, key=lambda i: np.mean(chi2[seg == i]))
+    x_seg, y_seg = x[seg == worst], y[seg == worst]
+    new_break = np.sqrt(np.min(x_seg)*np.max(x_seg))
+    halves = [x_seg <= new_break, x_seg > new_break]
+    new_alphas = [_loglog_slope(x_seg[h], y_seg[h])[0] if np.count_nonzero(h) >= 2 else alphas[worst] for h in halves]
+    breaks = np.insert(breaks, worst, new_break)
+    alphas = np.concatenate((alphas[:worst], new_alphas, alphas[worst+1:]))
+    return breaks, alphas
+
+def _ladder_params(x, breaks, alphas, amplitude, alpha_bounds):
+    '''
+    lmfit Parameters for cost_func_nbpl, each break bounded by its neighbours so the order is kept.
+    The amplitude is fitted as log_amplitude (amplitude = 10**log_amplitude), which keeps it positive
+    without a bound: least_squares would move a start within 1e-10 of a bound to 1e-10, far above
+    X-ray fluxes.
+    '''
+    params = lm.Parameters()
+    edges = np.concatenate(([np.min(x)], breaks, [np.max(x)]))
+    for i, tb in enumerate(breaks):
+        params.add("tb"+str(i), value=tb, min=np.sqrt(edges[i]*tb), max=np.sqrt(tb*edges[i+2]))
+    for i, alpha in enumerate(alphas):
+        params.add("alpha_"+str(i), value=np.clip(alpha, *alpha_bounds), min=alpha_bounds[0], max=alpha_bounds[1])
+    params.add("log_amplitude", value=np.log10(amplitude))
+    params.add("amplitude", expr="10**log_amplitude")
+    return params
+
+def model_ladder(x, y, x_err, y_err, max_n=4, alpha_bounds=(-5., 10.), patience=1):
+    '''
+    Fit n-broken power laws with n = 1, 2, ... max_n segments, each level warm-started
+    from the best fit of the previous one by splitting its worst-fitting segment, and rank
+    them by BIC (see information_criteria). The ladder stops early once BIC has not improved
+    for patience consecutive levels.
+    Args:
+        x, y, x_err, y_err : light curve, as passed to cost_func_nbpl
+        max_n : largest number of segments to try
+        alpha_bounds : (min, max) of every slope
+        patience : number of levels without a better BIC after which to stop
+    Returns:
+        tuple : (table, results). table is a pandas.DataFrame with columns n, chisqr, redchi,
+                lnlike, AIC, BIC, dof sorted by BIC; results maps n to the lmfit MinimizerResult
+    '''
+    x, y, y_err = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(y_err, dtype=float)
+    alpha, intercept = _loglog_slope(x, y)
+    breaks, alphas = np.array([]), np.array([alpha])
+    amplitude = np.exp(intercept)*np.max(x)**(-alpha)
+
+    rows, results = [], {}
+    best_bic, since_best = np.inf, 0
+    for n in range(1, max_n+1):
+        if n > 1:
+            #the amplitude of the previous fit is its flux at its own first break (at max(x) for n = 2)
+            new_breaks, new_alphas = _split_worst_segment(x, y, y_err, breaks, alphas, amplitude)
+            amplitude = amplitude*nbroken_law(np.array([new_breaks[0], np.max(x)]), breaks, alphas, 1.)[0]
+            breaks, alphas = new_breaks, new_alphas
+        params = _ladder_params(x, breaks, alphas, amplitude, alpha_bounds)
+        result = minimize(cost_func_nbpl, params, args=(x, y, x_err, y_err, n), method="least_squares", jac=jac_func_nbpl)
+        results[n] = result
+        ln_like = -0.5*(result.chisqr + np.sum(np.log(y_err**2)))
+        AIC, BIC, dof = information_criteria(ln_like, y, result.var_names)
+        rows.append({"n": n, "chisqr": result.chisqr, "redchi": result.redchi, "lnlike": ln_like, "AIC": AIC, "BIC": BIC, "dof": dof})
+
+        v = result.params.valuesdict()
+        breaks = np.array([v["tb"+str(i)] for i in range(n-1)])
+        alphas = np.array([v["alpha_"+str(i)] for i in range(n)])
+        amplitude = v["amplitude"]
+        if BIC < best_bic:
+            best_bic, since_best = BIC, 0
+        else:
+            since_best += 1
+        if since_best >= patience or n+1 > len(x)//2:
+            break
+
+    table = pd.DataFrame(rows).sort_values("BIC", ignore_index=True)
+    return table, results
+
+#global optimisation over the break times of the n-broken power law
+def break_candidates(x, n, n_grid=30, sampling="grid", n_samples=1000, t_range=None, min_points=2, seed=None):
+    '''
+    Candidate break times for an n-segment fit: every increasing combination of n-1 points of a
+    log-spaced grid (sampling="grid") or n_samples sorted Latin-hypercube draws in log time
+    (sampling="lhs"), keeping those that leave at least min_points points in every segment.
+    Returns:
+        array : (n_candidates, n-1) break times
+    '''
+    x = np.asarray(x, dtype=float)
+    lo, hi = np.log10(t_range if t_range is not None else (np.min(x), np.max(x)))
+    if sampling == "grid":
+        grid = np.linspace(lo, hi, n_grid+2)[1:-1]
+        index = np.array(list(itertools.combinations(range(n_grid), n-1)), dtype=int).reshape(-1, n-1)
+        log_breaks = grid[index]
+    elif sampling == "lhs":
+        sample = sp.stats.qmc.LatinHypercube(d=n-1, seed=seed).random(n_samples)
+        log_breaks = np.sort(lo + (hi-lo)*sample, axis=1)
+    else:
+        raise ValueError("sampling must be 'grid' or 'lhs'")
+    edges = np.searchsorted(np.sort(np.log10(x)), log_breaks, side='right')
+    counts = np.diff(np.column_stack((np.zeros(len(edges), dtype=int), edges, np.full(len(edges), len(x)))), axis=1)
+    return 10**log_breaks[np.all(counts >= min_points, axis=1)]
+
+def _sweep_breaks(log_x, log_y, weight, log_breaks):
+    '''
+    Weighted linear least squares of log10(flux) for each row of fixed log10 break times: with the
+    breaks fixed, log10 of the n-broken power law is linear in log10(amplitude) and the slopes.
+    Returns:
+        tuple : (chi2, log_amplitude, alphas) of shapes (n_candidates,), (n_candidates,), (n_candidates, n)
+    '''
+    n_cand, n_breaks = log_breaks.shape
+    seg = np.sum(log_x[None, :, None] > log_breaks[:, None, :], axis=2)
+    #d log10(y) / d alpha_k, as in _nbroken_slope_derivatives, with the pivot at the first break
+    lower = np.concatenate((log_breaks[:, :1], log_breaks), axis=1)
+    upper = np.concatenate((log_breaks, np.full((n_cand, 1), np.inf)), axis=1)
+    upper = np.minimum(log_x[None, :, None], upper[:, None, :])
+    design = np.where(seg[:, :, None] >= np.arange(n_breaks+1), lower[:, None, :] - upper, 0.)
+    design = np.concatenate((np.ones(design.shape[:2] + (1,)), design), axis=2)
+    weighted = design * weight[None, :, None]
+    coef = np.linalg.solve(np.einsum('cpi,cpj->cij', weighted, design), np.einsum('cpi,p->ci', weighted, log_y)[:, :, None])[:, :, 0]
+    chi2 = np.sum(weight*(log_y - np.einsum('cpi,ci->cp', design, coef))**2, axis=1)
+    return chi2, coef[:, 0], coef[:, 1:]
+
+def _polish_candidate(params, args, log, iter_cb):
+    return minimize(cost_func_nbpl, params, args=args, kws={"log": log}, method="least_squares", jac=jac_func_nbpl,
+                    iter_cb=iter_cb)
+
+def global_fit(x, y, x_err, y_err, n, top_k=5, alpha_bounds=(-5., 10.), log=False, processes=None, chunk_size=256, iter_cb=None,
+               **candidate_kws):
+    '''
+    Fit an n-broken power law without hand-tuned starting values or bounds: sweep the break times
+    over a log grid or a Latin hypercube (see break_candidates), solve the amplitude and slopes at
+    each fixed set of breaks by linear least squares in log space (vectorized over chunks of
+    candidates), and polish the top_k candidates with lmfit (cost_func_nbpl and jac_func_nbpl,
+    each break bounded by its neighbours).
+    Args:
+        x, y, x_err, y_err : light curve, as passed to cost_func_nbpl (points with y <= 0 are
+                             left out of the sweep)
+        n : number of segments (at least 2)
+        top_k : number of candidates to polish
+        alpha_bounds : (min, max) of every slope
+        log : polish the log-space residuals (see cost_func_nbpl) instead of the linear ones;
+              x, y and y_err are then log10(time), log10(flux) and its error
+        processes : number of worker processes for the sweep chunks and the polishing (None runs serially)
+        chunk_size : number of candidates solved at once
+        iter_cb : iteration callback of the polishing fits (see lmfit.minimize), e.g. to stop them at a
+                  deadline; it must be picklable when processes is given
+        candidate_kws : passed on to break_candidates (n_grid, sampling, n_samples, t_range, min_points, seed)
+    Returns:
+        tuple : (table, results). table is a pandas.DataFrame with the sweep chi2 (in log space),
+                chisqr, redchi and best fit values of the polished candidates, sorted by chisqr
+                (leaving out any whose amplitude is not positive and finite); results lists their
+                lmfit MinimizerResults in the same order
+    '''
+    if n < 2:
+        raise ValueError("global_fit needs n >= 2 segments")
+    x, y, y_err = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(y_err, dtype=float)
+    if log:
+        log_x, log_y, sigma, t = x, y, y_err, 10**x
+    else:
+        good = y > 0
+        log_x, log_y, sigma, t = np.log10(x[good]), np.log10(y[good]), y_err[good]/(y[good]*np.log(10)), x
+    weight = 1./sigma**2
+    log_breaks = np.log10(break_candidates(t, n, **candidate_kws))
+    if len(log_breaks) == 0:
+        raise ValueError("no break candidates with enough points in every segment")
+    chunks = [log_breaks[i:i+chunk_size] for i in range(0, len(log_breaks), chunk_size)]
+
+    pool = None if processes is None else futures.ProcessPoolExecutor(max_workers=processes)
+    try:
+        mapper = map if pool is None else pool.map
+        sweeps = list(mapper(_sweep_breaks, *zip(*[(log_x, log_y, weight, chunk) for chunk in chunks])))
+        chi2 = np.concatenate([sweep[0] for sweep in sweeps])
+        log_amplitude = np.concatenate([sweep[1] for sweep in sweeps])
+        alphas = np.concatenate([sweep[2] for sweep in sweeps])
+        best = np.argsort(chi2)[:top_k]
+
+        starts = []
+        for k in best:
+            breaks = 10**log_breaks[k]
+            #the swept amplitude is the flux at the first break, as in nbroken_law
+            starts.append(_ladder_params(t, breaks, alphas[k], 10**log_amplitude[k], alpha_bounds))
+        args = (x, y, x_err, y_err, n)
+        results = list(mapper(_polish_candidate, starts, [args]*len(starts), [log]*len(starts), [iter_cb]*len(starts)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    rows = [dict(sweep_chi2=chi2[k], chisqr=result.chisqr, redchi=result.redchi, **result.params.valuesdict())
+            for k, result in zip(best, results)]
+    #an amplitude that under- or overflowed is no fit
+    good = [i for i, row in enumerate(rows) if 0 < row["amplitude"] < np.inf and np.isfinite(row["chisqr"])]
+    if not good:
+        raise ValueError("no polished candidate has a positive, finite amplitude")
+    order = sorted(good, key=lambda i: rows[i]["chisqr"])
+    table = pd.DataFrame([rows[i] for i in order])
+    return table, [results[i] for i in order]
+
 #code by Jonathan Quirola-Vásquez for MCMC fitting
 def lnlikehood(x, y, yerr, theta,BPL):
     '''
@@ -188,4 +1078,537 @@ def lnprob(theta, x, y, yerr):
         return -np.inf
     return lp + lnlike(theta, x, y, yerr)
 
+def lnlike_batch(theta, x, y, yerr):
+    '''
+    Calculate lnlike for an (n_walkers, 4) array of broken power law parameters.
+    '''
+    model = broken_power_law_batch(x, theta)
+    inv_sigma2 = 1.0/(np.asarray(yerr)**2)
+    return -0.5*(np.sum((y-model)**2*inv_sigma2 - np.log(inv_sigma2), axis=1))
+
+def lnprior_batch(theta):
+    '''
+    Calculate lnprior for an (n_walkers, 4) array of broken power law parameters.
+    '''
+    t_break,alpha_1,alpha_2,amplitude = np.atleast_2d(theta).T
+    inside = (1e1<t_break)&(t_break<1e4)&(-1.0<alpha_1)&(alpha_1<0.2)&(0.0<alpha_2)&(alpha_2<4.0)&(1e-15<amplitude)&(amplitude<1e-11)
+    return np.where(inside, 0.0, -np.inf)
+
+def lnprob_batch(theta, x, y, yerr):
+    '''
+    Calculate lnprob for an (n_walkers, 4) array of broken power law parameters,
+    for use with emcee.EnsembleSampler(..., vectorize=True).
+    '''
+    theta = np.atleast_2d(theta)
+    lp = lnprior_batch(theta)
+    inside = np.isfinite(lp)
+    if np.any(inside):
+        lp[inside] += lnlike_batch(theta[inside], x, y, yerr)
+    return lp
+
+
+#joint hierarchical fits of a population of broken power laws
+BPL_PARAMS = ("t_break", "alpha_1", "alpha_2", "amplitude")
+
+class PopulationBPL:
+    '''
+    Broken power laws of a whole population of light curves, fitted together. The curves are
+    stacked into one ragged layout (all points concatenated, source i owning the rows
+    offsets[i]:offsets[i+1]), so the model, residuals and jacobian of all sources are each
+    evaluated as one array operation.
+
+    Every source has its own t_break, alpha_1, alpha_2 and amplitude (fitted as log10(t_break)
+    and log10(amplitude)), except for
+        shared : parameters with a single value for the whole population
+        hierarchical : parameters drawn from a normal population distribution with mean mu_<name>
+                       (fitted) and scatter tau[name]; each source adds the residual (value - mu)/tau
+    theta is laid out as (mu_<hierarchical>..., <shared>..., then the other parameters source by
+    source), see global_names and local_names.
+    Args:
+        curves : sequence of (x, y, x_err, y_err), as passed to cost_func_bpl
+        tau : dict of hierarchical parameter -> population scatter (default 1)
+        log : fit the log-space residuals (see cost_func_bpl); x, y and y_err are then
+              log10(time), log10(flux) and its error
+    '''
+
+    def __init__(self, curves, shared=(), hierarchical=(), tau=None, log=False):
+        for name in tuple(shared) + tuple(hierarchical):
+            if name not in BPL_PARAMS:
+                raise ValueError("unknown parameter " + repr(name))
+        if set(shared) & set(hierarchical):
+            raise ValueError("a parameter cannot be both shared and hierarchical")
+        lengths = [len(curve[0]) for curve in curves]
+        if not lengths or min(lengths) == 0:
+            raise ValueError("every source needs at least one point")
+        self.log = log
+        self.n_sources = len(curves)
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.source = np.repeat(np.arange(self.n_sources), lengths)
+        x, self.y, self.y_err = (np.concatenate([np.asarray(curve[i], dtype=float) for curve in curves]) for i in (0, 1, 3))
+        self.log_x = x if log else np.log10(x)
 
+        self.shared = [BPL_PARAMS.index(name) for name in shared]
+        self.hierarchical = [BPL_PARAMS.index(name) for name in hierarchical]
+        self.local = [i for i in range(4) if i not in self.shared]
+        self.global_names = ["mu_"+name for name in hierarchical] + list(shared)
+        self.local_names = [BPL_PARAMS[i] for i in self.local]
+        self.tau = np.array([1. if tau is None else tau[name] for name in hierarchical], dtype=float)
+
+        #the sparsity structure never changes: keep the row and column of every jacobian entry
+        n_points, n_hyper, n_global, n_local = len(self.y), len(self.hierarchical), len(self.global_names), len(self.local)
+        points = np.arange(n_points)
+        rows = [points]*(n_local + len(self.shared))
+        cols = [n_global + self.source*n_local + l for l in range(n_local)] + [np.full(n_points, n_hyper + j) for j in range(len(self.shared))]
+        for h, i in enumerate(self.hierarchical):
+            prior_rows = n_points + h*self.n_sources + np.arange(self.n_sources)
+            rows += [prior_rows, prior_rows]
+            cols += [n_global + np.arange(self.n_sources)*n_local + self.local.index(i), np.full(self.n_sources, h)]
+        self._rows, self._cols = np.concatenate(rows), np.concatenate(cols)
+        self.shape = (n_points + n_hyper*self.n_sources, n_global + self.n_sources*n_local)
+
+    def unpack(self, theta):
+        '''
+        Per-source parameters (log10(t_break), alpha_1, alpha_2, log10(amplitude)) of theta, as an (n_sources, 4) array.
+        '''
+        theta = np.asarray(theta, dtype=float)
+        n_hyper, n_global = len(self.hierarchical), len(self.global_names)
+        p = np.empty((self.n_sources, 4))
+        p[:, self.shared] = theta[n_hyper:n_global]
+        p[:, self.local] = theta[n_global:].reshape(self.n_sources, len(self.local))
+        return p
+
+    def pack(self, p, hyper=()):
+        '''
+        theta from (n_sources, 4) per-source parameters (see unpack) and the values of the mu_<name>;
+        shared parameters take their mean over the sources.
+        '''
+        return np.concatenate((np.asarray(hyper, dtype=float), p[:, self.shared].mean(axis=0), p[:, self.local].ravel()))
+
+    def _model(self, theta):
+        # log10 of the broken power law at every point, and its derivatives with respect to the per-source parameters
+        p = self.unpack(theta)[self.source]
+        dx = self.log_x - p[:, 0]
+        before = dx < 0
+        alpha = np.where(before, p[:, 1], p[:, 2])
+        log_model = p[:, 3] - alpha*dx
+        derivatives = np.column_stack((alpha, np.where(before, -dx, 0.), np.where(before, 0., -dx), np.ones_like(dx)))
+        return log_model, derivatives
+
+    def _prior_residual(self, theta):
+        z = (self.unpack(theta)[:, self.hierarchical] - np.asarray(theta[:len(self.hierarchical)]))/self.tau
+        return z.T.ravel()
+
+    def _data_residual(self, theta):
+        log_model, derivatives = self._model(theta)
+        if self.log:
+            return (log_model - self.y)/self.y_err, derivatives/self.y_err[:, None]
+        model = 10**log_model
+        return (model - self.y)/self.y_err, derivatives*(np.log(10)*model/self.y_err)[:, None]
+
+    def residual(self, theta):
+        '''
+        Normalised residuals of every point, then the population residuals (value - mu)/tau of every hierarchical parameter.
+        '''
+        return np.concatenate((self._data_residual(theta)[0], self._prior_residual(theta)))
+
+    def jacobian(self, theta):
+        '''
+        Jacobian of residual as a scipy.sparse matrix: every point depends only on the parameters
+        of its source and the shared ones, so it has 4 entries per point (2 per hierarchical residual).
+        '''
+        derivatives = self._data_residual(theta)[1]
+        values = [derivatives[:, i] for i in self.local] + [derivatives[:, i] for i in self.shared]
+        for tau in self.tau:
+            values += [np.full(self.n_sources, 1./tau), np.full(self.n_sources, -1./tau)]
+        return sp.sparse.csr_matrix((np.concatenate(values), (self._rows, self._cols)), shape=self.shape)
+
+    def sparsity(self):
+        '''
+        Sparsity structure of the jacobian (for least_squares(..., jac_sparsity=...) with finite differences).
+        '''
+        return sp.sparse.csr_matrix((np.ones(len(self._rows)), (self._rows, self._cols)), shape=self.shape)
+
+    def lnlike(self, theta):
+        '''
+        Log-likelihood of the data of every source, as lnlike, as an (n_sources,) array.
+        '''
+        inv_sigma2 = 1.0/self.y_err**2
+        return -0.5*np.add.reduceat(self._data_residual(theta)[0]**2 - np.log(inv_sigma2), self.offsets[:-1])
+
+    def lnprior(self, theta):
+        '''
+        Log-density of the hierarchical parameters under their population distributions.
+        '''
+        z = self._prior_residual(theta)
+        return -0.5*np.sum(z**2) - self.n_sources*np.sum(np.log(self.tau*np.sqrt(2*np.pi)))
+
+    def covariance(self, theta):
+        '''
+        Covariance of theta from the inverse of J^T J, computed blockwise (the per-source blocks are
+        independent given the global parameters), so the cost is linear in the number of sources.
+        Returns:
+            tuple : ((n_global, n_global) covariance of the global parameters,
+                     (n_sources, n_local, n_local) covariances of the per-source parameters)
+        '''
+        derivatives = self._data_residual(theta)[1]
+        starts = self.offsets[:-1]
+        n_hyper, n_global = len(self.hierarchical), len(self.global_names)
+        local = derivatives[:, self.local]
+        glob = np.zeros((len(self.y), n_global))
+        glob[:, n_hyper:] = derivatives[:, self.shared]
+        D = np.add.reduceat(local[:, :, None]*local[:, None, :], starts)
+        B = np.add.reduceat(glob[:, :, None]*local[:, None, :], starts)
+        A = glob.T @ glob
+        for h, i in enumerate(self.hierarchical):
+            l = self.local.index(i)
+            D[:, l, l] += 1./self.tau[h]**2
+            B[:, h, l] -= 1./self.tau[h]**2
+            A[h, h] += self.n_sources/self.tau[h]**2
+        D_inv = np.linalg.pinv(D)
+        BD = B @ D_inv
+        cov_global = np.linalg.pinv(A - np.einsum('sgl,shl->gh', BD, B)) if n_global else np.zeros((0, 0))
+        cov_local = D_inv + np.einsum('sgl,gh,shm->slm', BD, cov_global, BD)
+        return cov_global, cov_local
+
+def _bpl_start(x, y, y_err, log):
+    '''
+    Starting values of a broken power law: the best break of a log-grid sweep (see global_fit).
+    '''
+    x, y, y_err = (np.asarray(a, dtype=float) for a in (x, y, y_err))
+    if log:
+        log_x, log_y, sigma = x, y, y_err
+    else:
+        good = y > 0
+        log_x, log_y, sigma = np.log10(x[good]), np.log10(y[good]), y_err[good]/(y[good]*np.log(10))
+    log_breaks = np.log10(break_candidates(10**log_x, 2))
+    if len(log_breaks) == 0:
+        log_breaks = np.array([[np.median(log_x)]])
+    chi2, log_amplitude, alphas = _sweep_breaks(log_x, log_y, 1./sigma**2, log_breaks)
+    k = np.argmin(chi2)
+    return {"t_break": 10**log_breaks[k, 0], "alpha_1": alphas[k, 0], "alpha_2": alphas[k, 1], "amplitude": 10**log_amplitude[k]}
+
+def joint_fit(curves, shared=(), hierarchical=("alpha_2",), tau=None, init=None, bounds=None, log=False,
+              alpha_bounds=(-5., 10.), max_iter=20, tol=1e-3, tau_min=1e-3, **least_squares_kws):
+    '''
+    Fit broken power laws to a whole population of light curves in one solve: the shared and
+    hierarchical parameters together with the per-source breaks, slopes and amplitudes (see
+    PopulationBPL), by scipy.optimize.least_squares with the sparse analytic jacobian, so the cost
+    grows linearly with the number of sources. Unless tau is given, the scatter of every
+    hierarchical parameter is estimated as well, by alternating solves with the update
+    tau^2 = mean((value - mu)^2 + variance) over the sources (expectation-maximisation), until
+    it changes by less than tol (relative) or after max_iter solves.
+    Args:
+        curves : sequence of (x, y, x_err, y_err), as passed to cost_func_bpl (e.g. FitData.args)
+        shared, hierarchical : names of the shared and hierarchical parameters (see PopulationBPL)
+        tau : dict of hierarchical parameter -> fixed population scatter
+        init : per-source starting values, a sequence of dicts of t_break, alpha_1, alpha_2 and
+               amplitude; sources without (None, or init None) start from the best break of a
+               log-grid sweep
+        bounds : per-source bounds, a sequence of dicts of the same names -> (min, max) (default:
+                 the break within the times of the source, the slopes within alpha_bounds);
+                 shared and hierarchical parameters are bounded by the widest per-source bounds
+        log : fit the log-space residuals (see cost_func_bpl)
+        least_squares_kws : passed on to scipy.optimize.least_squares
+    Returns:
+        tuple : (table, population). table is a pandas.DataFrame with one row per source: best fit
+                values, their standard errors (as <param>_err), chisqr and n_points; population is a
+                dict of mu_<name>, mu_<name>_err and tau_<name> of every hierarchical parameter,
+                the values and errors of the shared ones, chisqr, redchi, nfev, n_iter and success
+    '''
+    fixed_tau = tau is not None
+    model = PopulationBPL(curves, shared, hierarchical, tau, log)
+    if init is None:
+        init = [None]*len(curves)
+    init = [start if start is not None else _bpl_start(curve[0], curve[1], curve[3], log) for curve, start in zip(curves, init)]
+    if bounds is None:
+        bounds = [{} for _ in curves]
+    to_internal = lambda name, value: np.log10(value) if name in ("t_break", "amplitude") else value
+    p0 = np.array([[to_internal(name, start[name]) for name in BPL_PARAMS] for start in init], dtype=float)
+    p_lower, p_upper = np.empty_like(p0), np.empty_like(p0)
+    for s, (curve, bound) in enumerate(zip(curves, bounds)):
+        log_x = np.asarray(curve[0], dtype=float) if log else np.log10(curve[0])
+        defaults = {"t_break": (10**np.min(log_x), 10**np.max(log_x)), "alpha_1": alpha_bounds,
+                    "alpha_2": alpha_bounds, "amplitude": (0., np.inf)}
+        with np.errstate(divide="ignore"):
+            for i, name in enumerate(BPL_PARAMS):
+                p_lower[s, i], p_upper[s, i] = (to_internal(name, limit) for limit in bound.get(name, defaults[name]))
+    p0 = np.clip(p0, p_lower, p_upper)
+    n_hyper, n_global = len(model.hierarchical), len(model.global_names)
+    theta = model.pack(p0, p0[:, model.hierarchical].mean(axis=0))
+    lower = model.pack(p_lower, p_lower[:, model.hierarchical].min(axis=0))
+    upper = model.pack(p_upper, p_upper[:, model.hierarchical].max(axis=0))
+    lower[n_hyper:n_global], upper[n_hyper:n_global] = p_lower[:, model.shared].min(axis=0), p_upper[:, model.shared].max(axis=0)
+    if not fixed_tau and n_hyper:
+        model.tau = np.maximum(p0[:, model.hierarchical].std(axis=0), 0.1)
+
+    kws = dict(method="trf", tr_solver="lsmr", x_scale="jac")
+    kws.update(least_squares_kws)
+    nfev = 0
+    with instrument.timed("fit", cost_func="joint_fit", method="least_squares") as timer:
+        for n_iter in range(1, max_iter+1):
+            solution = sp.optimize.least_squares(model.residual, np.clip(theta, lower, upper), jac=model.jacobian,
+                                                 bounds=(lower, upper), **kws)
+            theta, nfev = solution.x, nfev + solution.nfev
+            redchi = np.sum(solution.fun**2)/max(len(solution.fun) - len(theta), 1)
+            cov_global, cov_local = (cov*redchi for cov in model.covariance(theta))
+            if fixed_tau or not n_hyper:
+                break
+            p = model.unpack(theta)
+            variance = np.stack([cov_local[:, l, l] for l in (model.local.index(i) for i in model.hierarchical)], axis=1)
+            new_tau = np.maximum(np.sqrt(np.mean((p[:, model.hierarchical] - theta[:n_hyper])**2 + variance, axis=0)), tau_min)
+            converged = np.all(np.abs(new_tau/model.tau - 1) < tol)
+            model.tau = new_tau
+            if converged:
+                break
+        timer.add(nfev=nfev, success=bool(solution.success))
+
+    p = model.unpack(theta)
+    err = np.empty_like(p)
+    err[:, model.local] = np.sqrt(np.abs(np.diagonal(cov_local, axis1=1, axis2=2)))
+    err[:, model.shared] = np.sqrt(np.abs(np.diag(cov_global)[n_hyper:]))
+    values = p.copy()
+    for i in (0, 3):
+        values[:, i] = 10**p[:, i]
+        err[:, i] *= np.log(10)*values[:, i]
+    data_residual = solution.fun[:len(model.y)]
+    table = pd.DataFrame(values, columns=BPL_PARAMS)
+    for i, name in enumerate(BPL_PARAMS):
+        table[name+"_err"] = err[:, i]
+    table["chisqr"] = np.add.reduceat(data_residual**2, model.offsets[:-1])
+    table["n_points"] = np.diff(model.offsets)
+
+    population = {}
+    global_err = np.sqrt(np.abs(np.diag(cov_global)))
+    for h, i in enumerate(model.hierarchical):
+        name = BPL_PARAMS[i]
+        population.update({"mu_"+name: theta[h], "mu_"+name+"_err": global_err[h], "tau_"+name: model.tau[h]})
+    for i in model.shared:
+        name = BPL_PARAMS[i]
+        population.update({name: values[0, i], name+"_err": err[0, i]})
+    population.update(chisqr=float(np.sum(data_residual**2)), redchi=redchi, nfev=nfev, n_iter=n_iter, success=bool(solution.success))
+    return table, population
+
+
+#general posterior for MCMC fitting of n-broken power laws
+_SHARED_DATA = {}   # data of every NBrokenPosterior, bootstrap run, simulation and report, by key, so tasks do not copy it
+
+def share_data(key, data):
+    '''
+    Register data under key in this process (also used as the pool initializer, so that every
+    worker receives it once, at start-up); tasks look it up with shared_data(key).
+    '''
+    _SHARED_DATA[key] = data
+
+def shared_data(key):
+    return _SHARED_DATA[key]
+
+class NBrokenPosterior:
+    '''
+    Log-posterior of an n-broken power law with box or log-uniform priors, evaluated
+    for a whole ensemble of walkers at once.
+
+    theta is laid out as (tb0, ..., tb(n-2), alpha_0, ..., alpha_(n-1), amplitude), the
+    argument order of the *_batch models; breaks are additionally required to be increasing.
+    Args:
+        n : number of segments
+        x, y, yerr : light curve
+        priors : dict mapping each name in param_names to (low, high) for a uniform prior
+                 or (low, high, 'log') for a log-uniform one
+    '''
+
+    def __init__(self, n, x, y, yerr, priors):
+        self.n = n
+        self.param_names = ["tb"+str(i) for i in range(n-1)] + ["alpha_"+str(i) for i in range(n)] + ["amplitude"]
+        bounds = [priors[name] for name in self.param_names]
+        self.low = np.array([b[0] for b in bounds], dtype=float)
+        self.high = np.array([b[1] for b in bounds], dtype=float)
+        self.log_uniform = np.array([len(b) > 2 and b[2] == 'log' for b in bounds])
+        self.key = uuid.uuid4().hex
+        self._data = tuple(np.asarray(a, dtype=float) for a in (x, y, yerr))
+
+    def __getstate__(self):
+        #workers look the light curve up in _SHARED_DATA instead of unpickling it with every task
+        state = self.__dict__.copy()
+        del state["_data"]
+        return state
+
+    @property
+    def data(self):
+        return self.__dict__.get("_data") or _SHARED_DATA[self.key]
+
+    def log_prior(self, theta):
+        '''
+        Log-prior of an (n_walkers, n_params) array, up to a constant.
+        '''
+        theta = np.atleast_2d(theta)
+        inside = np.all((theta > self.low) & (theta < self.high), axis=1)
+        inside &= np.all(np.diff(theta[:, :self.n-1], axis=1) > 0, axis=1)
+        lp = np.full(len(theta), -np.inf)
+        lp[inside] = -np.sum(np.log(theta[inside][:, self.log_uniform]), axis=1)
+        return lp
+
+    def log_like(self, theta):
+        '''
+        Log-likelihood of an (n_walkers, n_params) array, as lnlike.
+        '''
+        x, y, yerr = self.data
+        theta = np.atleast_2d(theta)
+        model = nbroken_law_batch(x, theta[:, :self.n-1], theta[:, self.n-1:-1], theta[:, -1])
+        inv_sigma2 = 1.0/(yerr**2)
+        return -0.5*(np.sum((y-model)**2*inv_sigma2 - np.log(inv_sigma2), axis=1))
+
+    def __call__(self, theta):
+        '''
+        Log-posterior of an (n_walkers, n_params) array, for emcee.EnsembleSampler(vectorize=True).
+        '''
+        theta = np.atleast_2d(theta)
+        lp = self.log_prior(theta)
+        inside = np.isfinite(lp)
+        if np.any(inside):
+            lp[inside] += self.log_like(theta[inside])
+        return lp
+
+    def pool(self, processes=None):
+        '''
+        A multiprocessing.Pool whose workers receive the light curve once, at start-up.
+        '''
+        return multiprocessing.Pool(processes, initializer=share_data, initargs=(self.key, self.data))
+
+    def sample(self, p0, max_steps=100000, processes=None, check_interval=100, n_tau=50, tau_rtol=0.01, progress=False):
+        '''
+        Run emcee until the chains are converged or max_steps is reached. Converged means
+        the chains are longer than n_tau autocorrelation times and the autocorrelation time
+        estimate changed by less than tau_rtol since the previous check.
+        Args:
+            p0 : (n_walkers, n_params) starting positions
+            max_steps : maximum number of steps
+            processes : if given, the walkers of every step are split into one vectorized
+                        chunk per process of a pool (see pool())
+            check_interval : number of steps between convergence checks
+        Returns:
+            tuple : (sampler, tau, converged) with the emcee.EnsembleSampler, the last
+                    autocorrelation time estimate and whether the chains converged
+        '''
+        if processes is None or processes < 2:
+            return self._sample(self, p0, max_steps, check_interval, n_tau, tau_rtol, progress)
+        with self.pool(processes) as pool:
+            log_prob = lambda theta: np.concatenate(pool.map(self, np.array_split(theta, processes)))
+            return self._sample(log_prob, p0, max_steps, check_interval, n_tau, tau_rtol, progress)
+
+    @staticmethod
+    def _sample(log_prob, p0, max_steps, check_interval, n_tau, tau_rtol, progress):
+        p0 = np.atleast_2d(p0)
+        sampler = emcee.EnsembleSampler(len(p0), p0.shape[1], log_prob, vectorize=True)
+        tau, old_tau, converged = np.inf, np.inf, False
+        with instrument.timed("mcmc", walkers=len(p0)) as timer:
+            for _ in sampler.sample(p0, iterations=max_steps, progress=progress):
+                if sampler.iteration % check_interval:
+                    continue
+                tau = sampler.get_autocorr_time(tol=0)
+                converged = np.all(tau*n_tau < sampler.iteration) and np.all(np.abs(old_tau - tau)/tau < tau_rtol)
+                if converged:
+                    break
+                old_tau = tau
+            timer.add(steps=sampler.iteration, converged=bool(converged))
+        return sampler, tau, converged
+
+
+#bootstrap and jackknife uncertainties of least-squares fits
+def _resample_chunk(key, task):
+    '''
+    Refit one chunk of resamples of a bootstrap run registered under key (see bootstrap), each
+    warm-started from the best fit. task is the list of the seeds of its resamples for bootstraps
+    and the indices of the left-out points for a jackknife.
+    Returns:
+        array : (n_resamples, n_varying) best fit values, NaN where a fit failed
+    '''
+    data = _SHARED_DATA[key]
+    x, y, x_err, y_err = data["args"][:4]
+    extra, params, model, residual = data["args"][4:], data["params"], data["model"], data["residual"]
+    if data["kind"] == "jackknife":
+        resamples = ((np.delete(x, i), np.delete(y, i), np.delete(x_err, i), np.delete(y_err, i)) for i in task)
+    else:
+        rngs = (np.random.default_rng(seed) for seed in task)
+        if data["kind"] == "residual":
+            resamples = ((x, model - residual[rng.integers(0, len(y), len(y))]*y_err, x_err, y_err) for rng in rngs)
+        else:
+            resamples = ((x, model + y_err*rng.standard_normal(len(y)), x_err, y_err) for rng in rngs)
+    fit_kws = _jacobian_kws(data["cost_func"], data["method"])
+    rows = []
+    for resample in resamples:
+        try:
+            result = minimize(data["cost_func"], params, args=resample + extra, kws=data["kws"], method=data["method"], **fit_kws)
+            rows.append([result.params[name].value for name in data["names"]])
+        except Exception:
+            rows.append([np.nan]*len(data["names"]))
+    return np.array(rows, dtype=float).reshape(-1, len(data["names"]))
+
+def bootstrap(result, cost_func, args, n_resamples=1000, kind="residual", kws=None, ci=68.27, method="least_squares",
+              processes=None, n_chunks=None, seed=None):
+    '''
+    Bootstrap or jackknife the parameter uncertainties of a least-squares fit with any cost_func_*.
+    Every resample is refit starting from the best fit (with the analytic jacobian, see JACOBIANS).
+    Args:
+        result : lmfit MinimizerResult (or Parameters) of the best fit
+        cost_func, args : the cost function and its arguments after params, as passed to lm.minimize
+        n_resamples : number of bootstrap resamples (a jackknife always leaves out each point once)
+        kind : "residual" (resample the normalised residuals of the best fit), "parametric"
+               (add gaussian noise of size y_err to the best fit model) or "jackknife"
+        kws : keyword arguments of cost_func, e.g. {"log": True}
+        ci : width of the reported interval, in percent
+        processes : number of worker processes; the workers of the multiprocessing.Pool receive
+                    the data once, at start-up (None runs in this process)
+        n_chunks : number of tasks the resamples are split into (default 4 per process)
+        seed : seed of the resampling; every resample draws from its own child of it, so the
+               samples do not depend on processes or n_chunks
+    Returns:
+        tuple : (table, covariance, samples). table is a pandas.DataFrame indexed by the varying
+                parameters with the best fit value, median, low and high ends of the interval and
+                standard deviation; covariance is their covariance matrix (a DataFrame); samples the
+                (n_resamples, n_varying) array of refit values, NaN where a fit failed. Jackknife
+                intervals are the normal intervals of the jackknife standard deviation around the best fit.
+    '''
+    if kind not in ("residual", "parametric", "jackknife"):
+        raise ValueError("kind must be 'residual', 'parametric' or 'jackknife'")
+    params = getattr(result, "params", result)
+    kws = kws or {}
+    args = tuple(np.asarray(a, dtype=float) for a in args[:4]) + tuple(args[4:])
+    y, y_err = args[1], args[3]
+    residual = cost_func(params, *args, **kws)
+    names = [name for name, par in params.items() if par.vary]
+    data = dict(args=args, params=params, model=y + residual*y_err, residual=residual, cost_func=cost_func,
+                kws=kws, method=method, kind=kind, names=names)
+
+    if n_chunks is None:
+        n_chunks = 4*(processes or 1)
+    if kind == "jackknife":
+        tasks = [chunk for chunk in np.array_split(np.arange(len(y)), n_chunks) if len(chunk)]
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(n_resamples)
+        tasks = [seeds[chunk[0]:chunk[-1]+1] for chunk in np.array_split(np.arange(n_resamples), n_chunks) if len(chunk)]
+    key = uuid.uuid4().hex
+    if processes is None:
+        share_data(key, data)
+        try:
+            chunks = [_resample_chunk(key, task) for task in tasks]
+        finally:
+            del _SHARED_DATA[key]
+    else:
+        with multiprocessing.Pool(processes, initializer=share_data, initargs=(key, data)) as pool:
+            chunks = pool.starmap(_resample_chunk, [(key, task) for task in tasks])
+    samples = np.concatenate(chunks)
+
+    good = samples[np.all(np.isfinite(samples), axis=1)]
+    value = np.array([params[name].value for name in names])
+    if kind == "jackknife":
+        deviation = good - good.mean(axis=0)
+        covariance = (len(good) - 1)/len(good) * deviation.T @ deviation
+        std = np.sqrt(np.diag(covariance))
+        z = sp.stats.norm.ppf(0.5 + ci/200.)
+        median, low, high = value, value - z*std, value + z*std
+    else:
+        covariance = np.atleast_2d(np.cov(good, rowvar=False))
+        std = np.sqrt(np.diag(covariance))
+        low, median, high = np.percentile(good, [50. - ci/2., 50., 50. + ci/2.], axis=0)
+    table = pd.DataFrame({"value": value, "median": median, "low": low, "high": high, "std": std}, index=names)
+    return table, pd.DataFrame(covariance, index=names, columns=names), samples
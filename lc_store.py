@@ -0,0 +1,140 @@
+# Columnar binary store holding many light curves in a single memory-mapped file.
+# Build one with: python lc_store.py store.lcs afterglow_data/*_xray_batxrt.txt [--format fxrt]
+
+import argparse
+import json
+import os
+import threading
+import numpy as np
+import filecache
+
+COLUMNS = ('time', 'time_high', 'time_low', 'flux', 'flux_high', 'flux_low')
+MAGIC = b'LCSTORE1'
+ALIGN = 64
+
+_open_stores = {}   # path -> ((mtime, size), LightCurveStore), see open_store
+_open_lock = threading.Lock()
+
+
+def read_text_curve(filename, format="batxrt"):
+    '''
+    Read a light curve in either of the text layouts of the analysis_notebooks data folders.
+    Args:
+        filename : path+name
+        format : "batxrt" (swift_scrape output, tab separated with a header) or
+                 "fxrt" (whitespace separated time,flux,time_low,time_high,flux_low,flux_high)
+    Returns:
+        tuple : (time,time_high,time_low,flux,flux_high,flux_low), as lc_lmfit.get_individual_curves_log
+    '''
+    if format == "fxrt":
+        time,flux,time_low,time_high,flux_low,flux_high = np.loadtxt(filename, unpack=True, ndmin=2)
+        return time,time_high,time_low,flux,flux_high,flux_low
+    return tuple(np.genfromtxt(filename, delimiter='\t', unpack=True, skip_header=1, ndmin=2))
+
+
+def source_name(filename):
+    '''
+    Name under which a text light curve is stored: its file name without directory and extension.
+    '''
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def write_store(path, curves):
+    '''
+    Write light curves into one store file. The file holds a small JSON index (the row range
+    of every source) followed by a (6, n_rows) float64 array, so every column of every source
+    is a contiguous, memory-mappable slice.
+    Args:
+        path : store file to (over)write, atomically (see filecache.atomic_write)
+        curves : dict of name -> (time,time_high,time_low,flux,flux_high,flux_low)
+    '''
+    sources, start = {}, 0
+    for name, columns in curves.items():
+        n_rows = len(columns[0])
+        sources[name] = [start, start + n_rows]
+        start += n_rows
+    index = json.dumps({"columns": COLUMNS, "n_rows": start, "sources": sources}).encode('utf-8')
+    header = MAGIC + len(index).to_bytes(8, 'little') + index
+    header += b'\0' * (-len(header) % ALIGN)
+
+    data = np.empty((len(COLUMNS), start))
+    for name, columns in curves.items():
+        data[:, slice(*sources[name])] = columns
+
+    def write(f):
+        f.write(header)
+        data.tofile(f)
+    filecache.atomic_write(path, write)
+
+
+def build_store(path, filenames, format="batxrt"):
+    '''
+    Write the text light curves filenames (see read_text_curve) into one store file,
+    each under its source_name.
+    '''
+    write_store(path, {source_name(filename): read_text_curve(filename, format) for filename in filenames})
+
+
+class LightCurveStore:
+    '''
+    Read-only view of a store file (see write_store). store[name] returns the six columns of
+    a source as zero-copy slices of one np.memmap, in the order of get_individual_curves_log.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(path + ' is not a light curve store')
+            index_size = int.from_bytes(f.read(8), 'little')
+            index = json.loads(f.read(index_size).decode('utf-8'))
+        offset = len(MAGIC) + 8 + index_size
+        offset += -offset % ALIGN
+        self.sources = {name: slice(*rows) for name, rows in index["sources"].items()}
+        shape = (len(index["columns"]), index["n_rows"])
+        self.data = np.memmap(path, dtype=np.float64, mode='r', offset=offset, shape=shape) if shape[1] else np.empty(shape)
+
+    def __contains__(self, name):
+        return name in self.sources
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __getitem__(self, name):
+        return tuple(self.data[:, self.sources[name]])
+
+    def rows(self, name):
+        '''
+        The source as an (n_points, 6) view, as np.genfromtxt without unpack.
+        '''
+        return self.data[:, self.sources[name]].T
+
+
+def open_store(path):
+    '''
+    Open a store file once per process; it is reopened only if the file changed since.
+    '''
+    stat = os.stat(path)
+    with _open_lock:
+        cached = _open_stores.get(path)
+        if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+            cached = ((stat.st_mtime_ns, stat.st_size), LightCurveStore(path))
+            _open_stores[path] = cached
+    return cached[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect text light curves into one light curve store.")
+    parser.add_argument("store", help="store file to write")
+    parser.add_argument("files", nargs="+", help="text light curves")
+    parser.add_argument("--format", default="batxrt", choices=("batxrt", "fxrt"), help="layout of the text files")
+    args = parser.parse_args(argv)
+    build_store(args.store, args.files, args.format)
+    print("Wrote {} light curves to {}".format(len(args.files), args.store))
+
+
+if __name__ == "__main__":
+    main()
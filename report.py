@@ -0,0 +1,176 @@
+# Parallel rendering of catalogue fit figures: one panel per source and multi-panel summary grids.
+# Usage: python report.py manifest.json fit_parameters.csv -o report/ [--workers N] [--grid 5x3]
+
+import argparse
+import math
+import multiprocessing
+import os
+import numpy as np
+import lc_lmfit
+from lazy import lazy_import
+
+pd = lazy_import("pandas")
+mpl_figure = lazy_import("matplotlib.figure")
+backend_agg = lazy_import("matplotlib.backends.backend_agg")
+
+_CURVES = "report.curves"   # key of the light curves in the workers, see lc_lmfit.share_data
+
+
+def model_curve(row, model, t_min, t_max, n=None, n_grid=100):
+    '''
+    Best fit model of a catalogue row on n_grid log-spaced times between t_min and t_max
+    (instead of at every data point). A "bpl" row without a break (NaN t_break) is drawn as
+    a power law, as in the FXRT tables.
+    Args:
+        row : mapping of parameter names to best fit values (a row of fit_catalogue's table)
+        model : one of catalogue.MODELS ("nbpl" also needs n)
+    Returns:
+        tuple : (x, y) arrays
+    '''
+    x = np.geomspace(t_min, t_max, n_grid)
+    if model == "pl" or (model == "bpl" and np.isnan(row["t_break"])):
+        return x, lc_lmfit.power_law(x, row["alpha_1"], row["amplitude"])
+    if model == "bpl":
+        return x, lc_lmfit.broken_power_law(x, row["t_break"], row["alpha_1"], row["alpha_2"], row["amplitude"])
+    n = 3 if model == "dbl" else n
+    breaks = [row["tb"+str(i)] for i in range(n-1)]
+    alphas = [row["alpha_"+str(i)] for i in range(n)]
+    return x, lc_lmfit.nbroken_law(x, breaks, alphas, row["amplitude"])
+
+
+def _draw_panel(ax, panel, n_grid, minor_ticks):
+    name, row, model, n = panel
+    time, time_high, time_low, flux, flux_high, flux_low, t_min, t_max = lc_lmfit.shared_data(_CURVES)[name]
+    ax.errorbar(time, flux, fmt='.', xerr=[time_low, time_high], yerr=[flux_low, flux_high], markersize=5,
+                label='data', color='green')
+    x, y = model_curve(row, model, t_min, t_max, n=n, n_grid=n_grid)
+    ax.loglog(x, y, label='best fit', color='red', zorder=10)
+    ax.set_xlabel(r'$\mathrm{Time(s)}$', fontsize=12.)
+    ax.set_ylabel(r'$\mathrm{Flux}$', fontsize=12.)
+    ax.set_title(name, fontsize=10)
+    if not minor_ticks:
+        ax.minorticks_off()
+
+
+def _render_figure(task):
+    '''
+    Draw the panels of one figure on a non-interactive Agg canvas and save it.
+    task is (path, panels, shape, figsize, dpi, n_grid, minor_ticks), with panels a list of (name, row, model, n).
+    '''
+    path, panels, (n_rows, n_cols), figsize, dpi, n_grid, minor_ticks = task
+    fig = mpl_figure.Figure(figsize=figsize, dpi=dpi)
+    backend_agg.FigureCanvasAgg(fig)
+    fig.patch.set_facecolor('white')
+    for i, panel in enumerate(panels):
+        _draw_panel(fig.add_subplot(n_rows, n_cols, i+1), panel, n_grid, minor_ticks)
+    # fixed margins: bbox_inches='tight' would draw every figure twice
+    fig.subplots_adjust(left=0.9/figsize[0], right=1 - 0.2/figsize[0], bottom=0.55/figsize[1], top=1 - 0.3/figsize[1],
+                        hspace=0.5, wspace=0.45)
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def load_curves(manifest):
+    '''
+    The light curves of the sources of a manifest (see catalogue.read_manifest), each read once
+    (see catalogue.load_source): every point of the file, and the first and last time of the fit window.
+    Returns:
+        tuple : (curves, failed). curves maps names to (time,time_high,time_low,flux,flux_high,flux_low,t_min,t_max);
+                failed maps the names of unreadable sources to the reason
+    '''
+    import catalogue
+    curves, failed = {}, {}
+    for source in manifest["sources"]:
+        try:
+            data = catalogue.load_source(source, manifest.get("store"), rebin=False)
+            curves[source["name"]] = tuple(np.asarray(column) for column in data.curve) + (data.time[0], data.time[-1])
+        except Exception as err:
+            failed[source["name"]] = "{}: {}".format(type(err).__name__, err)
+    return curves, failed
+
+
+def render_report(manifest, table, output, workers=None, grid=(5, 3), panels=True, n_grid=100, dpi=100, minor_ticks=False, curves=None):
+    '''
+    Render the fit of every source of a catalogue: one figure per source and summary grids of
+    grid[0] x grid[1] panels (as eegrb_fits.png and fxrt_refit_paper*.png), in a pool of worker
+    processes. The light curves are read once and handed to every worker at start-up, and the
+    models are drawn on n_grid log-spaced times.
+    Args:
+        manifest : manifest dict, or path to a manifest file (see catalogue.read_manifest)
+        table : fit results, the table of catalogue.fit_catalogue or the path of its csv file
+        output : directory to write the figures to
+        workers : number of worker processes (None runs in this process)
+        panels : also write one figure per source
+        minor_ticks : draw the minor ticks of the log axes (they take about half of the drawing time)
+        curves : light curves already loaded by load_curves, to reuse instead of reading the files
+    Returns:
+        tuple : (written, skipped). written lists the figure files; skipped maps the names of
+                sources without fit results or readable data to the reason
+    '''
+    import catalogue
+    if isinstance(manifest, str):
+        manifest = catalogue.read_manifest(manifest)
+    if isinstance(table, str):
+        table = pd.read_csv(table)
+    if curves is None:
+        curves, skipped = load_curves(manifest)
+    else:
+        skipped = {}
+    name_column = manifest.get("name_column", "name")
+    rows = {row[name_column]: row for row in table.to_dict("records")}
+
+    figures = []
+    for source in manifest["sources"]:
+        name = source["name"]
+        if name in skipped:
+            continue
+        if name not in rows:
+            skipped[name] = "no fit results"
+        elif name not in curves:
+            skipped[name] = "no light curve"
+        else:
+            figures.append((name, rows[name], source["model"], source.get("n")))
+
+    os.makedirs(output, exist_ok=True)
+    tasks = []
+    if panels:
+        tasks += [(os.path.join(output, panel[0].replace(os.sep, "_") + ".png"), [panel], (1, 1), (5., 4.), dpi, n_grid, minor_ticks)
+                  for panel in figures]
+    per_page = grid[0]*grid[1]
+    for page in range(math.ceil(len(figures)/per_page)):
+        page_panels = figures[page*per_page:(page+1)*per_page]
+        n_rows = math.ceil(len(page_panels)/grid[1])
+        tasks.append((os.path.join(output, "summary_{}.png".format(page)), page_panels, (n_rows, grid[1]),
+                      (4.*grid[1], 3.*n_rows), dpi, n_grid, minor_ticks))
+
+    if workers is None:
+        lc_lmfit.share_data(_CURVES, curves)
+        written = [_render_figure(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers, initializer=lc_lmfit.share_data, initargs=(_CURVES, curves)) as pool:
+            written = list(pool.imap_unordered(_render_figure, tasks))
+    return written, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the fits of a catalogue in parallel.")
+    parser.add_argument("manifest", help="JSON manifest of the sources (see catalogue.py)")
+    parser.add_argument("table", help="fit parameter table written by catalogue.py")
+    parser.add_argument("-o", "--output", default="report", help="directory to write the figures to")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-g", "--grid", default="5x3", help="rows x columns of the summary grids")
+    parser.add_argument("--no-panels", action="store_true", help="only write the summary grids")
+    parser.add_argument("--dpi", type=int, default=100, help="resolution of the figures")
+    parser.add_argument("--minor-ticks", action="store_true", help="draw the minor ticks of the log axes")
+    args = parser.parse_args(argv)
+
+    grid = tuple(int(size) for size in args.grid.split("x"))
+    written, skipped = render_report(args.manifest, args.table, args.output, workers=args.workers, grid=grid,
+                                     panels=not args.no_panels, dpi=args.dpi, minor_ticks=args.minor_ticks)
+    print("Wrote {} figures to {}".format(len(written), args.output))
+    for name, reason in skipped.items():
+        print("Skipped {}: {}".format(name, reason))
+
+
+if __name__ == "__main__":
+    main()
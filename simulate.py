@@ -0,0 +1,188 @@
+# Injection-recovery simulations of n-broken power law fits on the cadence and errors of real light curves.
+# Usage: python simulate.py afterglow_data/*_xray_batxrt.txt -o recovery.csv -N 10000 [-n 2] [--workers N]
+
+import argparse
+import csv
+import multiprocessing
+import numpy as np
+import lc_lmfit
+import lc_store
+from lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+_TEMPLATES = "simulate.templates"   # key of the templates in the workers, see lc_lmfit.share_data
+
+
+def load_templates(filenames, format="batxrt", store=None):
+    '''
+    Cadence and error templates of real light curves (see lc_store.read_text_curve for format):
+    the times and time errors of the points with positive time and flux, and their fractional flux errors.
+    Returns:
+        list : dicts with name, time, time_err and rel_err
+    '''
+    templates = []
+    for filename in filenames:
+        data = lc_lmfit.fit_data(filename, store=store, format=format)
+        good = (data.x > 0) & (data.y > 0)
+        templates.append({"name": lc_store.source_name(filename), "time": data.x[good], "time_err": data.x_err[good],
+                          "rel_err": (data.y_err/data.y)[good]})
+    return templates
+
+
+def draw_parameters(rng, n_sets, n, time, alpha_range=(-0.5, 3.), amplitude_range=(1e-12, 1e-9), break_quantiles=(0.1, 0.9)):
+    '''
+    Draw n_sets n-broken power laws: breaks log-uniform between the break_quantiles of the log
+    times of a template, slopes uniform in alpha_range and amplitudes log-uniform in amplitude_range.
+    Returns:
+        array : (n_sets, 2n) parameter sets laid out as (tb0, ..., alpha_0, ..., amplitude)
+    '''
+    low, high = np.quantile(np.log10(time), break_quantiles)
+    breaks = np.sort(10**rng.uniform(low, high, (n_sets, n-1)), axis=1)
+    alphas = rng.uniform(alpha_range[0], alpha_range[1], (n_sets, n))
+    amplitude = 10**rng.uniform(np.log10(amplitude_range[0]), np.log10(amplitude_range[1]), (n_sets, 1))
+    return np.hstack((breaks, alphas, amplitude))
+
+
+def simulate_batch(rng, template, theta, n):
+    '''
+    Evaluate a batch of parameter sets (see draw_parameters) on the cadence of a template as one
+    array operation, and add gaussian noise with the template's fractional errors.
+    Returns:
+        tuple : (y, y_err) arrays of shape (n_sets, n_points)
+    '''
+    y_true = lc_lmfit.nbroken_law_batch(template["time"], theta[:, :n-1], theta[:, n-1:2*n-1], theta[:, -1])
+    y_err = template["rel_err"] * y_true
+    return y_true + y_err*rng.standard_normal(y_true.shape), y_err
+
+
+def param_names(n):
+    return ["tb"+str(i) for i in range(n-1)] + ["alpha_"+str(i) for i in range(n)] + ["amplitude"]
+
+
+def fieldnames(n):
+    names = param_names(n)
+    return (["realisation", "template", "n_points"] + ["true_"+name for name in names] + ["fit_"+name for name in names]
+            + ["err_"+name for name in names] + ["chisqr", "redchi", "nfev", "success"])
+
+
+def _simulate_chunk(task):
+    '''
+    Draw, simulate and fit one batch of realisations, each fit started from a global sweep over
+    the break times (see lc_lmfit.global_fit).
+    Returns:
+        list : one row (dict, see fieldnames) per realisation
+    '''
+    seed, index, start, size, n, options = task
+    rng = np.random.default_rng(seed)
+    template = lc_lmfit.shared_data(_TEMPLATES)[index]
+    draw_kws = {key: options[key] for key in ("alpha_range", "amplitude_range", "break_quantiles") if key in options}
+    theta = draw_parameters(rng, size, n, template["time"], **draw_kws)
+    y, y_err = simulate_batch(rng, template, theta, n)
+    names = param_names(n)
+
+    rows = []
+    for k in range(size):
+        row = {"realisation": start+k, "template": template["name"], "n_points": len(template["time"])}
+        row.update({"true_"+name: value for name, value in zip(names, theta[k])})
+        try:
+            _, results = lc_lmfit.global_fit(template["time"], y[k], template["time_err"], y_err[k], n,
+                                             top_k=options.get("top_k", 2), n_grid=options.get("n_grid", 20))
+            result = results[0]
+            row.update({"fit_"+name: result.params[name].value for name in names})
+            row.update({"err_"+name: result.params[name].stderr for name in names})
+            row.update(chisqr=result.chisqr, redchi=result.redchi, nfev=result.nfev, success=result.success)
+        except Exception:
+            row["success"] = False
+        rows.append(row)
+    return rows
+
+
+def simulate(templates, n_realisations, output, n=2, batch_size=100, processes=None, seed=None, **options):
+    '''
+    Run an injection-recovery simulation and stream one row per realisation to a csv file.
+    Realisations are drawn and fitted in batches of batch_size, cycling through the templates;
+    only the batches in flight are held in memory, however many realisations are run.
+    Args:
+        templates : see load_templates
+        n_realisations : number of synthetic light curves
+        output : csv file to write (see fieldnames for the columns)
+        n : number of segments of the injected and fitted models
+        processes : number of worker processes (None runs in this process)
+        seed : seed of the whole simulation; batch i uses the i-th spawned seed
+        options : alpha_range, amplitude_range, break_quantiles (see draw_parameters), and top_k, n_grid (see lc_lmfit.global_fit)
+    Returns:
+        int : number of realisations written
+    '''
+    n_batches = -(-n_realisations // batch_size)
+    tasks = ((np.random.SeedSequence(seed, spawn_key=(i,)), i % len(templates), i*batch_size,
+              min(batch_size, n_realisations - i*batch_size), n, options) for i in range(n_batches))
+    written = 0
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames(n))
+        writer.writeheader()
+        if processes is None:
+            lc_lmfit.share_data(_TEMPLATES, templates)
+            for rows in map(_simulate_chunk, tasks):
+                writer.writerows(rows)
+                written += len(rows)
+        else:
+            with multiprocessing.Pool(processes, initializer=lc_lmfit.share_data, initargs=(_TEMPLATES, templates)) as pool:
+                for rows in pool.imap_unordered(_simulate_chunk, tasks):
+                    writer.writerows(rows)
+                    f.flush()
+                    written += len(rows)
+    return written
+
+
+def recovery_summary(output, chunksize=100000):
+    '''
+    Recovery statistics of a simulation output file, read in chunks: for every parameter the
+    number of successful fits, the bias and scatter of fit - true (in dex for the breaks and the
+    amplitude) and the fraction of fits within one standard error of the truth. Fits with a
+    non-positive amplitude are left out, as is every value that is not finite (e.g. a missing
+    standard error only leaves the fit out of the coverage).
+    Returns:
+        pandas.DataFrame : indexed by parameter, with columns n, bias, scatter, coverage
+    '''
+    totals = {}
+    for chunk in pd.read_csv(output, chunksize=chunksize):
+        chunk = chunk[(chunk["success"] == True) & (chunk["fit_amplitude"] > 0)]
+        for name in [column[4:] for column in chunk.columns if column.startswith("fit_")]:
+            true, fit, err = chunk["true_"+name], chunk["fit_"+name], chunk["err_"+name]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                diff = np.log10(fit/true) if name.startswith("tb") or name == "amplitude" else fit - true
+            finite = np.isfinite(diff)
+            with_err = finite & np.isfinite(err)
+            covered = np.abs(fit - true)[with_err] <= err[with_err]
+            total = totals.setdefault(name, np.zeros(5))
+            total += [finite.sum(), diff[finite].sum(), (diff[finite]**2).sum(), covered.sum(), with_err.sum()]
+    rows = {}
+    for name, (count, total, squares, covered, n_err) in totals.items():
+        bias = total/count if count else np.nan
+        scatter = np.sqrt(max(squares/count - bias**2, 0.)) if count else np.nan
+        rows[name] = {"n": int(count), "bias": bias, "scatter": scatter, "coverage": covered/n_err if n_err else np.nan}
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Injection-recovery simulation of n-broken power law fits.")
+    parser.add_argument("templates", nargs="+", help="real light curves whose cadence and errors are used")
+    parser.add_argument("-o", "--output", default="recovery.csv", help="output csv, one row per realisation")
+    parser.add_argument("-N", "--realisations", type=int, default=1000, help="number of synthetic light curves")
+    parser.add_argument("-n", "--segments", type=int, default=2, help="number of power law segments")
+    parser.add_argument("--format", default="batxrt", choices=("batxrt", "fxrt"), help="layout of the template files")
+    parser.add_argument("-b", "--batch-size", type=int, default=100, help="realisations per batch")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the simulation")
+    args = parser.parse_args(argv)
+
+    templates = [template for template in load_templates(args.templates, args.format) if len(template["time"]) > 2*args.segments]
+    written = simulate(templates, args.realisations, args.output, n=args.segments, batch_size=args.batch_size,
+                       processes=args.workers, seed=args.seed)
+    print("Wrote {} realisations to {}".format(written, args.output))
+    print(recovery_summary(args.output))
+
+
+if __name__ == "__main__":
+    main()
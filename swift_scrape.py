@@ -8,30 +8,361 @@ Documentation for get_targetIDs, get_xrt, get_xrtdense added by Kruthi Krishna
 
 
 import numpy as np
-import urllib
 import os
-from astropy.table import Table
-from astropy.io import ascii
-from urllib.error import HTTPError
+import io
+import json
+import time
+import hashlib
+import tarfile
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit, urljoin
+import instrument
+import filecache
+# astropy is imported inside the functions that build tables, so that importing this module stays light
 
 
-def get_targetIDs(loc, url='https://www.swift.ac.uk/xrt_curves/grb.list',save=True):
+SWIFT_URL = 'https://www.swift.ac.uk/'	# Base of the UKSSDC urls; point this at a local server for testing.
+GCN_URL = 'https://gcn.gsfc.nasa.gov/'
+
+
+class HTTPClient:
+	"""
+	Minimal thread-safe HTTP(S) client used for all downloads in this module.
+
+	Each thread keeps one keep-alive connection per host, at most max_connections requests
+	are in flight at once, requests to the same host are spaced by at least min_interval
+	seconds, and connection errors, 429 and 5xx responses are retried with exponential backoff
+	(waiting at least the Retry-After seconds the server asks for). Other HTTP errors raise
+	urllib.error.HTTPError, like urllib.request.urlopen.
+	"""
+
+	def __init__(self, max_connections=8, retries=3, backoff=0.5, min_interval=0., timeout=60.):
+		self.retries = retries
+		self.backoff = backoff
+		self.min_interval = min_interval
+		self.timeout = timeout
+		self._slots = threading.BoundedSemaphore(max_connections)
+		self._local = threading.local()
+		self._host_lock = threading.Lock()
+		self._next_request = {}
+
+	def _connection(self, scheme, netloc, fresh=False):
+		connections = self._local.__dict__.setdefault('connections', {})
+		if fresh and (scheme, netloc) in connections:
+			connections.pop((scheme, netloc)).close()
+		if (scheme, netloc) not in connections:
+			cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+			connections[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+		return connections[(scheme, netloc)]
+
+	def _wait_turn(self, netloc):
+		# Reserve the next free time slot for this host, then sleep until it arrives.
+		with self._host_lock:
+			now = time.monotonic()
+			start = max(now, self._next_request.get(netloc, now))
+			self._next_request[netloc] = start + self.min_interval
+		if start > now:
+			time.sleep(start - now)
+
+	def get(self, url, headers=None, max_redirects=5):
+		"""
+		GET a url, following redirects.
+
+		Returns:
+			tuple : (status, response headers, body bytes)
+		"""
+		with instrument.timed('http', url=url) as timer:
+			return self._get(url, headers, max_redirects, timer)
+	
+	def _get(self, url, headers, max_redirects, timer):
+		for attempt in range(self.retries + 1):
+			delay = self.backoff * 2**attempt
+			target = url
+			try:
+				for _ in range(max_redirects + 1):
+					parts = urlsplit(target)
+					path = parts.path + ('?' + parts.query if parts.query else '')
+					self._wait_turn(parts.netloc)
+					with self._slots:
+						conn = self._connection(parts.scheme, parts.netloc, fresh=attempt > 0)
+						conn.request('GET', path or '/', headers=headers or {})
+						response = conn.getresponse()
+						body = response.read()
+					if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+						target = urljoin(target, response.getheader('Location'))
+						continue
+					break
+			except (OSError, http.client.HTTPException) as err:
+				if attempt == self.retries:
+					raise URLError(err)
+			else:
+				if response.status < 400:
+					timer.add(status=response.status, bytes=len(body), attempts=attempt+1)
+					return response.status, response.headers, body
+				if (response.status != 429 and response.status < 500) or attempt == self.retries:
+					raise HTTPError(target, response.status, response.reason, response.headers, None)
+				retry_after = response.getheader('Retry-After', '')
+				if retry_after.strip().isdigit():
+					delay = max(delay, float(retry_after))
+			time.sleep(delay)
+
+
+client = HTTPClient()	# Shared by every function in this module; replace it to change the pooling, retry or rate-limit settings.
+
+
+def _read_url(url):
+	"""
+	Download a url with the shared client and return its text split into lines.
+	"""
+	return client.get(url)[2].decode('utf-8').splitlines()
+
+
+class ProductCache:
+	"""
+	On-disk cache of parsed light-curve products, shared safely by concurrent workers.
+
+	Each product is stored in one .npz file named by the hash of its key, e.g.
+	(GRB, targetID, product, snr, band, evolving), next to a small .json file with the url it came
+	from and that url's ETag/Last-Modified validators. A cached product is revalidated with a
+	conditional GET, so an unchanged product costs a 304 response, no parsing and only a rewrite of
+	its .json file. Files are written to a temporary name and atomically renamed, and the least
+	recently used products are evicted once the cache grows beyond max_bytes.
+
+	Args:
+		root (str): Directory of the cache, e.g. loc+'cache/'.
+		max_bytes (int, optional): Size limit of the cache. Defaults to 1 GB.
+		max_age (float, optional): Seconds during which a product is used without revalidation. Defaults to 0.
+	"""
+
+	def __init__(self, root, max_bytes=2**30, max_age=0.):
+		self.root = root
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		os.makedirs(root, exist_ok=True)
+
+	def path(self, key):
+		return os.path.join(self.root, hashlib.sha256(repr(key).encode('utf-8')).hexdigest()+'.npz')
+
+	@staticmethod
+	def meta_path(path):
+		return os.path.splitext(path)[0]+'.json'
+
+	def fetch(self, key, url, parse):
+		"""
+		Returns the product for key, downloading url and parsing it with parse(body) only if it changed.
+
+		Returns:
+			tuple : (data, changed) with the parsed structured array and whether it was (re)downloaded
+		"""
+		path = self.path(key)
+		try:
+			with open(self.meta_path(path)) as f:
+				meta = json.load(f)
+			with np.load(path) as cached:
+				data = cached['data']
+		except (OSError, KeyError, ValueError):
+			data, meta = None, {}
+		
+		headers = {}
+		if data is not None and meta.get('url') == url:
+			if time.time() - meta['fetched'] < self.max_age:
+				os.utime(path)
+				return data, False
+			if meta.get('etag'):
+				headers['If-None-Match'] = meta['etag']
+			if meta.get('last_modified'):
+				headers['If-Modified-Since'] = meta['last_modified']
+		
+		status, response_headers, body = client.get(url, headers=headers)
+		if status == 304 and data is not None:
+			# A 304 may leave out validators that did not change: keep the old ones, and the payload.
+			meta.update(fetched=time.time(), etag=response_headers.get('ETag') or meta.get('etag'),
+						last_modified=response_headers.get('Last-Modified') or meta.get('last_modified'))
+			self._write_meta(path, meta)
+			os.utime(path)
+			return data, False
+		
+		data = parse(body)
+		meta = {'url': url, 'fetched': time.time(), 'etag': response_headers.get('ETag'), 'last_modified': response_headers.get('Last-Modified')}
+		filecache.atomic_write(path, lambda f: np.savez(f, data=data))
+		self._write_meta(path, meta)
+		self.evict()
+		return data, True
+
+	def _write_meta(self, path, meta):
+		filecache.atomic_write(self.meta_path(path), lambda f: json.dump(meta, f), mode='w')
+
+	def evict(self):
+		"""
+		Removes the least recently used products until the cache is within max_bytes.
+		"""
+		filecache.evict_lru(os.path.join(self.root, '*.npz'), self.max_bytes, companions=lambda path: (self.meta_path(path),))
+
+
+def _fetch_product(cache, key, url, parse):
+	"""
+	Downloads and parses a product, through cache if one is given (see ProductCache.fetch).
+	"""
+	if cache is None:
+		return parse(client.get(url)[2]), True
+	return cache.fetch(key, url, parse)
+
+
+def _parse_flux_qdp(body):
+	"""
+	Parses a downloaded flux.qdp, raising LookupError if the server returned a web page instead.
+	"""
+	lines = body.decode('utf-8').splitlines()
+	if lines[0][0] == '<':
+		raise LookupError('Webpage exists but data file does not')
+	return read_qdp(lines)
+
+
+QDP_DTYPE = [('time', float), ('tpos', float), ('tneg', float), ('flux', float), ('fpos', float), ('fneg', float), ('segment', 'U3')]
+QDP_COLUMNS = ('time', 'tpos', 'tneg', 'flux', 'fpos', 'fneg')
+
+
+def read_qdp(source, segment=''):
+	"""
+	Parses a 6-column Swift QDP light curve (e.g. flux.qdp or the BAT/WT/PC files of the burst analyser).
+
+	Each line is tokenized once; 'NO' separators, '!' comment and header lines and any line without
+	exactly six columns are skipped, and the remaining rows are converted in bulk.
+
+	Args:
+		source: A filename, an open (text or binary) file, or an iterable of lines.
+		segment (str, optional): Label stored in every row, e.g. 'BAT', 'WT' or 'PC'.
+
+	Returns:
+		data (numpy structured array): Fields 'time','tpos','tneg','flux','fpos','fneg' (with tneg and fneg made positive) and 'segment'
+	"""
+	if isinstance(source, str):
+		with open(source, 'r') as f:
+			return read_qdp(f, segment)
+	
+	with instrument.timed('parse_qdp', segment=segment) as timer:
+		rows = []
+		for line in source:
+			if isinstance(line, bytes):
+				line = line.decode('utf-8')
+			tokens = line.split()
+			if len(tokens) == 6 and tokens[0] != 'NO' and tokens[0][0] != '!':
+				rows.append(line)
+		values = np.loadtxt(rows, ndmin=2) if rows else np.empty((0, 6))
+	
+		data = np.empty(len(values), dtype=QDP_DTYPE)
+		for i, name in enumerate(QDP_COLUMNS):
+			data[name] = values[:, i]
+		data['tneg'] = np.abs(data['tneg'])
+		data['fneg'] = np.abs(data['fneg'])
+		data['segment'] = segment
+		timer.add(rows=len(data))
+	return data
+
+
+def _read_tar_qdp(tar, members, GRB):
+	"""
+	Parses QDP members of an open tarfile straight into read_qdp, without extracting anything to disk.
+
+	Member names are compared after normalisation (so './' prefixes do not matter); a member that is
+	nested differently is still found by its file name.
+
+	Args:
+		tar (tarfile.TarFile): The open tarball.
+		members (list): (segment, member name) pairs, in the order to concatenate them.
+		GRB (str): The name of the GRB, for the messages about missing members.
+
+	Returns:
+		data (numpy structured array): The concatenated segments, see read_qdp.
+
+	Raises:
+		LookupError: If the tarball holds none of the members.
+	"""
+	paths = {_member_path(name): name for segment, name in members}
+	basenames = {os.path.basename(path): name for path, name in paths.items()}
+	segments_of = {name: segment for segment, name in members}
+	exact, nested = {}, {}
+	with instrument.timed('tar', GRB=GRB) as timer:
+		for member in tar:
+			if not member.isfile():
+				continue
+			path = _member_path(member.name)
+			if path in paths:
+				exact[paths[path]] = member
+			elif os.path.basename(path) in basenames:
+				nested.setdefault(basenames[os.path.basename(path)], member)
+		nested.update(exact)
+		found = {name: read_qdp(tar.extractfile(member), segments_of[name]) for name, member in nested.items()}
+		timer.add(members=len(found))
+	if not found:
+		raise LookupError('None of '+', '.join(name for _, name in members)+' is in the tarball of '+GRB)
+	
+	segments = []
+	for segment, name in members:
+		if name not in found:	# Pass if there is no file for this segment
+			print('No '+segment+' file found for '+GRB)
+			continue
+		segments.append(found[name])
+		if segment == 'BAT' and len(found[name]) and max(found[name]['flux']) == 0.:
+			print('WARNING: the maximum BAT flux in this file = 0. This can often be solved by re-running swift_scrape with the keyword evolving = True.')
+	return np.concatenate(segments) if segments else np.empty(0, dtype=QDP_DTYPE)
+
+
+def _member_path(name):
+	"""
+	Normalised path of a tarball member, e.g. './00012345/bat/x.qdp' -> '00012345/bat/x.qdp'.
+	"""
+	return os.path.normpath(name).lstrip('/')
+
+
+def _extract_tar(tar, path):
+	"""
+	Extracts a whole tarball under path (used when the download is kept).
+	"""
+	if hasattr(tarfile, 'data_filter'):
+		tar.extractall(path, filter='data')
+	else:
+		tar.extractall(path)
+
+
+def _qdp_table(data, names=QDP_COLUMNS):
+	"""
+	Converts the output of read_qdp into an astropy Table sorted by time.
+	"""
+	from astropy.table import Table
+	table = Table([data[name] for name in QDP_COLUMNS], names=names)
+	table.sort('time')
+	return table
+
+
+def _write_table(data, filename):
+	"""
+	Writes an astropy Table as a tab-separated csv file through filecache.atomic_write, so that a
+	concurrent reader never sees a half-written file and a failed write leaves the old one in place.
+	"""
+	filecache.atomic_write(filename, lambda f: data.write(f,format='csv',delimiter='\t'), mode='w')
+
+
+def get_targetIDs(loc, url=None,save=True):
 	"""
 	get_targetIDs function populates a lookup table of GRBs vs their target IDs.
  
 	Args:
 		loc = directory path to save the targetIDs.txt file
+		url = url of the GRB list, defaults to SWIFT_URL+'xrt_curves/grb.list'
 	"""
+	from astropy.table import Table
 
-	with urllib.request.urlopen(url) as f:
-		string = f.read().decode('utf-8').splitlines()
-	
-	GRB = []
-	targetID = []
+	if url is None:
+		url = SWIFT_URL+'xrt_curves/grb.list'
+	string = _read_url(url)
 	
-	for line in string:
-		GRB = np.append(GRB,line.split()[1])
-		targetID = np.append(targetID,line.split()[2])
+	rows = [line.split() for line in string]
+	GRB = [row[1] for row in rows]
+	targetID = [row[2] for row in rows]
 		
 	IDs = Table([GRB,targetID],names=('GRB','targetID'))
 	
@@ -43,7 +374,70 @@ def get_targetIDs(loc, url='https://www.swift.ac.uk/xrt_curves/grb.list',save=Tr
 	return IDs
 
 
-def get_xrt(GRB,loc, uselocal=True,keep=False):
+persist_target_index = False	# Set to True to keep a binary copy of each parsed targetIDs.txt (targetIDs.npz) for fast cold starts.
+_target_indexes = {}	# loc -> (targetIDs.txt modification time and size, {GRB: target IDs in file order})
+_target_lock = threading.Lock()
+
+
+def _read_target_index(filename):
+	"""
+	Parses targetIDs.txt into a dict of GRB name -> array of target IDs (in file order).
+
+	If persist_target_index is set, the parsed columns are also saved to targetIDs.npz next to the
+	text file and read from there on later cold starts, as long as the text file has not changed since.
+	"""
+	stat = os.stat(filename)
+	npzfile = os.path.splitext(filename)[0]+'.npz'
+	GRBs = None
+	if persist_target_index and os.path.exists(npzfile):
+		with np.load(npzfile) as cached:
+			if cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+				GRBs, tIDs = cached['GRB'], cached['targetID']
+	if GRBs is None:
+		with open(filename, 'r') as f:
+			rows = [line.split('\t') for line in f.read().splitlines()[1:] if line.strip()]
+		GRBs = np.array([row[0].strip() for row in rows])
+		tIDs = np.array([int(row[1]) for row in rows], dtype=int)
+		if persist_target_index:
+			np.savez(npzfile, GRB=GRBs, targetID=tIDs, mtime=stat.st_mtime_ns, size=stat.st_size)
+	
+	# Group the target IDs of each GRB, keeping their order in the file.
+	order = np.argsort(GRBs, kind='stable')
+	names, starts = np.unique(GRBs[order], return_index=True)
+	groups = np.split(tIDs[order], starts[1:])
+	return (stat.st_mtime_ns, stat.st_size), dict(zip(names.tolist(), groups))
+
+
+def target_index(loc):
+	"""
+	Returns the GRB -> target IDs lookup of loc+'targetIDs.txt'.
+
+	The file is parsed once per loc and re-parsed only when its modification time or size changes.
+
+	Args:
+		loc (str): The location of targetIDs.txt (see get_targetIDs).
+
+	Returns:
+		dict : {GRB name: numpy array of its target IDs, in file order}
+	"""
+	filename = loc+'targetIDs.txt'
+	stat = os.stat(filename)
+	with _target_lock:
+		cached = _target_indexes.get(loc)
+		if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+			cached = _read_target_index(filename)
+			_target_indexes[loc] = cached
+	return cached[1]
+
+
+def lookup_targetIDs(GRB, loc):
+	"""
+	Returns the sorted unique target IDs of a GRB (an empty array if it is not listed), see target_index.
+	"""
+	return np.unique(target_index(loc).get(GRB, np.array([], dtype=int)))
+
+
+def get_xrt(GRB,loc, uselocal=True,keep=False,cache=None):
 	"""
 	Retrieves the XRT 0.3 - 10keV flux light curves for a given GRB.
 
@@ -51,10 +445,12 @@ def get_xrt(GRB,loc, uselocal=True,keep=False):
 		GRB (str): The name of the GRB, e.g. '060614'.
 		uselocal (bool, optional): If True, checks for a locally saved version of the data file before attempting the download. Defaults to True.
 		keep (bool, optional): If True, saves the data locally after use. Defaults to False.
+		cache (ProductCache, optional): If given, the download is only repeated when UKSSDC has changed the data. Defaults to None.
 	
 	Returns:
 		data (astropy.table.Table): Lightcuve data containing columns - 'time','tpos','tneg','flux','fpos','fneg'
 	"""
+	from astropy.io import ascii
 
 	if uselocal == True:
 		try:
@@ -64,62 +460,85 @@ def get_xrt(GRB,loc, uselocal=True,keep=False):
 		except FileNotFoundError:
 			pass
 
-	base = 'https://www.swift.ac.uk/xrt_curves/'
+	base = SWIFT_URL+'xrt_curves/'
 	
-	IDs = ascii.read(loc+'targetIDs.txt')
 	#tID = str("{:08d}".format(IDs['targetID'][np.where(IDs['GRB'] == GRB)][0]))
-	tIDs = np.unique(IDs['targetID'][np.where(IDs['GRB'] == GRB)])
+	tIDs = lookup_targetIDs(GRB, loc)
 	if len(tIDs) == 0:
 		return -888.
 
 	for tID in tIDs:
 		url = base+str("{:08d}".format(tID))+'/flux.qdp'
 		try:
-			with urllib.request.urlopen(url) as f:
-				string = f.read().decode('utf-8').splitlines()
+			data, changed = _fetch_product(cache, (GRB, int(tID), 'xrt'), url, _parse_flux_qdp)
 		except HTTPError:
-			string = -404.	# Webpage not found
+			data = -404.	# Webpage not found
 			print("Webpage not found")
 			continue
-		if string[0][0] == '<':
-			string = -999.	# Webpage exists but data file does not.
+		except LookupError:
+			data = -999.	# Webpage exists but data file does not.
 			print("Webpage exists but data file does not")
 			continue
 		break	# If data is found for a target ID, end the loop.
 	
-	if string == -404. or string == -999.:
-		return string
-	
-	Time = []
-	Tpos = []
-	Tneg = []
-	Flux = []
-	Fpos = []
-	Fneg = []
-	
-	for line in string:
-		if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0] != '!Time':
-			Time = np.append(Time,float(line.split()[0]))
-			Tpos = np.append(Tpos,float(line.split()[1]))
-			Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
-			Flux = np.append(Flux,float(line.split()[3]))
-			Fpos = np.append(Fpos,float(line.split()[4]))
-			Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
-		
-	data = Table([Time,Tpos,Tneg,Flux,Fpos,Fneg],names=('time','tpos','tneg','flux','fpos','fneg'))
-	data.sort('time')
+	if np.isscalar(data):
+		return data
+	
+	data = _qdp_table(data)
 	
 	if keep == True:
 		if not os.path.exists(loc):
 			os.mkdir(loc)
 		# if not os.path.exists(loc+GRB+'/xray'):
 		# 	os.mkdir(loc+GRB+'/xray')
-		data.write(loc+GRB+'_xray_flux.txt',format='csv',delimiter='\t',overwrite=True)
+		_write_table(data, loc+GRB+'_xray_flux.txt')
 
 	return data
 	
 	
-def get_batxrt(GRB, loc, snr='4', band='XRT', evolving=False, spec=False, uselocal=True, keep=False):
+def update_xrt(GRB, loc, cache=None):
+	"""
+	Brings the locally saved XRT light curve of a GRB (loc+GRB+'_xray_flux.txt', as saved by get_xrt with keep=True) up to date.
+
+	The light curve is downloaded again (cheaply, if cache is given) and only the rows later than the last
+	saved one are appended to the saved table, which is rewritten atomically when rows were added.
+
+	Args:
+		GRB (str): The name of the GRB, e.g. '060614'.
+		loc (str): The location of targetIDs.txt and of the saved light curve.
+		cache (ProductCache, optional): Passed on to get_xrt. Defaults to None.
+
+	Returns:
+		tuple : (data, new) with the updated astropy.table.Table and a boolean array marking the rows added by this call,
+		or (error code, None) if get_xrt returned one.
+	"""
+	from astropy.io import ascii
+	from astropy.table import vstack
+	latest = get_xrt(GRB, loc, uselocal=False, cache=cache)
+	if np.isscalar(latest):
+		return latest, None
+	
+	filename = loc+GRB+'_xray_flux.txt'
+	try:
+		saved = ascii.read(filename)
+	except FileNotFoundError:
+		saved = None
+	if saved is None or len(saved) == 0:
+		data = latest
+		new = np.ones(len(data), dtype=bool)
+	else:
+		latest = latest[latest['time'] > np.max(saved['time'])]
+		data = vstack([saved, latest])
+		new = np.arange(len(data)) >= len(saved)
+	
+	if np.any(new):
+		if not os.path.exists(loc):
+			os.mkdir(loc)
+		_write_table(data, filename)
+	return data, new
+	
+	
+def get_batxrt(GRB, loc, snr='4', band='XRT', evolving=False, spec=False, uselocal=True, keep=False, cache=None):
 	"""
 	Retrieves data for a specific GRB (Gamma-Ray Burst) from the Swift Burst Analyser website.
 
@@ -132,10 +551,13 @@ def get_batxrt(GRB, loc, snr='4', band='XRT', evolving=False, spec=False, useloc
 	- spec (bool, optional): Whether to retrieve spectral data. Default is False.
 	- uselocal (bool, optional): Whether to use local files if available. Default is True.
 	- keep (bool, optional): Whether to keep the downloaded data. Default is False.
+	- cache (ProductCache, optional): If given, the download is only repeated when UKSSDC has changed the data,
+	  and the saved table is only rewritten when it changed. Not used with keep, which needs the whole tarball. Default is None.
 
 	Returns:
 	- data (astropy.table.Table): The retrieved data in the form of an astropy table.
 	"""
+	from astropy.io import ascii
 	
 	if uselocal == True:
 		try:
@@ -148,143 +570,81 @@ def get_batxrt(GRB, loc, snr='4', band='XRT', evolving=False, spec=False, useloc
 		except FileNotFoundError:
 			pass
 	
-	cwd = os.getcwd()	# Record the current working directory to return to later
-	
-	base = 'https://www.swift.ac.uk/burst_analyser/'	# Base of the UKSSDC url
+	base = SWIFT_URL+'burst_analyser/'	# Base of the UKSSDC url
 	
 	# Find the target ID for the desired GRB (required for the url and navigating the directories)
-	IDs = ascii.read(loc+'targetIDs.txt')
 	#tID = str("{:08d}".format(IDs['targetID'][np.where(IDs['GRB'] == GRB)][0]))
-	tIDs = np.unique(IDs['targetID'][np.where(IDs['GRB'] == GRB)])
+	tIDs = lookup_targetIDs(GRB, loc)
+	
+	# Fill in the filename gaps to get the requested file based on the optional keywords given.
+	if evolving == False:
+		batevolve = '_NOEVOLVE'
+		xrtevolve = '_nosys'
+	else:
+		batevolve = ''
+		xrtevolve = ''
 	
-	# Create a temporary folder if none exists in the selected location.
-	if not os.path.exists(loc+'temp'):
-		os.mkdir(loc+'temp')
+	# Names of the BAT, WT and PC files inside the tarball (below the target ID directory)
+	batfile = '/bat/bat_flux_snr'+str(snr)+'_'+band+'BAND'+batevolve+'.qdp'
+	wtfile = '/xrt/xrt_flux_wt_'+band+'BAND'+xrtevolve+'.qdp'
+	pcfile = '/xrt/xrt_flux_pc_'+band+'BAND'+xrtevolve+'.qdp'
 	
+	if spec == True:
+		batfile = '/bat/bat_gamma_snr'+str(snr)+'_'+band+'BAND.qdp'
+		wtfile = '/xrt/xrt_gamma_wt.qdp'
+		pcfile = '/xrt/xrt_gamma_pc.qdp'
+	
+	def parse(body):
+		# Read elements from the BAT, WT and PC files straight out of the tarball, in memory.
+		with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+			data = _read_tar_qdp(tar, [('BAT', tID+batfile), ('WT', tID+wtfile), ('PC', tID+pcfile)], GRB)
+			# Option to save the whole download.
+			if keep == True:
+				if os.path.exists(loc+GRB+'/'+tID):
+					print(tID+' directory already exists for GRB '+GRB+'. This was not overwritten.')
+				else:
+					_extract_tar(tar, loc+GRB)
+		return data
+	
+	# Download the data tarball; nothing is written to a temporary folder.
+	tID = -404.
 	for line in tIDs:
 		url = base+str("{:08d}".format(line))+'/batxrtfiles_'+str("{:08d}".format(line))+'.tar'
+		key = (GRB, int(line), 'spec' if spec == True else 'batxrt', str(snr), band, bool(evolving))
 		try:
-			urllib.request.urlretrieve(url,loc+'temp/download.tar')
 			tID = str("{:08d}".format(line))
+			data, changed = _fetch_product(None if keep == True else cache, key, url, parse)
 		except HTTPError:
 			tID = -404.	# Webpage not found
 			continue	# Continue cycles the loop without triggering the 'break' clause.
+		except LookupError:
+			tID = -999.	# Tarball exists but holds none of the data files.
+			print("Tarball exists but holds none of the data files")
+			continue
 		break	# If data is found for a target ID, end the loop.
 	
-	if tID == -404.:
+	if tID in (-404., -999.):
 		return tID
 	
 	#url = base+tID+'/batxrtfiles_'+tID+'.tar'
-
-	# Download and unpack the data tarball	
-	#try:
-	#	urllib.request.urlretrieve(url,loc+'temp/download.tar')
-	#except HTTPError:
-	#	return -404.
-	
-	os.chdir(loc+'temp')
-	stdout = os.system('tar -xf download.tar')
-	
-	# Fill in the filename gaps to get the requested file based on the optional keywords given.
-	if evolving == False:
-		batevolve = '_NOEVOLVE'
-		xrtevolve = '_nosys'
-	else:
-		batevolve = ''
-		xrtevolve = ''
-	
-	# Append BAT, WT and PC files to directory paths
-	batfile = loc+'temp/'+tID+'/bat/bat_flux_snr'+str(snr)+'_'+band+'BAND'+batevolve+'.qdp'
-	wtfile = loc+'temp/'+tID+'/xrt/xrt_flux_wt_'+band+'BAND'+xrtevolve+'.qdp'
-	pcfile = loc+'temp/'+tID+'/xrt/xrt_flux_pc_'+band+'BAND'+xrtevolve+'.qdp'
-	
-	if spec == True:
-		batfile = loc+'temp/'+tID+'/bat/bat_gamma_snr'+str(snr)+'_'+band+'BAND.qdp'
-		wtfile = loc+'temp/'+tID+'/xrt/xrt_gamma_wt.qdp'
-		pcfile = loc+'temp/'+tID+'/xrt/xrt_gamma_pc.qdp'
-		
-	Time = []
-	Tpos = []
-	Tneg = []
-	Flux = []
-	Fpos = []
-	Fneg = []
-	
-	# Read elements from BAT file
-	try:
-		with open(batfile, 'r') as string:
-			for line in string:
-				if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0][0] != '!':
-					Time = np.append(Time,float(line.split()[0]))
-					Tpos = np.append(Tpos,float(line.split()[1]))
-					Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
-					Flux = np.append(Flux,float(line.split()[3]))
-					Fpos = np.append(Fpos,float(line.split()[4]))
-					Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
-			if max(Flux) == 0.:
-				print('WARNING: the maximum BAT flux in this file = 0. This can often be solved by re-running swift_scrape with the keyword evolving = True.')
-	except FileNotFoundError:	# Pass if there is no BAT file
-		print('No BAT file found for '+GRB)
-	
-	# Read elements from WT file			
-	try:
-		with open(wtfile, 'r') as string:
-			for line in string:
-				if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0][0] != '!':
-					Time = np.append(Time,float(line.split()[0]))
-					Tpos = np.append(Tpos,float(line.split()[1]))
-					Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
-					Flux = np.append(Flux,float(line.split()[3]))
-					Fpos = np.append(Fpos,float(line.split()[4]))
-					Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
-	except FileNotFoundError:	# Pass if there is no WT file
-		print('No WT file found for '+GRB)
-	
-	# Read elements from PC file			
-	try:
-		with open(pcfile, 'r') as string:
-			for line in string:
-				if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0][0] != '!':
-					Time = np.append(Time,float(line.split()[0]))
-					Tpos = np.append(Tpos,float(line.split()[1]))
-					Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
-					Flux = np.append(Flux,float(line.split()[3]))
-					Fpos = np.append(Fpos,float(line.split()[4]))
-					Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
-	except FileNotFoundError:	# Pass if there is no PC file
-		print('No PC file found for '+GRB)
 	
 	# Organise in an astropy table and sort by time.
 	if spec == True:
-		data = Table([Time,Tpos,Tneg,Flux,Fpos/1.645,Fneg/1.645],names=('time','tpos','tneg','gamma','gpos','gneg'))
+		data['fpos'] /= 1.645
+		data['fneg'] /= 1.645
+		data = _qdp_table(data, names=('time','tpos','tneg','gamma','gpos','gneg'))
 	else:
-		data = Table([Time,Tpos,Tneg,Flux,Fpos,Fneg],names=('time','tpos','tneg','flux','fpos','fneg'))
-	data.sort('time')
+		data = _qdp_table(data)
 	if not os.path.exists(loc):
 			os.mkdir(loc)
-	if spec == True:
-		data.write(loc+GRB+'_xray_spec.txt',format='csv',delimiter='\t',overwrite=True)
-	else:
-		data.write(loc+GRB+'_xray_batxrt.txt',format='csv',delimiter='\t',overwrite=True)
-	
-	# Option to save the whole download.
-	if keep == True:
-		try:
-			os.rename(loc+'temp/'+tID, loc+GRB+'/'+tID)
-		except OSError:
-			print(tID+' directory already exists for GRB '+GRB+'. This was not overwritten.')
-	
-	# Remove temporary directory
-	os.chdir(loc)
-	stdout = os.system('rm -Rf temp')
-	
-	# Go back to initial working directory
-	os.chdir(cwd)
+	outfile = loc+GRB+('_xray_spec.txt' if spec == True else '_xray_batxrt.txt')
+	if changed or not os.path.exists(outfile):
+		_write_table(data, outfile)
 	
 	return data
 	
 
-def get_xrtdense(GRB, loc, uselocal=True,keep=False):
+def get_xrtdense(GRB, loc, uselocal=True,keep=False,cache=None):
 	"""
 	Retrieves the 1keV BAT+XRT flux density light curves from the UKSSDC (in Jy). SNR = 4, no spectral evolution.
 	
@@ -292,10 +652,12 @@ def get_xrtdense(GRB, loc, uselocal=True,keep=False):
 		GRB (str): The name of the GRB, e.g. '060614'.
 		uselocal (bool, optional): If True, checks for a locally saved version of the data file before attempting the download. Defaults to True.
 		keep (bool, optional): If True, saves the data locally after use. Defaults to False.
+		cache (ProductCache, optional): If given, the download is only repeated when UKSSDC has changed the data. Defaults to None.
 
 	Returns:
 		data (astropy.table.Table): Lightcuve data containing columns - 'time','tpos','tneg','flux','fpos','fneg'
 	"""
+	from astropy.io import ascii
 	
 	if uselocal == True:
 		try:
@@ -304,67 +666,27 @@ def get_xrtdense(GRB, loc, uselocal=True,keep=False):
 		except FileNotFoundError:
 			print('No local file found for '+GRB+'. Downloading from the UKSSDC.')
 	
-	cwd = os.getcwd()	# Record the current working directory to return to later
-	
-	base = 'https://www.swift.ac.uk/burst_analyser/'	# Base of the UKSSDC url
+	base = SWIFT_URL+'burst_analyser/'	# Base of the UKSSDC url
 	
 	# Find the target ID for the desired GRB (required for the url and navigating the directories)
-	IDs = ascii.read(loc+'targetIDs.txt')
-	tID = str("{:08d}".format(IDs['targetID'][np.where(IDs['GRB'] == GRB)][0]))
+	tID = str("{:08d}".format(target_index(loc).get(GRB, [])[0]))
 	
 	url = base+tID+'/batxrtfiles_'+tID+'.tar'
 	
-	# Create a temporary folder if none exists in the selected location.
-	if not os.path.exists(loc+'temp'):
-		os.mkdir(loc+'temp')
+	# Names of the WT and PC files inside the tarball
+	wtfile = tID+'/xrt/xrt_flux_wt_OBSDENSITY_nosys.qdp'
+	pcfile = tID+'/xrt/xrt_flux_pc_OBSDENSITY_nosys.qdp'
 	
-	# Download and unpack the data tarball	
-	urllib.request.urlretrieve(url,loc+'temp/download.tar')
-	os.chdir(loc+'temp')
-	stdout = os.system('tar -xf download.tar')
-
-	# Append WT and PC files to directory paths
-	wtfile = loc+'temp/'+tID+'/xrt/xrt_flux_wt_OBSDENSITY_nosys.qdp'
-	pcfile = loc+'temp/'+tID+'/xrt/xrt_flux_pc_OBSDENSITY_nosys.qdp'
-		
-	Time = []
-	Tpos = []
-	Tneg = []
-	Flux = []
-	Fpos = []
-	Fneg = []
-	
-	# Read elements from WT file			
-	try:
-		with open(wtfile, 'r') as string:
-			for line in string:
-				if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0][0] != '!':
-					Time = np.append(Time,float(line.split()[0]))
-					Tpos = np.append(Tpos,float(line.split()[1]))
-					Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
-					Flux = np.append(Flux,float(line.split()[3]))
-					Fpos = np.append(Fpos,float(line.split()[4]))
-					Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
-	except FileNotFoundError:	# Pass if there is no WT file
-		print('No WT file found for '+GRB)
-	
-	# Read elements from PC file			
-	try:
-		with open(pcfile, 'r') as string:
-			for line in string:
-				if len(line.split()) == 6 and line.split()[0] != 'NO' and line.split()[0][0] != '!':
-					Time = np.append(Time,float(line.split()[0]))
-					Tpos = np.append(Tpos,float(line.split()[1]))
-					Tneg = np.append(Tneg,np.sqrt(float(line.split()[2])**2.))
-					Flux = np.append(Flux,float(line.split()[3]))
-					Fpos = np.append(Fpos,float(line.split()[4]))
-					Fneg = np.append(Fneg,np.sqrt(float(line.split()[5])**2.))
-	except FileNotFoundError:	# Pass if there is no PC file
-		print('No PC file found for '+GRB)
+	def parse(body):
+		# Read elements from the WT and PC files straight out of the tarball, in memory.
+		with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+			return _read_tar_qdp(tar, [('WT', wtfile), ('PC', pcfile)], GRB)
+	
+	# Download the data tarball; nothing is written to a temporary folder.
+	data, changed = _fetch_product(cache, (GRB, int(tID), 'xrtdense'), url, parse)
 	
 	# Organise in an astropy table and sort by time.
-	data = Table([Time,Tpos,Tneg,Flux,Fpos,Fneg],names=('time','tpos','tneg','flux','fpos','fneg'))
-	data.sort('time')
+	data = _qdp_table(data)
 
 	# Option to save the flux density file.
 	if keep == True:
@@ -372,31 +694,34 @@ def get_xrtdense(GRB, loc, uselocal=True,keep=False):
 			os.mkdir(loc+GRB)
 		if not os.path.exists(loc+GRB+'/xray'):
 			os.mkdir(loc+GRB+'/xray')
-		data.write(loc+GRB+'/xray/flux_density.txt',format='csv',delimiter='\t',overwrite=True)
-	
-	# Remove temporary directory
-	os.chdir(loc)
-	stdout = os.system('rm -Rf temp')
-	
-	# Go back to initial working directory	
-	os.chdir(cwd)
+		_write_table(data, loc+GRB+'/xray/flux_density.txt')
 	
 	return data
 	
 	
-def t90(GRB):
+def _default_loc():
+	"""
+	Returns the module-level loc set by the user (swift_scrape.loc = ...), for functions called without one.
+	"""
+	try:
+		return globals()['loc']
+	except KeyError:
+		raise ValueError('No loc given: pass the directory of targetIDs.txt as loc, or set swift_scrape.loc') from None
+
+
+def t90(GRB, loc=None):
 	
-	base = "https://gcn.gsfc.nasa.gov/notices_s/"
-	IDs = ascii.read(loc+'targetIDs.txt')
+	if loc is None:
+		loc = _default_loc()
+	base = GCN_URL+"notices_s/"
 	
 	#tID = str("{:06d}".format(IDs['targetID'][np.where(IDs['GRB'] == GRB)][0]))
-	tIDs = np.unique(IDs['targetID'][np.where(IDs['GRB'] == GRB)])
+	tIDs = lookup_targetIDs(GRB, loc)
 
 	for line in tIDs:
 		url = base+str("{:06d}".format(line))+'/BA/'
 		try:
-			with urllib.request.urlopen(url) as f:
-				string = f.read().decode('utf-8').splitlines()
+			string = _read_url(url)
 			tID = str("{:06d}".format(line))
 		except HTTPError:
 			tID = -404., -404.	# Webpage not found
@@ -423,17 +748,17 @@ def t90(GRB):
 	return -999., -999.	# T90 not found.
 	
 	
-def find_pho(GRB):	# Scrapes the UKSSDC automatic spectrum fits and returns the last value of photon index (intended to be the late-time photon counting mode fit).
+def find_pho(GRB, loc=None):	# Scrapes the UKSSDC automatic spectrum fits and returns the last value of photon index (intended to be the late-time photon counting mode fit).
 
-	IDs = ascii.read(loc+'targetIDs.txt')
-	tIDs = np.unique(IDs['targetID'][np.where(IDs['GRB'] == GRB)])
-	base = 'https://www.swift.ac.uk/xrt_spectra/'
+	if loc is None:
+		loc = _default_loc()
+	tIDs = lookup_targetIDs(GRB, loc)
+	base = SWIFT_URL+'xrt_spectra/'
 	
 	for tID in tIDs:
 		url = base+str("{:08d}".format(tID))+'/'
 		try:
-			with urllib.request.urlopen(url) as f:
-				string = f.read().decode('utf-8').splitlines()
+			string = _read_url(url)
 		except HTTPError:
 			string = -404.	# Webpage not found
 			continue
@@ -455,3 +780,42 @@ def find_pho(GRB):	# Scrapes the UKSSDC automatic spectrum fits and returns the
 
 	return float(pho), phopos, phoneg
 
+
+PRODUCTS = {'xrt': get_xrt, 'batxrt': get_batxrt, 'xrtdense': get_xrtdense, 't90': t90, 'pho': find_pho}
+
+
+def fetch_many(GRBs, loc, products=('xrt',), max_workers=8, product_kws=None, cache=None):
+	"""
+	Retrieves several products for many GRBs concurrently, on a pool of threads sharing the module's HTTPClient.
+
+	Args:
+		GRBs (list of str): The names of the GRBs.
+		loc (str): The location of targetIDs.txt and of any saved files.
+		products (list of str, optional): Any of 'xrt', 'batxrt', 'xrtdense', 't90' and 'pho' (see PRODUCTS).
+		max_workers (int, optional): Number of concurrent downloads. Defaults to 8.
+		product_kws (dict, optional): Extra keyword arguments per product, e.g. {'batxrt': {'snr': '5'}}.
+		cache (ProductCache, optional): Cache passed on to the 'xrt', 'batxrt' and 'xrtdense' products. Defaults to None.
+
+	Returns:
+		dict : {GRB: {product: result of the corresponding function}}; a product whose retrieval
+		raised an exception maps to that exception instead.
+	"""
+	product_kws = product_kws or {}
+
+	def retrieve(GRB, product):
+		kws = dict(product_kws.get(product, {}))
+		if cache is not None and product in ('xrt', 'batxrt', 'xrtdense'):
+			kws.setdefault('cache', cache)
+		try:
+			return PRODUCTS[product](GRB, loc=loc, **kws)
+		except Exception as err:
+			return err
+
+	tasks = [(GRB, product) for GRB in GRBs for product in products]
+	with ThreadPoolExecutor(max_workers=max_workers) as pool:
+		results = list(pool.map(lambda task: retrieve(*task), tasks))
+
+	data = {GRB: {} for GRB in GRBs}
+	for (GRB, product), result in zip(tasks, results):
+		data[GRB][product] = result
+	return data
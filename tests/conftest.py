@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules live at the top of the repository, next to setup.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,23 @@
+import numpy as np
+import lmfit as lm
+import pytest
+import lc_lmfit
+
+
+@pytest.mark.parametrize("kind", ["residual", "parametric"])
+def test_bootstrap_samples_do_not_depend_on_the_pool(kind):
+    rng = np.random.default_rng(1)
+    x = np.sort(10**rng.uniform(1, 4, 60))
+    y_true = lc_lmfit.power_law(x, 1.3, 1e-10)
+    y_err = 0.1*y_true
+    args = (x, y_true + y_err*rng.standard_normal(len(x)), np.ones(len(x)), y_err)
+    params = lm.Parameters()
+    params.add("alpha_1", value=1.3)
+    params.add("amplitude", value=1e-10)
+    result = lm.minimize(lc_lmfit.cost_func_pl, params, args=args, method="least_squares")
+
+    serial = lc_lmfit.bootstrap(result, lc_lmfit.cost_func_pl, args, n_resamples=20, kind=kind, seed=7)[2]
+    chunked = lc_lmfit.bootstrap(result, lc_lmfit.cost_func_pl, args, n_resamples=20, kind=kind, seed=7, n_chunks=3)[2]
+    pooled = lc_lmfit.bootstrap(result, lc_lmfit.cost_func_pl, args, n_resamples=20, kind=kind, seed=7, processes=2)[2]
+    np.testing.assert_array_equal(serial, chunked)
+    np.testing.assert_array_equal(serial, pooled)
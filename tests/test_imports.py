@@ -0,0 +1,9 @@
+import pytest
+import benchmarks
+
+
+@pytest.mark.parametrize("module, budget", sorted(benchmarks.IMPORT_BUDGETS.items()))
+def test_cold_start_import_within_budget(module, budget):
+    rows, failed = benchmarks.check_imports(budgets={module: budget})
+    (_, seconds, _, heavy, flag), = rows
+    assert not failed, "import {} took {:.3f} s (budget {} s), heavy modules loaded: {}".format(module, seconds, budget, heavy)
@@ -0,0 +1,97 @@
+import numpy as np
+import lmfit as lm
+import pytest
+import lc_lmfit
+
+RTOL = 1e-7
+
+PL = dict(alpha_1=1.2, amplitude=1e-11)
+BPL = dict(t_break=500., alpha_1=0.2, alpha_2=1.8, amplitude=1e-11)
+DBL = dict(tb0=100., tb1=3e3, alpha_0=0.1, alpha_1=1.2, alpha_2=2.5, amplitude=1e-11)
+NBPL = dict(tb0=50., tb1=800., tb2=2e4, alpha_0=-0.3, alpha_1=0.4, alpha_2=1.5, alpha_3=2.8, amplitude=1e-11)
+
+MODELS = [(lc_lmfit.cost_func_pl, PL, ()), (lc_lmfit.cost_func_bpl, BPL, ()),
+          (lc_lmfit.cost_func_dbl, DBL, ()), (lc_lmfit.cost_func_nbpl, NBPL, (4,))]
+
+
+def make_params(values):
+    params = lm.Parameters()
+    for name, value in values.items():
+        params.add(name, value=value)
+    return params
+
+
+def finite_difference_jacobian(cost_func, params, args, kws, rel_step=1e-6):
+    columns = []
+    for name in [name for name, par in params.items() if par.vary]:
+        step = rel_step*abs(params[name].value)
+        upper, lower = params.copy(), params.copy()
+        upper[name].value += step
+        lower[name].value -= step
+        columns.append((cost_func(upper, *args, **kws) - cost_func(lower, *args, **kws))/(2*step))
+    return np.column_stack(columns)
+
+
+def assert_jacobian_close(jac, fd_jac):
+    # relative to the largest entry of every column, as the entries span many decades
+    scale = np.abs(fd_jac).max(axis=0)
+    assert np.max(np.abs(jac - fd_jac)/scale) < RTOL
+
+
+def curve(cost_func, values, extra, log, n_points=200, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.sort(10**rng.uniform(1, 5, n_points))
+    # the residuals of a zero flux with unit errors are the model itself
+    y_true = cost_func(make_params(values), x, np.zeros(n_points), np.ones(n_points), np.ones(n_points), *extra)
+    y_err = 0.1*y_true
+    y = y_true + y_err*rng.standard_normal(n_points)
+    if log:
+        return (np.log10(x), np.log10(y), np.ones(n_points), y_err/(y_true*np.log(10))) + extra
+    return (x, y, np.ones(n_points), y_err) + extra
+
+
+@pytest.mark.parametrize("log", [False, True])
+@pytest.mark.parametrize("cost_func, values, extra", MODELS, ids=lambda model: getattr(model, "__name__", None))
+def test_analytic_jacobian_matches_finite_differences(cost_func, values, extra, log):
+    params = make_params(values)
+    args = curve(cost_func, values, extra, log)
+    jac = lc_lmfit.JACOBIANS[cost_func](params, *args, log=log)
+    assert jac.shape == (len(args[0]), len(params))
+    assert_jacobian_close(jac, finite_difference_jacobian(cost_func, params, args, {"log": log}))
+
+
+@pytest.mark.parametrize("log", [False, True])
+def test_log_amplitude_jacobian_matches_finite_differences(log):
+    # the ladder and global fits vary log_amplitude, with amplitude = 10**log_amplitude
+    x = curve(lc_lmfit.cost_func_nbpl, NBPL, (4,), False)[0]
+    params = lc_lmfit._ladder_params(x, [NBPL["tb0"], NBPL["tb1"], NBPL["tb2"]],
+                                     [NBPL["alpha_"+str(i)] for i in range(4)], NBPL["amplitude"], (-5., 10.))
+    args = curve(lc_lmfit.cost_func_nbpl, NBPL, (4,), log)
+    jac = lc_lmfit.jac_func_nbpl(params, *args, log=log)
+    assert_jacobian_close(jac, finite_difference_jacobian(lc_lmfit.cost_func_nbpl, params, args, {"log": log}))
+
+
+def test_jacobian_skips_fixed_parameters():
+    params = make_params(BPL)
+    params["alpha_1"].vary = False
+    args = curve(lc_lmfit.cost_func_bpl, BPL, (), False)
+    jac = lc_lmfit.jac_func_bpl(params, *args)
+    full = lc_lmfit.jac_func_bpl(make_params(BPL), *args)
+    np.testing.assert_array_equal(jac, full[:, [0, 2, 3]])
+
+
+@pytest.mark.parametrize("log", [False, True])
+def test_population_jacobian_matches_finite_differences(log):
+    curves = [curve(lc_lmfit.cost_func_bpl, dict(BPL, t_break=t_break, alpha_2=alpha_2), (), log, n_points=40, seed=seed)
+              for seed, (t_break, alpha_2) in enumerate([(300., 1.6), (800., 2.), (2e3, 1.4)])]
+    model = lc_lmfit.PopulationBPL(curves, shared=("alpha_1",), hierarchical=("alpha_2",), tau={"alpha_2": 0.5}, log=log)
+    p = np.array([[np.log10(300.), 0.2, 1.6, -11.], [np.log10(800.), 0.2, 2., -11.1], [np.log10(2e3), 0.2, 1.4, -10.9]])
+    theta = model.pack(p, hyper=[1.7])
+    jac = model.jacobian(theta)
+    assert jac.shape == (len(model.residual(theta)), len(theta))
+    assert jac.nnz == model.sparsity().nnz
+
+    step = 1e-6*np.maximum(np.abs(theta), 1.)
+    fd_jac = np.column_stack([(model.residual(theta + dt) - model.residual(theta - dt))/(2*dt[i])
+                              for i, dt in enumerate(np.diag(step))])
+    assert_jacobian_close(jac.toarray(), fd_jac)
@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pytest
+import lc_lmfit
+from conftest import ROOT
+
+FXRT = os.path.join(ROOT, "analysis_notebooks", "fxrt", "data")
+
+
+def start_chisqr(result, args, n, log=False):
+    params = result.params.copy()
+    for name, value in result.init_values.items():
+        params[name].value = value
+    return np.sum(lc_lmfit.cost_func_nbpl(params, *args, n, log=log)**2)
+
+
+@pytest.mark.parametrize("name, window", [("FXRT_7", (-np.inf, np.inf)), ("FXRT_16", (1, 1e4)),
+                                          ("FXRT_19", (-np.inf, np.inf)), ("FXRT_22", (300, 1e7))])
+def test_ladder_steps_improve_on_their_warm_start(name, window):
+    # X-ray fluxes (~1e-13) must not be clamped to a bound before the first evaluation
+    data = lc_lmfit.fit_data(os.path.join(FXRT, name + "_LC_log.txt"), window=window, format="fxrt")
+    _, results = lc_lmfit.model_ladder(*data.args, max_n=4, patience=5)
+    for n, result in results.items():
+        assert result.chisqr <= start_chisqr(result, data.args, n)*(1 + 1e-9)
+
+
+@pytest.mark.parametrize("name, n", [("FXRT_7", 3), ("FXRT_16", 4)])
+def test_global_fit_polish_improves_on_its_start(name, n):
+    data = lc_lmfit.fit_data(os.path.join(FXRT, name + "_LC_log.txt"), format="fxrt")
+    _, results = lc_lmfit.global_fit(*data.args, n, top_k=3, n_grid=20)
+    for result in results:
+        assert result.chisqr <= start_chisqr(result, data.args, n)*(1 + 1e-9)
+
+
+def test_global_fit_stops_at_the_deadline():
+    data = lc_lmfit.fit_data(os.path.join(FXRT, "FXRT_16_LC_log.txt"), format="fxrt")
+    _, results = lc_lmfit.global_fit(*data.args, 3, top_k=2, n_grid=20, iter_cb=lambda *args, **kws: True)
+    assert all(result.aborted for result in results)
+
+
+@pytest.mark.parametrize("name", ["FXRT_10", "FXRT_16"])
+@pytest.mark.parametrize("log", [False, True])
+def test_global_fit_keeps_the_amplitude_positive(name, log):
+    # an unbounded linear amplitude stepped below zero on FXRT_10 (NaN from log10 in log space)
+    data = lc_lmfit.fit_data(os.path.join(FXRT, name + "_LC_log.txt"), format="fxrt", log=log)
+    table, results = lc_lmfit.global_fit(*data.args, 3, top_k=3, n_grid=20, log=log)
+    assert np.all(table["amplitude"] > 0)
+    for result in results:
+        assert result.params["amplitude"].value > 0
+        assert result.chisqr <= start_chisqr(result, data.args, 3, log)*(1 + 1e-9)
+
+
+def test_global_fit_leaves_out_candidates_without_a_positive_amplitude(monkeypatch):
+    polish = lc_lmfit._polish_candidate
+    calls = []
+
+    def underflowing_first(*args):
+        result = polish(*args)
+        if not calls:
+            result.params["log_amplitude"].value = -400.   # amplitude 0
+        calls.append(result)
+        return result
+
+    monkeypatch.setattr(lc_lmfit, "_polish_candidate", underflowing_first)
+    data = lc_lmfit.fit_data(os.path.join(FXRT, "FXRT_16_LC_log.txt"), format="fxrt")
+    table, results = lc_lmfit.global_fit(*data.args, 3, top_k=3, n_grid=20)
+    assert len(results) == len(table) == 2 and calls[0] not in results
+    assert np.all(table["amplitude"] > 0)
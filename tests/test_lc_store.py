@@ -0,0 +1,46 @@
+import glob
+import os
+import threading
+import numpy as np
+import pytest
+import lc_store
+
+
+def curves(seed, n_sources=3, n_rows=50):
+    rng = np.random.default_rng(seed)
+    return {"GRB%d" % i: tuple(rng.uniform(1, 10, (len(lc_store.COLUMNS), n_rows))) for i in range(n_sources)}
+
+
+def assert_store_holds(path, expected):
+    store = lc_store.LightCurveStore(path)
+    assert sorted(store) == sorted(expected)
+    for name, columns in expected.items():
+        np.testing.assert_array_equal(np.array(store[name]), np.array(columns))
+
+
+def test_concurrent_writers_leave_one_complete_store(tmp_path):
+    # every writer has its own temporary file, so the store is always one writer's complete output
+    path = str(tmp_path / "store.lcs")
+    written = [curves(seed) for seed in range(8)]
+    threads = [threading.Thread(target=lc_store.write_store, args=(path, c)) for c in written]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store = lc_store.LightCurveStore(path)
+    assert any(np.array_equal(np.array(store["GRB0"]), np.array(c["GRB0"])) for c in written)
+    assert os.listdir(tmp_path) == ["store.lcs"]
+
+
+def test_failed_write_keeps_the_previous_store(tmp_path, monkeypatch):
+    path = str(tmp_path / "store.lcs")
+    lc_store.write_store(path, curves(0))
+
+    def fail(src, dst):
+        raise OSError("disk full")
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "replace", fail)
+        with pytest.raises(OSError, match="disk full"):
+            lc_store.write_store(path, curves(1))
+    assert_store_holds(path, curves(0))
+    assert not glob.glob(str(tmp_path / "*.tmp"))
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import benchmarks
+import lc_lmfit
+
+LAWS = {
+    1: ([], [1.2]),
+    2: ([500.], [0.2, 1.8]),
+    3: ([100., 3e3], [0.1, 1.2, 2.5]),
+    4: ([50., 800., 2e4], [-0.3, 0.4, 1.5, 2.8]),
+}
+AMPLITUDE = 1e-11
+
+
+def times(breaks, n_points=200, seed=0):
+    # sorted, none of them on a break, with the last one above every break
+    x = np.sort(10**np.random.default_rng(seed).uniform(1, 5, n_points))
+    return x[~np.isin(x, breaks)]
+
+
+@pytest.mark.parametrize("n", LAWS)
+def test_nbroken_law_matches_the_previous_implementation(n):
+    breaks, alphas = LAWS[n]
+    x = times(breaks)
+    expected = benchmarks._nbroken_law_append(x, breaks, alphas, AMPLITUDE)
+    np.testing.assert_allclose(lc_lmfit.nbroken_law(x, breaks, alphas, AMPLITUDE), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("n", LAWS)
+def test_nbroken_law_is_continuous_on_the_breaks(n):
+    # the previous implementation returned a point on a break twice, once from either segment;
+    # both values agree, and nbroken_law returns it once
+    breaks, alphas = LAWS[n]
+    x = np.sort(np.concatenate([times(breaks), breaks]))
+    expected = benchmarks._nbroken_law_append(x, breaks, alphas, AMPLITUDE)
+    assert len(expected) == len(x) + len(breaks)
+    on_break = np.flatnonzero(np.isin(x, breaks))
+    duplicates = on_break + np.arange(1, len(breaks)+1)
+    np.testing.assert_allclose(expected[duplicates], expected[duplicates-1], rtol=1e-12)
+    np.testing.assert_allclose(lc_lmfit.nbroken_law(x, breaks, alphas, AMPLITUDE), np.delete(expected, duplicates), rtol=1e-12)
+
+
+@pytest.mark.parametrize("n", LAWS)
+def test_nbroken_law_follows_the_order_of_unsorted_x(n):
+    # the previous implementation returned the values in segment order whatever the order of x
+    breaks, alphas = LAWS[n]
+    x = np.concatenate([times(breaks), breaks])
+    x_unsorted = x[np.random.default_rng(1).permutation(len(x))]
+    order = np.argsort(x_unsorted)
+    expected = np.empty(len(x))
+    expected[order] = lc_lmfit.nbroken_law(x_unsorted[order], breaks, alphas, AMPLITUDE)
+    x_copy, breaks_copy = x_unsorted.copy(), list(breaks)
+    np.testing.assert_array_equal(lc_lmfit.nbroken_law(x_unsorted, breaks, alphas, AMPLITUDE), expected)
+    np.testing.assert_array_equal(x_unsorted, x_copy)
+    assert breaks == breaks_copy
+
+
+def test_nbroken_law_writes_into_out():
+    breaks, alphas = LAWS[4]
+    x = times(breaks)
+    out = np.empty(len(x))
+    assert lc_lmfit.nbroken_law(x, breaks, alphas, AMPLITUDE, out=out) is out
+    np.testing.assert_array_equal(out, lc_lmfit.nbroken_law(x, breaks, alphas, AMPLITUDE))
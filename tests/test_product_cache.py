@@ -0,0 +1,45 @@
+import os
+import numpy as np
+import swift_scrape
+
+
+class StubClient:
+    # answers every GET with the next of responses, recording the request headers
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+
+def parse(body):
+    return np.array([float(value) for value in body.split()])
+
+
+def test_not_modified_keeps_validators_and_payload(tmp_path, monkeypatch):
+    client = StubClient([(200, {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}, b'1 2 3'),
+                         (304, {}, b''), (304, {'ETag': '"v1"'}, b'')])
+    monkeypatch.setattr(swift_scrape, 'client', client)
+    cache = swift_scrape.ProductCache(str(tmp_path))
+    key, url = ('GRB', 'xrt'), 'http://example/flux.qdp'
+
+    data, changed = cache.fetch(key, url, parse)
+    assert changed and list(data) == [1., 2., 3.]
+    payload = os.stat(cache.path(key))
+
+    for _ in range(2):
+        data, changed = cache.fetch(key, url, parse)
+        assert not changed and list(data) == [1., 2., 3.]
+    # the second revalidation still sends the validators that the first 304 left out
+    assert client.requests[1] == client.requests[2] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    assert os.stat(cache.path(key)).st_ino == payload.st_ino
+
+
+def test_modified_product_is_parsed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(swift_scrape, 'client', StubClient([(200, {'ETag': '"v1"'}, b'1'), (200, {'ETag': '"v2"'}, b'2')]))
+    cache = swift_scrape.ProductCache(str(tmp_path))
+    cache.fetch('key', 'http://example/flux.qdp', parse)
+    data, changed = cache.fetch('key', 'http://example/flux.qdp', parse)
+    assert changed and list(data) == [2.]
@@ -0,0 +1,34 @@
+import csv
+import numpy as np
+import pytest
+import simulate
+
+
+def write_rows(path, rows, n=2):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=simulate.fieldnames(n))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def row(alpha_1, err_alpha_1, amplitude=1e-11, success=True):
+    values = {"tb0": 100., "alpha_0": 0.5, "alpha_1": 1.5, "amplitude": 1e-11}
+    result = {"realisation": 0, "template": "t", "n_points": 20, "success": success}
+    result.update({"true_"+name: value for name, value in values.items()})
+    result.update({"fit_"+name: value for name, value in values.items()})
+    result.update({"err_"+name: 0.1 for name in values})
+    result.update(fit_alpha_1=alpha_1, err_alpha_1=err_alpha_1, fit_amplitude=amplitude)
+    return result
+
+
+def test_recovery_summary_counts_only_finite_values(tmp_path):
+    path = str(tmp_path / "recovery.csv")
+    write_rows(path, [row(1.6, 0.2), row(1.3, 0.1), row(1.7, ""), row(2.5, 0.1, amplitude=-2.6e-18),
+                      row(2.5, 0.1, success=False)])
+    summary = simulate.recovery_summary(path, chunksize=2)
+    alpha = summary.loc["alpha_1"]
+    # the non-positive amplitude and the failed fit are left out; the missing error only from the coverage
+    assert alpha["n"] == 3
+    assert alpha["bias"] == pytest.approx((0.1 - 0.2 + 0.2)/3)
+    assert alpha["coverage"] == pytest.approx(0.5)
+    assert summary.loc["amplitude", "n"] == 3 and np.isfinite(summary.loc["amplitude", "bias"])
@@ -0,0 +1,213 @@
+import contextlib
+import glob
+import io
+import os
+import tarfile
+import threading
+from urllib.error import HTTPError
+import numpy as np
+import pytest
+import benchmarks
+import swift_scrape
+from conftest import ROOT
+
+AFTERGLOWS = sorted(glob.glob(os.path.join(ROOT, "analysis_notebooks", "EE_sGRB", "afterglow_data", "*_xray_batxrt.txt")))[:3]
+
+
+@pytest.fixture
+def stub():
+    # a local stand-in of swift.ac.uk serving the fixture files (see benchmarks.serve_fixtures)
+    files = benchmarks.fixture_files(AFTERGLOWS)
+    server, url = benchmarks.serve_fixtures(files)
+    yield server, url, files
+    server.shutdown()
+
+
+@pytest.fixture
+def scrape(stub, tmp_path, monkeypatch):
+    server, url, files = stub
+    monkeypatch.setattr(swift_scrape, "SWIFT_URL", url)
+    monkeypatch.setattr(swift_scrape, "client", swift_scrape.HTTPClient(backoff=0.01))
+    loc = str(tmp_path) + "/"
+    with contextlib.redirect_stdout(io.StringIO()):
+        swift_scrape.get_targetIDs(loc)
+    return server, loc
+
+
+def grb(filename):
+    return os.path.basename(filename).split("_")[0]
+
+
+def test_fetch_many_retrieves_every_product(scrape):
+    server, loc = scrape
+    GRBs = [grb(filename) for filename in AFTERGLOWS] + ["000000"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = swift_scrape.fetch_many(GRBs, loc, products=("xrt", "batxrt"), max_workers=4, product_kws={"batxrt": {"uselocal": False}})
+    for filename in AFTERGLOWS:
+        expected = np.loadtxt(filename, skiprows=1, ndmin=2)
+        xrt = data[grb(filename)]["xrt"]
+        np.testing.assert_allclose(np.asarray(xrt["time"]), expected[:, 0])
+        np.testing.assert_allclose(np.asarray(xrt["fneg"]), np.abs(expected[:, 5]))
+        assert len(data[grb(filename)]["batxrt"]) == len(expected)
+    assert data["000000"]["xrt"] == -888.    # not listed
+
+
+def test_server_errors_are_retried(stub):
+    server, url, files = stub
+    files["/flaky"] = [(503, {}, b""), (500, {}, b""), (200, {}, b"ok")]
+    status, _, body = swift_scrape.HTTPClient(backoff=0.01).get(url + "flaky")
+    assert (status, body) == (200, b"ok")
+    assert [path for path, _ in server.requests] == ["/flaky"]*3
+
+
+def test_retries_give_up_after_the_last_attempt(stub):
+    server, url, files = stub
+    files["/down"] = [(503, {}, b"")]
+    with pytest.raises(HTTPError) as error:
+        swift_scrape.HTTPClient(retries=2, backoff=0.01).get(url + "down")
+    assert error.value.code == 503 and len(server.requests) == 3
+
+
+def test_missing_page_is_not_retried(stub):
+    server, url, files = stub
+    with pytest.raises(HTTPError) as error:
+        swift_scrape.HTTPClient(backoff=0.01).get(url + "missing")
+    assert error.value.code == 404 and len(server.requests) == 1
+
+
+def test_too_many_requests_waits_for_retry_after(stub):
+    server, url, files = stub
+    files["/busy"] = [(429, {"Retry-After": "1"}, b""), (200, {}, b"ok")]
+    assert swift_scrape.HTTPClient(backoff=0.01).get(url + "busy")[2] == b"ok"
+    (_, first), (_, second) = server.requests
+    assert second - first >= 0.95
+
+
+def test_requests_to_one_host_are_spaced(stub):
+    server, url, files = stub
+    client = swift_scrape.HTTPClient(max_connections=4, min_interval=0.05)
+    threads = [threading.Thread(target=client.get, args=(url + "xrt_curves/grb.list",)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    times = sorted(t for _, t in server.requests)
+    assert len(times) == 6 and np.min(np.diff(times)) >= 0.04
+
+
+def test_missing_loc_is_explained(monkeypatch):
+    monkeypatch.delattr(swift_scrape, "loc", raising=False)
+    for function in (swift_scrape.t90, swift_scrape.find_pho):
+        with pytest.raises(ValueError, match="loc"):
+            function("060614")
+
+
+def tarball(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, rows in members.items():
+            content = "\n".join(benchmarks.qdp_lines(rows)).encode()
+            member = tarfile.TarInfo(name)
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+    buffer.seek(0)
+    return tarfile.open(fileobj=buffer)
+
+
+ROWS = np.array([[10., 1., -1., 2e-10, 1e-11, -1e-11], [20., 2., -2., 1e-10, 1e-11, -1e-11]])
+MEMBERS = [("BAT", "00012345/bat/bat_flux.qdp"), ("WT", "00012345/xrt/xrt_flux_wt.qdp"), ("PC", "00012345/xrt/xrt_flux_pc.qdp")]
+
+
+@pytest.mark.parametrize("prefix", ["", "./", "./batxrt/"])
+def test_tar_members_are_found_however_they_are_prefixed(prefix):
+    # exact names, a ./ prefix, and one more directory level all yield the three segments
+    with tarball({prefix + name: ROWS*(k+1) for k, (_, name) in enumerate(MEMBERS)}) as tar:
+        data = swift_scrape._read_tar_qdp(tar, MEMBERS, "GRB")
+    assert list(data["segment"]) == ["BAT"]*2 + ["WT"]*2 + ["PC"]*2
+    np.testing.assert_allclose(data["time"], [10., 20., 20., 40., 30., 60.])
+    np.testing.assert_allclose(data["fneg"], [1e-11, 1e-11, 2e-11, 2e-11, 3e-11, 3e-11])
+
+
+def test_tar_without_any_expected_member_raises():
+    with tarball({"00012345/other.qdp": ROWS}) as tar:
+        with pytest.raises(LookupError, match="GRB"):
+            swift_scrape._read_tar_qdp(tar, MEMBERS, "GRB")
+
+
+QDP = os.path.join(ROOT, "tests", "data", "060614_flux.qdp")
+
+
+def qdp_lines():
+    with open(QDP) as f:
+        return f.read().splitlines()
+
+
+def read_binary(filename):
+    with open(filename, "rb") as f:
+        return swift_scrape.read_qdp(f, "PC")
+
+
+READERS = {
+    "filename": lambda: swift_scrape.read_qdp(QDP, "PC"),
+    "lines": lambda: swift_scrape.read_qdp(qdp_lines(), "PC"),
+    "binary file": lambda: read_binary(QDP),
+    "download": lambda: swift_scrape._parse_flux_qdp("\n".join(qdp_lines()).encode()),
+}
+
+
+@pytest.mark.parametrize("source", READERS)
+def test_read_qdp_matches_the_previous_reader(source):
+    # a flux.qdp in the UKSSDC layout: READ lines, ! comments and headers, NO separators,
+    # negative T_-ve and Fluxneg columns and a 4-column upper limit
+    expected = benchmarks._read_qdp_append(qdp_lines())
+    data = READERS[source]()
+    assert len(data) == 85
+    for name, column in zip(swift_scrape.QDP_COLUMNS, expected):
+        np.testing.assert_array_equal(data[name], column, err_msg=name)
+    assert np.all(data["tneg"] > 0) and np.all(data["fneg"] > 0)
+
+
+def test_kept_light_curve_is_written_atomically(scrape, monkeypatch):
+    server, loc = scrape
+    GRB = grb(AFTERGLOWS[0])
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = swift_scrape.get_xrt(GRB, loc, uselocal=False, keep=True)
+        assert list(swift_scrape.get_xrt(GRB, loc)["flux"]) == list(data["flux"])
+
+    # a failed write leaves the previous file in place and no temporary file behind
+    def fail(table, target, **kwargs):
+        with open(target, "w") if isinstance(target, str) else contextlib.nullcontext(target) as f:
+            f.write("time\tflux\n")
+            raise OSError("disk full")
+    monkeypatch.setattr(type(data), "write", fail)
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(OSError, match="disk full"):
+        swift_scrape.get_xrt(GRB, loc, uselocal=False, keep=True)
+    assert not glob.glob(loc + "*.tmp")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert list(swift_scrape.get_xrt(GRB, loc)["flux"]) == list(data["flux"])
+
+
+def test_update_xrt_appends_new_rows_atomically(scrape, monkeypatch):
+    server, loc = scrape
+    GRB = grb(AFTERGLOWS[0])
+    filename = loc + GRB + "_xray_flux.txt"
+    with contextlib.redirect_stdout(io.StringIO()):
+        full = swift_scrape.get_xrt(GRB, loc, uselocal=False)
+    full[:10].write(filename, format="csv", delimiter="\t")
+
+    # a failed rewrite leaves the saved rows in place and no temporary file behind
+    def fail(table, target, **kwargs):
+        with open(target, "w") if isinstance(target, str) else contextlib.nullcontext(target) as f:
+            f.write("time\tflux\n")
+            raise OSError("disk full")
+    with monkeypatch.context() as patch:
+        patch.setattr(type(full), "write", fail)
+        with contextlib.redirect_stdout(io.StringIO()), pytest.raises(OSError, match="disk full"):
+            swift_scrape.update_xrt(GRB, loc)
+    assert not glob.glob(loc + "*.tmp")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert len(swift_scrape.get_xrt(GRB, loc)) == 10
+        data, new = swift_scrape.update_xrt(GRB, loc)
+    assert len(data) == len(full) and np.count_nonzero(new) == len(full) - 10
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert list(swift_scrape.get_xrt(GRB, loc)["flux"]) == list(full["flux"])